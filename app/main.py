@@ -1,39 +1,114 @@
-import os
-from fastapi import FastAPI, UploadFile, File, HTTPException, Body
-from modules import ocr, optimizer, openai_helper
+import os, json, shutil, asyncio, tarfile, zipfile
+from contextlib import asynccontextmanager
+from dotenv import load_dotenv
+
+# 加載 .env 檔案：須在 import modules 之前，各模組的 DATA_DIR 等設定於 import 時讀取
+load_dotenv()
+
+from fastapi import FastAPI, UploadFile, File, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import Response, StreamingResponse
+# optimizer（pymoo）在第一次優化請求時才載入，見 _optimizer()；pdfplumber / openai / scipy 亦由各模組延後載入
+from modules import ocr, openai_helper, gwp_cache, jobs, table_format, uploads, storage, transport, fronts, incremental, metrics, batch, uncertainty
 import pandas as pd
 from pathlib import Path
-from typing import List, Dict, Any
-from datetime import datetime
+from typing import List, Dict, Any, Optional
+
+# PREWARM：啟動時先載入 / 建立的項目（逗號分隔，或 all）；預設不預熱，第一次用到時才載入
+PREWARM_TARGETS = ("ocr", "optimizer", "llm", "epd")
+
+def _optimizer():
+    from modules import optimizer
+    return optimizer
+
+def prewarm(targets) -> None:
+    if "ocr" in targets:
+        import pdfplumber  # noqa: F401
+    if "optimizer" in targets:
+        _optimizer()
+    if "llm" in targets:
+        from modules import llm_backend, llm_engine
+        backend = llm_backend.get_backend()
+        if isinstance(backend, llm_backend.OpenAIBackend):
+            backend.client
+        llm_engine.get_engine()
+        gwp_cache.get_cache()
+    if "epd" in targets:
+        from modules import factor_index
+        factor_index.get_index()
 
-app = FastAPI(title="Carbon Procurement MVP")
+def _prewarm_targets() -> List[str]:
+    value = os.getenv("PREWARM", "").strip().lower()
+    if value in ("", "0"):
+        return []
+    if value in ("1", "all"):
+        return list(PREWARM_TARGETS)
+    targets = [t.strip() for t in value.split(",") if t.strip()]
+    unknown = set(targets) - set(PREWARM_TARGETS)
+    if unknown:
+        raise ValueError(f"未知的 PREWARM 項目：{', '.join(sorted(unknown))}")
+    return targets
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    targets = _prewarm_targets()
+    if targets:
+        with metrics.span("prewarm"):
+            await run_in_threadpool(prewarm, targets)
+    yield
+
+app = FastAPI(title="Carbon Procurement MVP", lifespan=lifespan)
+# 請求 / 各階段計時（GET /metrics）；SERVER_TIMING=0 關閉回應標頭，TRACE_LOG=1 逐請求輸出各階段耗時
+app.add_middleware(metrics.TimingMiddleware,
+                   server_timing=os.getenv("SERVER_TIMING", "1") != "0",
+                   trace_log=os.getenv("TRACE_LOG", "0") == "1")
 
 # 確保資料夾存在
 DATA_DIR = Path(os.getenv("DATA_DIR", "data"))
 DATA_DIR.mkdir(exist_ok=True, parents=True)
 
+# 表格類端點皆支援內容協商：Content-Type / Accept 為 application/vnd.apache.arrow.stream
+# 時以 Arrow IPC 傳輸，否則維持原本的 JSON records
+
+def _upload_response(request: Request, sha: str, df: pd.DataFrame,
+                     filename: str = '', cached: bool = False):
+    return transport.respond_table(
+        request, df,
+        sha256=sha, filename=filename, cached=cached,
+        path=str(uploads.parsed_path(sha)), rows=len(df),
+    )
+
 @app.post("/upload_pdf")
-async def upload_pdf(pdf: UploadFile = File(...)):
-    tmp = DATA_DIR / pdf.filename
-    with tmp.open("wb") as f:
-        f.write(await pdf.read())
+async def upload_pdf(request: Request, pdf: UploadFile = File(...), mode: str = "stream"):
+    # mode: stream（逐頁）或 process（多行程分頁平行，適合大型標案）
+    if mode not in ("stream", "process"):
+        raise HTTPException(status_code=400, detail=f"未知的解析模式：{mode}")
+    content = await pdf.read()
+    sha = uploads.content_hash(content)
+
+    # 同一份文件只解析一次
+    df = uploads.load_parsed(sha)
+    if df is not None:
+        return _upload_response(request, sha, df, pdf.filename, cached=True)
 
+    sha, path = uploads.store_pdf(content)
     try:
-        df = ocr.pdf_to_dataframe(tmp)
+        df = await run_in_threadpool(ocr.pdf_to_dataframe, path, mode)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"PDF 解析失敗：{e}")
 
-    csv_path = tmp.with_suffix(".csv")
-    df.to_csv(csv_path, index=False, encoding="utf-8-sig")
+    uploads.save_parsed(sha, df)
+    return _upload_response(request, sha, df, pdf.filename)
 
-    return {
-        "csv_path": str(csv_path),
-        "rows": len(df),
-        "csv_data": df.to_dict(orient="records")
-    }
+@app.get("/uploads/{sha}")
+async def get_upload(request: Request, sha: str):
+    """已解析過的文件可直接以 SHA-256 取回，不需重新上傳。"""
+    df = uploads.load_parsed(sha)
+    if df is None:
+        raise HTTPException(status_code=404, detail="此文件尚未上傳或解析")
+    return _upload_response(request, sha, df, cached=True)
 
-@app.post("/format_table")
-async def format_table(raw: dict = Body(...)):
+def _table_records(raw: Any, what: str) -> List[Dict[str, Any]]:
     # 取得 records
     if isinstance(raw, list):
         records = raw
@@ -42,43 +117,40 @@ async def format_table(raw: dict = Body(...)):
     elif isinstance(raw, dict) and 'data' in raw and isinstance(raw['data'], list):
         records = raw['data']
     else:
-        raise HTTPException(status_code=400, detail="Invalid JSON format for formatting")
+        raise HTTPException(status_code=400, detail=f"Invalid JSON format for {what}")
     if not records:
         raise HTTPException(status_code=400, detail="Empty data list")
+    return records
 
-    # 統一欄位名，並保留所有需要的欄位
-    main_cols = ['項次', '工程項目', '單位', '數量', '單價', '複價', '說明']
-    # 重新整理 mapping + 萃取欄位
-    df = pd.DataFrame(records)
-    df = df.reindex(columns=main_cols).fillna('')
-    # 過濾掉非明細的行
-    not_header = ~df['項次'].astype(str).str.contains('項次', na=False)
-    not_title = ~(
-        (df['項次'] == '') & (df['單位'] == '') & (df['數量'] == '') & (df['單價'] == '') &
-        (df['複價'] == '') & (df['說明'] == '') & (df['工程項目'] != '')
-    )
-    not_summary = ~(
-        df['工程項目'].astype(str).str.contains('小計|合計|subtotal|total', na=False) |
-        df['項次'].astype(str).str.contains('小計|合計|subtotal|total', na=False)
-    )
-    # 去除全空行
-    is_not_empty = ~(df == '').all(axis=1)
-    mask = not_header & not_title & not_summary & is_not_empty
-    df_clean = df[mask].reset_index(drop=True)
+@app.post("/format_table")
+async def format_table(request: Request):
+    df, _ = await transport.read_table(request, lambda raw: _table_records(raw, "formatting"))
+    # 統一欄位名並過濾掉非明細的行（表頭、段落標題、小計、全空行）
+    df_clean = table_format.clean_detail_rows(df)
 
     # 輸出資料結構（留著統一格式）
-    return {"csv_data": df_clean.to_dict(orient="records")}
+    return transport.respond_table(request, df_clean)
 
-@app.post("/fill_carbon_factors")
-async def fill_carbon_factors(raw: Any = Body(...)):
+@app.post("/align_table")
+async def align_table(request: Request):
+    """
+    將 /upload_pdf 的原始表格對齊主欄位並依段落標題分段（Dashboard「整理表格」）。
+    找不到段落標題時 csv_data 為 null（Arrow 模式回傳 204）。
+    """
+    df, _ = await transport.read_table(request, lambda raw: _table_records(raw, "alignment"))
+    merged = table_format.align_and_section(df)
+    if merged is None:
+        if transport.wants_arrow(request):
+            return Response(status_code=204)
+        return {"csv_data": None, "rows": 0}
+    return transport.respond_table(request, merged, rows=len(merged))
+
+def _fill_records(raw: Any) -> List[Dict[str, Any]]:
     if isinstance(raw, dict) and 'data' in raw and isinstance(raw['data'], list):
-        records = raw['data']
-    else:
-        raise HTTPException(status_code=400, detail="Invalid input")
-    df = pd.DataFrame(records)
-    from modules import openai_helper
-    df = openai_helper.fill_carbon_factors(df)
+        return raw['data']
+    raise HTTPException(status_code=400, detail="Invalid input")
 
+def _finish_fill(df: pd.DataFrame) -> pd.DataFrame:
     # **確保 gwp/qty 為數值型態**
     for col in ['gwp', 'qty']:
         if col not in df.columns:
@@ -87,23 +159,109 @@ async def fill_carbon_factors(raw: Any = Body(...)):
     df['qty'] = pd.to_numeric(df['qty'], errors='coerce').fillna(0)
 
     df['碳排放量'] = df['gwp'] * df['qty']
-    return {"csv_data": df.to_dict(orient="records")}
+    return df
+
+@app.post("/fill_carbon_factors")
+async def fill_carbon_factors(request: Request):
+    df, _ = await transport.read_table(request, _fill_records)
+    # 並行估算，不阻塞 event loop
+    df = await openai_helper.afill_carbon_factors(df)
+    return transport.respond_table(request, _finish_fill(df))
+
+# ---------------------------------------------------------------------
+# 可編輯的估碳表格：修改少數列時只重新估算 / 計算變動的列，合計以差額更新
+
+def _get_project(project_id: str) -> incremental.Project:
+    project = incremental.get_registry().get(project_id)
+    if project is None:
+        raise HTTPException(status_code=404, detail="找不到此表格，請重新建立")
+    return project
+
+def _project_response(request: Request, project: incremental.Project, result: Dict[str, Any]):
+    # 只回傳有變動的列，回應大小與變動列數成正比
+    return transport.respond_table(request, project.rows(result["changed"]),
+                                   **project.info(), **result)
+
+@app.post("/projects")
+async def create_project(request: Request):
+    """建立可編輯表格（格式同 /fill_carbon_factors），回傳 project_id、估碳後的表格與段落 / 全案合計。"""
+    df, _ = await transport.read_table(request, lambda raw: _table_records(raw, "project"))
+    project = incremental.get_registry().create()
+    result = await project.load(df)
+    return transport.respond_table(request, project.df, **project.info(), estimated=result["estimated"])
+
+@app.get("/projects/{project_id}")
+async def get_project(request: Request, project_id: str):
+    project = _get_project(project_id)
+    return transport.respond_table(request, project.df, **project.info())
+
+@app.get("/projects/{project_id}/totals")
+async def project_totals(project_id: str):
+    return _get_project(project_id).info()
+
+@app.put("/projects/{project_id}")
+async def sync_project(request: Request, project_id: str):
+    """整表重送：以列指紋比對，只處理內容有變動的列。"""
+    project = _get_project(project_id)
+    df, _ = await transport.read_table(request, lambda raw: _table_records(raw, "project"))
+    result = await project.load(df)
+    return _project_response(request, project, result)
+
+@app.patch("/projects/{project_id}")
+async def edit_project(request: Request, project_id: str):
+    """
+    修改指定列：{"updates": [{"row": 3, "數量": 12}, ...], "append": [{...}, ...]}。
+    只有估算欄位（項目、單位、數量級、說明）變動的列會重新估算 GWP，其餘只重算碳排量。
+    """
+    project = _get_project(project_id)
+    try:
+        body = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid JSON body")
+    if not isinstance(body, dict) or not isinstance(body.get("updates", []), list) \
+            or not isinstance(body.get("append", []), list):
+        raise HTTPException(status_code=400, detail="Invalid input")
+    try:
+        result = await project.edit(body.get("updates"), body.get("append"))
+    except IndexError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return _project_response(request, project, result)
+
+def _save_records(raw: Any) -> List[Dict[str, Any]]:
+    if isinstance(raw, dict) and isinstance(raw.get("data"), list):
+        return raw["data"]
+    raise HTTPException(status_code=400, detail="Invalid input or missing filename")
 
 @app.post("/save_csv")
-async def save_csv(raw: Any = Body(...)):
-    filename = os.path.splitext(os.path.basename(raw.get("filename", "")))[0]
-    data = raw.get("data")
-    if not filename or not isinstance(data, list):
+async def save_csv(request: Request):
+    # 名稱沿用舊介面；實際以固定 schema 的 Arrow 檔保存，CSV 改由 /tables/{name}/csv 匯出
+    # Arrow 模式下 filename 以 query string 傳入
+    df, params = await transport.read_table(request, _save_records)
+    filename = os.path.splitext(os.path.basename(params.get("filename") or ""))[0]
+    if not filename:
         raise HTTPException(status_code=400, detail="Invalid input or missing filename")
-    df = pd.DataFrame(data)
-    sorted_csv_name = f"{filename}_sorted.csv"
-    csv_path = DATA_DIR / sorted_csv_name
-    df = df.loc[:, ~df.columns.duplicated()]
-    df.to_csv(csv_path, index=False, encoding="utf-8-sig")
-    return {"csv_path": str(csv_path), "rows": len(df)}
+    name = f"{filename}_sorted"
+    path = storage.write_table(df, name)
+    return {"path": str(path), "name": name, "rows": len(df),
+            "csv_url": f"/tables/{name}/csv"}
 
-@app.post("/optimize", response_model=None)
-async def optimize(raw: Any = Body(...)):
+@app.get("/tables/{name}")
+async def get_table(request: Request, name: str):
+    df = storage.read_table(name)
+    if df is None:
+        raise HTTPException(status_code=404, detail="找不到此表格")
+    return transport.respond_table(request, df, name=name, rows=len(df))
+
+@app.get("/tables/{name}/csv")
+async def export_table_csv(name: str):
+    df = storage.read_table(name)
+    if df is None:
+        raise HTTPException(status_code=404, detail="找不到此表格")
+    body = df.to_csv(index=False).encode("utf-8-sig")
+    return Response(content=body, media_type="text/csv; charset=utf-8",
+                    headers={"Content-Disposition": f'attachment; filename="{name}.csv"'})
+
+def _optimize_records(raw: Any) -> List[Dict[str, Any]]:
     # 一律先走欄位標準化
     # 可以直接呼叫 format_table 的同名欄位 mapping
     if isinstance(raw, list):
@@ -126,9 +284,10 @@ async def optimize(raw: Any = Body(...)):
 
     if not records:
         raise HTTPException(status_code=400, detail="Empty data list")
+    return records
 
+def _optimize_frame(df: pd.DataFrame) -> pd.DataFrame:
     # 新增這段！直接複製你 /format_table 的欄位 rename
-    df = pd.DataFrame(records)
     df = df.rename(columns={
         '項次':'idx','工程項目':'item','Item':'item',
         '單位':'unit','Unit':'unit',
@@ -151,10 +310,235 @@ async def optimize(raw: Any = Body(...)):
     # 下面照原本繼續
     if 'gwp' not in df.columns:
         df['gwp'] = pd.NA
-    df = openai_helper.fill_carbon_factors(df)
+    return df
 
+def _optimize_engine(params: Dict[str, Any]) -> str:
+    engine = params.get("engine") or "auto"
+    engines = _optimizer().ENGINES
+    if engine not in engines:
+        raise HTTPException(status_code=400, detail=f"engine 必須為 {', '.join(engines)} 之一")
+    return engine
+
+def _carbon_quantile(params: Dict[str, Any]) -> Optional[float]:
+    q = _float_param(params, "carbon_quantile")
+    if q is not None and not 0 < q < 1:
+        raise HTTPException(status_code=400, detail="carbon_quantile 必須介於 0 與 1 之間（例如 0.9）")
+    return q
+
+def _optimize_df(df: pd.DataFrame, engine: str = "auto", carbon_quantile: Optional[float] = None):
     if 'eta' not in df.columns:
         df['eta'] = 0
+    return _optimizer().optimize_materials(df, engine=engine, carbon_quantile=carbon_quantile)
 
-    solutions = optimizer.optimize_materials(df)
+@app.post("/optimize", response_model=None)
+async def optimize(request: Request):
+    # engine：auto（預設，取捨項目少時窮舉精確前緣，否則 NSGA-II）、exact-enum、weighted-sum（近似）、nsga2
+    # carbon_quantile：例如 0.9 時以估算上下限下的 P90 碳排為目標（穩健優化），省略則為期望值
+    df, params = await transport.read_table(request, _optimize_records)
+    engine = _optimize_engine(params)
+    carbon_quantile = _carbon_quantile(params)
+    df = _optimize_frame(df)
+    df = await openai_helper.afill_carbon_factors(df)
+    # NSGA-II 為 CPU 密集，丟到執行緒池避免卡住 event loop
+    solutions = await run_in_threadpool(_optimize_df, df, engine, carbon_quantile)
     return {"solutions": solutions}
+
+@app.post("/uncertainty")
+async def carbon_uncertainty(request: Request):
+    """
+    碳排不確定性（格式同 /fill_carbon_factors，需已有 gwp，gwp_low / gwp_high 可省略）：
+    回傳各列 carbon_p10 / carbon_p50 / carbon_p90，以及全案與各段落（section 欄）總碳排的 mean / P10 / P50 / P90。
+    參數 samples（蒙地卡羅樣本數，預設 MC_SAMPLES 或 2000）、seed。
+    """
+    df, params = await transport.read_table(request, _fill_records)
+    samples = _float_param(params, "samples")
+    seed = _float_param(params, "seed")
+    if samples is not None and not 1 <= samples <= 100000:
+        raise HTTPException(status_code=400, detail="samples 必須介於 1 與 100000 之間")
+    groups = df['section'] if 'section' in df.columns else None
+    result = await run_in_threadpool(uncertainty.simulate, df,
+                                     int(samples) if samples else None,
+                                     int(seed) if seed is not None else None, groups)
+    rows = pd.concat([df, result["rows"]], axis=1)
+    return transport.respond_table(request, rows, samples=result["samples"],
+                                   total=result["total"], sections=result["sections"])
+
+def _float_param(params: Dict[str, Any], key: str) -> Optional[float]:
+    value = params.get(key)
+    if value in (None, ""):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail=f"{key} 必須為數字")
+
+@app.post("/optimize_choices")
+async def optimize_choices(request: Request):
+    """
+    多方案選擇：每列為某項目（group）的一個替代方案（option），
+    需有 cost 或 unit_price(+qty)、carbon 或 gwp(+qty)，lead_time 可省略。
+    參數 budget、max_lead_time（JSON body 或 query string），皆可省略。
+    """
+    df, params = await transport.read_table(request, lambda raw: _table_records(raw, "optimization"))
+    missing = [c for c in ('group', 'option') if c not in df.columns]
+    if not {'cost', 'unit_price'} & set(df.columns):
+        missing.append('cost')
+    if not {'carbon', 'gwp'} & set(df.columns):
+        missing.append('carbon')
+    if missing:
+        raise HTTPException(status_code=400, detail=f"缺少欄位：{', '.join(missing)}")
+    budget = _float_param(params, "budget")
+    max_lead_time = _float_param(params, "max_lead_time")
+    try:
+        return await run_in_threadpool(_optimizer().optimize_choices, df,
+                                       budget=budget, max_lead_time=max_lead_time)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/fronts/{front_id}")
+async def query_front(front_id: str, select: str = "crowding", k: int = Query(5, ge=1),
+                      max_cost: Optional[float] = None, max_carbon: Optional[float] = None,
+                      max_eta: Optional[float] = None):
+    """
+    查詢 /optimize 回傳的 front_id 所對應的 Pareto 前緣，不需重新優化。
+    select：knee（膝點）、crowding（擁擠距離前 k 個）、spread（依序取最遠者）、all；
+    max_cost / max_carbon / max_eta 先篩選再挑選。
+    """
+    cache = fronts.get_cache()
+    front = cache.get(front_id) if cache is not None else None
+    if front is None:
+        raise HTTPException(status_code=404, detail="找不到此前緣，請重新優化")
+    try:
+        return fronts.query(front, select=select, k=k, max_cost=max_cost,
+                            max_carbon=max_carbon, max_eta=max_eta)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# ---------------------------------------------------------------------
+# 背景工作：送出後立即回傳 job_id，再以 /jobs/{id}、/jobs/{id}/events 查詢進度
+
+# 工作結果若含 "table"（DataFrame），/jobs/{id}/result 會依 Accept 轉為 JSON 或 Arrow
+
+def _fill_job(df: pd.DataFrame):
+    def run(job: jobs.Job):
+        job.update(stage="estimate")
+        filled = openai_helper.fill_carbon_factors(df, progress=job.progress)
+        return {"table": _finish_fill(filled)}
+    return run
+
+def _optimize_job(df: pd.DataFrame, engine: str = "auto", carbon_quantile: Optional[float] = None):
+    def run(job: jobs.Job):
+        job.update(stage="estimate")
+        filled = openai_helper.fill_carbon_factors(_optimize_frame(df), progress=job.progress)
+        job.update(stage="optimize", done=0, total=1)
+        solutions = _optimize_df(filled, engine, carbon_quantile)
+        job.progress(1, 1)
+        return {"solutions": solutions}
+    return run
+
+@app.post("/jobs/fill_carbon_factors")
+async def submit_fill_carbon_factors(request: Request):
+    df, _ = await transport.read_table(request, _fill_records)
+    job = jobs.get_manager().submit("fill_carbon_factors", _fill_job(df))
+    return job.to_dict()
+
+@app.post("/jobs/optimize")
+async def submit_optimize(request: Request):
+    df, params = await transport.read_table(request, _optimize_records)
+    job = jobs.get_manager().submit("optimize", _optimize_job(df, _optimize_engine(params),
+                                                              _carbon_quantile(params)))
+    return job.to_dict()
+
+def _batch_job(files, name: str, optimize: bool):
+    def run(job: jobs.Job):
+        job.update(stage="batch")
+        result = asyncio.run(batch.run_batch(files, name=name, optimize=optimize, progress=job.progress))
+        # 逐檔摘要為結果表格；彙整後的明細另存為 /tables/{name}
+        return {"table": result.pop("summary"), **result,
+                "table_url": f"/tables/{name}", "csv_url": f"/tables/{name}/csv"}
+    return run
+
+@app.post("/batch")
+async def submit_batch(files: List[UploadFile] = File(...), optimize: bool = False,
+                       name: Optional[str] = None):
+    """
+    批次處理：上傳多個 PDF 或壓縮檔（zip / tar），背景依序解析、整理、估碳、存檔（optimize=true 時另做優化）。
+    回傳 job_id；完成後 /jobs/{id}/result 為逐檔摘要，彙整明細（含 source 欄）在 /tables/{name}。
+    """
+    name = batch.batch_name(name)
+    input_dir = batch.BATCH_DIR / name / "input"
+    sources = []
+    for n, upload in enumerate(files):
+        # 每個上傳檔放在各自的子目錄，保留原始檔名作為 source
+        filename = os.path.basename(upload.filename or "") or f"{n}.pdf"
+        path = input_dir / str(n) / filename
+        path.parent.mkdir(exist_ok=True, parents=True)
+        path.write_bytes(await upload.read())
+        sources.append(path)
+    try:
+        pdfs = await run_in_threadpool(batch.collect_pdfs, sources, input_dir)
+    except (ValueError, OSError, zipfile.BadZipFile, tarfile.TarError) as e:
+        shutil.rmtree(input_dir, ignore_errors=True)
+        raise HTTPException(status_code=400, detail=str(e))
+    job = jobs.get_manager().submit("batch", _batch_job(pdfs, name, optimize))
+    return {**job.to_dict(), "name": name, "files": len(pdfs)}
+
+def _get_job(job_id: str) -> jobs.Job:
+    job = jobs.get_manager().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="找不到此工作")
+    return job
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    return _get_job(job_id).to_dict()
+
+@app.get("/jobs/{job_id}/result")
+async def job_result(request: Request, job_id: str):
+    job = _get_job(job_id)
+    if job.status == jobs.FAILED:
+        raise HTTPException(status_code=500, detail=job.error)
+    if job.status != jobs.DONE:
+        raise HTTPException(status_code=409, detail=f"工作尚未完成（{job.status}）")
+    result = job.result
+    if isinstance(result, dict) and isinstance(result.get("table"), pd.DataFrame):
+        extra = {k: v for k, v in result.items() if k != "table"}
+        return transport.respond_table(request, result["table"], **extra)
+    return result
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    job = _get_job(job_id)
+
+    async def stream():
+        # Server-Sent Events：狀態有變動才送出，結束後關閉連線
+        version = -1
+        while True:
+            if job.version != version:
+                version = job.version
+                yield f"data: {json.dumps(job.to_dict(), ensure_ascii=False)}\n\n"
+            if job.finished:
+                break
+            await asyncio.sleep(0.2)
+
+    return StreamingResponse(stream(), media_type="text/event-stream")
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus 格式的指標。"""
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/gwp_cache/stats")
+async def gwp_cache_stats():
+    cache = gwp_cache.get_cache()
+    if cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **cache.stats()}
+
+@app.delete("/gwp_cache")
+async def gwp_cache_invalidate(item: Optional[str] = None):
+    # 不帶 item 時清空全部快取
+    cache = gwp_cache.get_cache()
+    if cache is None:
+        raise HTTPException(status_code=400, detail="GWP 快取未啟用")
+    return {"deleted": cache.invalidate(item)}
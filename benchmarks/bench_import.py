@@ -0,0 +1,83 @@
+"""
+量測 `import app.main` 的冷啟動時間（每次皆為新的 Python 行程），並檢查重量級套件未在 import 時載入：
+
+    python benchmarks/bench_import.py                 # 預設 5 次，取中位數
+    python benchmarks/bench_import.py --budget 0.8    # 超過預算（秒）或重量級套件被提早載入時 exit 1
+    python benchmarks/bench_import.py --top 15        # 另列出 -X importtime 累計耗時最高的模組
+
+CI 可直接以 --budget 當作啟動時間的回歸測試。
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+
+# 這些套件應延後到第一次使用時才載入
+LAZY_MODULES = ["pdfplumber", "fitz", "pytesseract", "pymoo", "openai", "scipy", "modules.optimizer"]
+
+PROBE = """
+import json, sys, time
+t = time.perf_counter()
+import app.main
+elapsed = time.perf_counter() - t
+print(json.dumps({"seconds": elapsed, "loaded": [m for m in %r if m in sys.modules]}))
+""" % (LAZY_MODULES,)
+
+
+def run_once(env):
+    out = subprocess.run([sys.executable, "-c", PROBE], cwd=ROOT, env=env,
+                         capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def importtime_top(env, top):
+    """-X importtime 的累計時間（微秒）最高的模組。"""
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app.main"], cwd=ROOT, env=env,
+                         capture_output=True, text=True, check=True)
+    rows = []
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cum_us, name = line[len("import time:"):].split("|")
+        rows.append((int(cum_us), int(self_us), name.rstrip()[1:]))
+    # 只列出第一層（未縮排）與第二層的模組，避免同一條 import 鏈重複出現
+    rows = [r for r in rows if len(r[2]) - len(r[2].lstrip()) <= 2]
+    return sorted(rows, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--budget", type=float, help="import 時間上限（秒，中位數）")
+    parser.add_argument("--top", type=int, default=0)
+    args = parser.parse_args()
+
+    env = {**os.environ, "PYTHONPATH": str(ROOT), "PYTHONDONTWRITEBYTECODE": "0"}
+    env.setdefault("DATA_DIR", str(ROOT / "data"))
+    run_once(env)  # 先產生 .pyc，量測不含編譯時間
+    runs = [run_once(env) for _ in range(args.repeat)]
+    times = [r["seconds"] for r in runs]
+    loaded = sorted({m for r in runs for m in r["loaded"]})
+    median = statistics.median(times)
+    print(f"import app.main：中位數 {median * 1e3:.1f} ms（最小 {min(times) * 1e3:.1f}、最大 {max(times) * 1e3:.1f}，{args.repeat} 次）")
+    print(f"提早載入的重量級套件：{', '.join(loaded) if loaded else '無'}")
+
+    if args.top:
+        print(f"\n{'cumulative(ms)':>15} {'self(ms)':>9}  module")
+        for cum, self_, name in importtime_top(env, args.top):
+            print(f"{cum / 1e3:>15.1f} {self_ / 1e3:>9.1f}  {name}")
+
+    failed = bool(loaded)
+    if args.budget is not None and median > args.budget:
+        print(f"超過啟動時間預算 {args.budget * 1e3:.0f} ms")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+比較 ocr.pdf_to_dataframe 清理階段的舊寫法（逐 cell applymap + dict 去重標頭）
+與向量化的 combine_tables / normalize_cells。
+
+以 data/aa.pdf 擷取出的原始表格為樣本，複製成不同頁數來模擬大型標案：
+
+    python benchmarks/bench_ocr_normalize.py --scales 1 10 100 300
+"""
+import argparse
+import sys
+import timeit
+import warnings
+from pathlib import Path
+
+import pandas as pd
+import pdfplumber
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from modules import ocr  # noqa: E402
+
+
+def raw_tables(pdf_path):
+    with pdfplumber.open(str(pdf_path)) as pdf:
+        return [t for page in pdf.pages for t in page.extract_tables() if t and len(t) >= 2]
+
+
+def legacy(tables):
+    dfs = []
+    for table in tables:
+        header, *rows = table
+        cleaned = [h.strip() if isinstance(h, str) else '' for h in header]
+        seen = {}
+        unique_header = []
+        for h in cleaned:
+            if h in seen:
+                seen[h] += 1
+                unique_header.append(f"{h}.{seen[h]}")
+            else:
+                seen[h] = 0
+                unique_header.append(h)
+        df = pd.DataFrame(rows, columns=unique_header)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", FutureWarning)
+            df = df.applymap(lambda x: x.strip() if isinstance(x, str) else x)
+        dfs.append(df)
+    combined = pd.concat(dfs, ignore_index=True)
+    combined = combined.dropna(how='all').reset_index(drop=True)
+    return combined.where(pd.notnull(combined), None)
+
+
+def vectorized(tables):
+    combined = ocr.combine_tables(tables, normalize=False)
+    combined = combined.dropna(how='all').reset_index(drop=True)
+    return ocr.normalize_cells(combined)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pdf", default=str(ROOT / "data" / "aa.pdf"))
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    base = raw_tables(args.pdf)
+    print(f"{'scale':>6} {'rows':>8} {'legacy(ms)':>12} {'vectorized(ms)':>15} {'speedup':>8}")
+    for scale in args.scales:
+        tables = base * scale
+        rows = sum(len(t) - 1 for t in tables)
+        t_old = min(timeit.repeat(lambda: legacy(tables), number=1, repeat=args.repeat))
+        t_new = min(timeit.repeat(lambda: vectorized(tables), number=1, repeat=args.repeat))
+        print(f"{scale:>6} {rows:>8} {t_old * 1e3:>12.1f} {t_new * 1e3:>15.1f} {t_old / t_new:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""
+估算路徑壓測：以指定並行數對 /fill_carbon_factors、/optimize 發送請求，
+回報 p50 / p95 / p99 延遲與吞吐量。
+
+預設在行程內以 httpx.ASGITransport 直接驅動 FastAPI app，並使用離線的 FakeBackend
+（LLM_BACKEND=fake），不需 API key：
+
+    python benchmarks/loadtest.py --endpoint fill --rows 50 --concurrency 1 8 32 --requests 200
+    python benchmarks/loadtest.py --endpoint optimize --llm-latency 0.2 --error-rate 0.05
+
+對已啟動的服務壓測（LLM 後端由該服務的環境變數決定）：
+
+    python benchmarks/loadtest.py --url http://127.0.0.1:8000 --concurrency 16
+
+每個請求的項目名稱皆不同，且預設停用 GWP / 前緣快取，量到的是完整估算路徑；
+加上 --cache 可量測快取命中時的表現。
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+import numpy as np
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+ENDPOINTS = {"fill": "/fill_carbon_factors", "optimize": "/optimize"}
+MATERIALS = ["預拌混凝土", "鋼筋", "模板", "紅磚", "水泥砂漿", "鋼構", "玻璃", "PVC 管", "瀝青混凝土", "石膏板"]
+UNITS = ["m3", "t", "m2", "塊", "m3", "t", "m2", "m", "t", "m2"]
+
+
+def payload(n_rows, seed):
+    rng = random.Random(seed)
+    rows = []
+    for i in range(n_rows):
+        k = rng.randrange(len(MATERIALS))
+        rows.append({
+            "item": f"{MATERIALS[k]} 規格{seed}-{i}",
+            "unit": UNITS[k],
+            "qty": rng.randint(1, 500),
+            "unit_price": rng.randint(100, 5000),
+        })
+    return {"data": rows}
+
+
+def summarize(latencies, errors, elapsed, concurrency):
+    lat = np.asarray(latencies) * 1e3
+    done = len(lat)
+    pct = np.percentile(lat, [50, 95, 99]) if done else [float("nan")] * 3
+    return {
+        "concurrency": concurrency,
+        "requests": done + errors,
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(done / elapsed, 2) if elapsed > 0 else 0.0,
+        "p50_ms": round(float(pct[0]), 1),
+        "p95_ms": round(float(pct[1]), 1),
+        "p99_ms": round(float(pct[2]), 1),
+        "mean_ms": round(float(lat.mean()), 1) if done else float("nan"),
+    }
+
+
+async def run_level(client, path, n_requests, concurrency, n_rows, seed0):
+    latencies, errors = [], 0
+    queue = asyncio.Queue()
+    for i in range(n_requests):
+        queue.put_nowait(seed0 + i)
+
+    async def worker():
+        nonlocal errors
+        while True:
+            try:
+                seed = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            body = payload(n_rows, seed)
+            start = time.perf_counter()
+            try:
+                resp = await client.post(path, json=body)
+                ok = resp.status_code == 200
+            except httpx.HTTPError:
+                ok = False
+            if ok:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, errors, time.perf_counter() - start, concurrency)
+
+
+def configure_inprocess(args):
+    """在 import app 之前設定環境變數：離線 LLM、暫存 DATA_DIR、不限速。"""
+    os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="loadtest-"))
+    os.environ["LLM_BACKEND"] = "fake"
+    os.environ["LLM_FAKE_LATENCY"] = str(args.llm_latency)
+    os.environ["LLM_FAKE_JITTER"] = str(args.llm_jitter)
+    os.environ["LLM_FAKE_ERROR_RATE"] = str(args.error_rate)
+    os.environ["LLM_FAKE_MALFORMED_RATE"] = str(args.malformed_rate)
+    os.environ["LLM_FAKE_SEED"] = str(args.seed)
+    os.environ.setdefault("LLM_RPS", "0")
+    os.environ.setdefault("LLM_RETRY_DELAY", "0.05")
+    if not args.cache:
+        os.environ["GWP_CACHE"] = "0"
+        os.environ["FRONT_CACHE"] = "0"
+
+
+async def main_async(args):
+    if args.url:
+        transport, base = None, args.url.rstrip("/")
+    else:
+        configure_inprocess(args)
+        from app.main import app
+        transport, base = httpx.ASGITransport(app=app), "http://loadtest"
+
+    results = []
+    timeout = httpx.Timeout(args.timeout)
+    async with httpx.AsyncClient(transport=transport, base_url=base, timeout=timeout) as client:
+        for name in args.endpoint:
+            path = ENDPOINTS[name]
+            if args.warmup:
+                await run_level(client, path, args.warmup, 1, args.rows, seed0=-args.warmup)
+            for level, concurrency in enumerate(args.concurrency):
+                res = await run_level(client, path, args.requests, concurrency, args.rows,
+                                      seed0=args.seed * 1_000_000 + level * args.requests)
+                res = {"endpoint": path, "rows": args.rows, **res}
+                results.append(res)
+                if not args.json:
+                    print(f"{path:<22} {concurrency:>5} {res['requests']:>6} {res['errors']:>6} "
+                          f"{res['throughput_rps']:>9.2f} {res['p50_ms']:>9.1f} "
+                          f"{res['p95_ms']:>9.1f} {res['p99_ms']:>9.1f}", file=sys.__stdout__, flush=True)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="壓測已啟動的服務；不指定時在行程內驅動 app")
+    parser.add_argument("--endpoint", nargs="+", choices=sorted(ENDPOINTS), default=["fill"])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=100, help="每個並行數發送的請求數")
+    parser.add_argument("--rows", type=int, default=20, help="每個請求的列數")
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--cache", action="store_true", help="保留 GWP / 前緣快取")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="FakeBackend 每次呼叫延遲（秒）")
+    parser.add_argument("--llm-jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--malformed-rate", type=float, default=0.0)
+    parser.add_argument("--json", action="store_true", help="以 JSON 輸出結果")
+    parser.add_argument("--verbose", action="store_true", help="保留 app 本身的輸出")
+    args = parser.parse_args()
+
+    if not args.json:
+        print(f"{'endpoint':<22} {'conc':>5} {'reqs':>6} {'errors':>6} {'req/s':>9} "
+              f"{'p50(ms)':>9} {'p95(ms)':>9} {'p99(ms)':>9}")
+    # 估算流程會逐列 print，壓測時不輸出，除非 --verbose
+    quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, "w"))
+    with quiet:
+        results = asyncio.run(main_async(args))
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+"""
+各階段基準量測：PDF 解析、/format_table、碳係數估算（離線 LLM）、材料組合優化
+（optimize 為 NSGA-II、optimize_auto 為預設的引擎選擇）、碳排不確定性（蒙地卡羅）。
+
+資料皆由 benchmarks/synthetic.py 以固定 seed 產生；每個 (階段, 列數) 量測
+多次執行時間（取最小值與中位數），另以 tracemalloc 跑一次量測 Python 端的峰值記憶體。
+結果寫成 JSON，可與先前版本比較：
+
+    python benchmarks/suite.py                                  # 全部階段、預設列數
+    python benchmarks/suite.py --stages ocr format --sizes 100 1000
+    python benchmarks/suite.py --output benchmarks/results/v0.3.json
+    python benchmarks/suite.py --compare benchmarks/results/v0.3.json --tolerance 0.2
+
+--compare 時若任何項目比基準慢超過 tolerance（預設 20%）則以 exit code 1 結束。
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+# 各階段預設列數；估算與 PDF 解析在大表上耗時較長，上限較低
+DEFAULT_SIZES = {
+    "ocr": [100, 1000, 5000],
+    "format": [100, 1000, 10000, 100000],
+    "fill": [100, 1000, 10000],
+    "optimize": [100, 1000, 10000],
+    "optimize_auto": [100, 1000, 10000, 100000],
+    "uncertainty": [1000, 10000, 100000],
+}
+
+
+def configure_env(workdir: Path) -> None:
+    """量測前固定環境：暫存 DATA_DIR、離線 LLM（無延遲）、停用所有快取。"""
+    os.environ["DATA_DIR"] = str(workdir)
+    os.environ["LLM_BACKEND"] = "fake"
+    os.environ["LLM_FAKE_LATENCY"] = "0"
+    os.environ["LLM_FAKE_ERROR_RATE"] = "0"
+    os.environ["LLM_FAKE_MALFORMED_RATE"] = "0"
+    os.environ["LLM_RPS"] = "0"
+    os.environ["GWP_CACHE"] = "0"
+    os.environ["FRONT_CACHE"] = "0"
+    os.environ.pop("EPD_LIBRARY", None)
+
+
+def setup_ocr(n, workdir, seed):
+    from modules import ocr
+    import synthetic
+    path = synthetic.boq_pdf(workdir / f"boq_{n}_{seed}.pdf", n, seed)
+    return lambda: ocr.pdf_to_dataframe(path, mode="stream")
+
+
+def setup_format(n, workdir, seed):
+    from fastapi.testclient import TestClient
+    from app.main import app
+    import synthetic
+    client = TestClient(app)
+    body = json.dumps({"data": synthetic.boq_frame(n, seed).to_dict(orient="records")},
+                      ensure_ascii=False).encode("utf-8")
+    headers = {"Content-Type": "application/json"}
+
+    def run():
+        resp = client.post("/format_table", content=body, headers=headers)
+        resp.raise_for_status()
+        return resp
+    return run
+
+
+def setup_fill(n, workdir, seed):
+    from modules import openai_helper
+    import synthetic
+    df = synthetic.detail_frame(n, seed)
+    return lambda: openai_helper.fill_carbon_factors(df.copy())
+
+
+def _setup_optimizer(engine):
+    def setup(n, workdir, seed):
+        from modules import optimizer
+        import synthetic
+        df = synthetic.detail_frame(n, seed, with_gwp=True)
+        # 關閉暖啟動，每次重複量測都從頭求解
+        return lambda: optimizer.optimize_materials(df, seed=seed, engine=engine,
+                                                    use_cache=False, warm_start=False)
+    return setup
+
+
+# 合成表格為線性無限制式，engine="auto" 多半走窮舉 / 權重掃描；NSGA-II 另列一個階段量測
+setup_optimize = _setup_optimizer("nsga2")
+setup_optimize_auto = _setup_optimizer("auto")
+
+
+def setup_uncertainty(n, workdir, seed):
+    from modules import uncertainty
+    import synthetic
+    df = synthetic.detail_frame(n, seed, with_gwp=True)
+    groups = (df.index // 50).astype(str)
+    return lambda: uncertainty.simulate(df, seed=seed, groups=groups)
+
+
+STAGES = {
+    "ocr": setup_ocr,
+    "format": setup_format,
+    "fill": setup_fill,
+    "optimize": setup_optimize,
+    "optimize_auto": setup_optimize_auto,
+    "uncertainty": setup_uncertainty,
+}
+
+
+def measure(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        "min_s": round(min(times), 6),
+        "median_s": round(statistics.median(times), 6),
+        "repeat": repeat,
+        "peak_mb": round(peak / 2 ** 20, 3),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path, tolerance):
+    """回傳比基準慢超過 tolerance 的項目數。"""
+    baseline = json.loads(Path(baseline_path).read_text(encoding="utf-8"))
+    base = {(r["stage"], r["rows"]): r for r in baseline["results"]}
+    slower = 0
+    print(f"\n與 {baseline_path}（{baseline['meta'].get('revision')}）比較：")
+    print(f"{'stage':<13} {'rows':>8} {'time':>8} {'peak':>8}")
+    for r in results:
+        b = base.get((r["stage"], r["rows"]))
+        if b is None:
+            continue
+        t = r["min_s"] / b["min_s"] if b["min_s"] else float("nan")
+        m = r["peak_mb"] / b["peak_mb"] if b["peak_mb"] else float("nan")
+        flag = "  <-- 變慢" if t > 1 + tolerance else ""
+        slower += bool(flag)
+        print(f"{r['stage']:<13} {r['rows']:>8} {t:>7.2f}x {m:>7.2f}x{flag}")
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stages", nargs="+", choices=list(STAGES), default=list(STAGES))
+    parser.add_argument("--sizes", type=int, nargs="+", help="覆寫各階段的預設列數")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="結果 JSON 路徑（預設 benchmarks/results/<revision>.json）")
+    parser.add_argument("--compare", help="基準結果 JSON")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    workdir = Path(tempfile.mkdtemp(prefix="bench-"))
+    configure_env(workdir)
+    sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+    revision = git_revision()
+    results = []
+    print(f"{'stage':<13} {'rows':>8} {'min(ms)':>10} {'median(ms)':>11} {'peak(MB)':>9}")
+    for stage in args.stages:
+        for n in args.sizes or DEFAULT_SIZES[stage]:
+            # 估算流程會逐列 print，量測時不輸出
+            with contextlib.redirect_stdout(io.StringIO()):
+                fn = STAGES[stage](n, workdir, args.seed)
+                res = measure(fn, args.repeat)
+            res = {"stage": stage, "rows": n, **res}
+            results.append(res)
+            print(f"{stage:<13} {n:>8} {res['min_s'] * 1e3:>10.1f} {res['median_s'] * 1e3:>11.1f} "
+                  f"{res['peak_mb']:>9.1f}", flush=True)
+
+    report = {
+        "meta": {
+            "revision": revision,
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+    output = Path(args.output or ROOT / "benchmarks" / "results" / f"{revision or 'local'}.json")
+    output.parent.mkdir(exist_ok=True, parents=True)
+    output.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"結果已寫入 {output}")
+
+    if args.compare and compare(results, args.compare, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
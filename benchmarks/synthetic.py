@@ -0,0 +1,107 @@
+"""
+基準量測用的合成資料：標案詳細價目表（BoQ）與多頁 PDF。
+
+所有產生器都以 seed 決定內容，同樣參數永遠得到同一份資料。
+"""
+import random
+from pathlib import Path
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+ROMAN = ["一", "二", "三", "四", "五", "六", "七", "八", "九", "十"]
+MATERIALS = [
+    ("預拌混凝土 210kgf/cm2", "m3", 2300), ("預拌混凝土 280kgf/cm2", "m3", 2600),
+    ("鋼筋 SD420", "t", 24000), ("鋼筋 SD280", "t", 22000), ("模板 清水", "m2", 650),
+    ("紅磚 1B 牆", "m2", 1800), ("水泥砂漿粉刷", "m2", 420), ("H 型鋼構", "t", 52000),
+    ("強化玻璃 10mm", "m2", 3200), ("PVC 管 4\"", "m", 280), ("瀝青混凝土鋪面", "m2", 380),
+    ("石膏板隔間", "m2", 1100), ("防水層 PU", "m2", 520), ("磁磚 30x30", "m2", 950),
+]
+SECTIONS = ["準備及配合工程", "建築工程", "周圍環境工程", "水電及消防設備工程", "景觀工程"]
+HEADER = ['項次', '工程項目', '單位', '數量', '單價', '複價', '說明']
+
+
+def _money(value: float) -> str:
+    return f"{int(round(value)):,}"
+
+
+def boq_records(n_rows: int, seed: int = 0, section_every: int = 50) -> List[List[str]]:
+    """
+    產生 n_rows 列明細（另含段落標題、重複表頭與小計列），欄位同 ocr 解析後的 DESIRED_COLS，
+    數字為 PDF 上常見的千分位字串。
+    """
+    rng = random.Random(seed)
+    out, no, section = [], 0, -1
+    for i in range(n_rows):
+        if i % section_every == 0:
+            if section >= 0:
+                out.append(['', f'{SECTIONS[section % len(SECTIONS)]}小計', '', '', '', '', ''])
+            section += 1
+            out.append(HEADER[:])
+            out.append(['', f'{ROMAN[section % len(ROMAN)]}、{SECTIONS[section % len(SECTIONS)]}', '', '', '', '', ''])
+            no = 0
+        no += 1
+        name, unit, price = MATERIALS[rng.randrange(len(MATERIALS))]
+        qty = rng.randint(1, 800)
+        price = price * rng.uniform(0.8, 1.2)
+        out.append([str(no), f"{name} #{i}", unit, str(qty), _money(price), _money(qty * price),
+                    rng.choice(['', '', '含運費', '依圖說施作'])])
+    return out
+
+
+def boq_frame(n_rows: int, seed: int = 0) -> pd.DataFrame:
+    """/format_table 的輸入：含表頭、段落標題、小計的原始表格。"""
+    return pd.DataFrame(boq_records(n_rows, seed), columns=HEADER)
+
+
+def detail_frame(n_rows: int, seed: int = 0, with_gwp: bool = False) -> pd.DataFrame:
+    """只含明細列、欄名已標準化（item / unit / qty / unit_price ...），供估算與優化使用。"""
+    rng = np.random.default_rng(seed)
+    k = rng.integers(0, len(MATERIALS), n_rows)
+    names = np.array([m[0] for m in MATERIALS], dtype=object)[k]
+    df = pd.DataFrame({
+        'idx': np.arange(1, n_rows + 1).astype(str),
+        'item': [f"{name} #{i}" for i, name in enumerate(names)],
+        'unit': np.array([m[1] for m in MATERIALS], dtype=object)[k],
+        'qty': rng.integers(1, 800, n_rows),
+        'unit_price': (np.array([m[2] for m in MATERIALS])[k] * rng.uniform(0.8, 1.2, n_rows)).round(),
+        'remark': '',
+    })
+    df['amount'] = df['qty'] * df['unit_price']
+    if with_gwp:
+        df['gwp'] = rng.uniform(-50, 500, n_rows).round(2)
+        df['eta'] = rng.integers(0, 60, n_rows)
+        # 估算上下限：不對稱、寬度不一
+        spread = df['gwp'].abs()
+        df['gwp_low'] = (df['gwp'] - spread * rng.uniform(0.05, 0.4, n_rows)).round(2)
+        df['gwp_high'] = (df['gwp'] + spread * rng.uniform(0.05, 0.6, n_rows)).round(2)
+    else:
+        df['gwp'] = None
+    return df
+
+
+def boq_pdf(path: Path, n_rows: int, seed: int = 0, rows_per_page: int = 28) -> Path:
+    """
+    以 PyMuPDF 畫出有框線的多頁價目表（每頁重複表頭），pdfplumber 可直接擷取表格。
+    中文使用 PyMuPDF 內建的 china-t 字型。
+    """
+    import fitz
+
+    records = [r for r in boq_records(n_rows, seed) if r != HEADER]
+    widths = [40, 300, 50, 60, 90, 110, 140]
+    xs = np.concatenate([[20], 20 + np.cumsum(widths)])
+    row_h = 18
+    doc = fitz.open()
+    for start in range(0, len(records), rows_per_page):
+        page = doc.new_page(width=842, height=595)
+        for r, row in enumerate([HEADER] + records[start:start + rows_per_page]):
+            y = 30 + r * row_h
+            for c, text in enumerate(row):
+                page.draw_rect(fitz.Rect(xs[c], y, xs[c + 1], y + row_h), width=0.5)
+                if text:
+                    page.insert_text((xs[c] + 2, y + 13), text, fontname="china-t", fontsize=8)
+    path = Path(path)
+    doc.save(str(path))
+    doc.close()
+    return path
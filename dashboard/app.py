@@ -1,10 +1,47 @@
 import streamlit as st
 import requests
 import pandas as pd
+import pyarrow as pa
 import json
+import time
+import hashlib
+import sys
+from pathlib import Path
+
+# 與後端共用 Arrow 編碼（streamlit run dashboard/app.py 時 sys.path 只有 dashboard/）
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from modules.transport import ARROW_STREAM, frame_to_arrow  # noqa: E402
 
 BACKEND = "http://localhost:8000"
 
+def from_arrow(content):
+    """回傳 (DataFrame, 附帶資訊 dict)。"""
+    table = pa.ipc.open_stream(content).read_all()
+    meta = (table.schema.metadata or {}).get(b"meta")
+    return table.to_pandas(), (json.loads(meta) if meta else {})
+
+def post_table(path, df, params=None):
+    return requests.post(f"{BACKEND}{path}", data=frame_to_arrow(df), params=params,
+                         headers={"Content-Type": ARROW_STREAM, "Accept": ARROW_STREAM})
+
+def run_job(path, df, label):
+    """送出背景工作並輪詢進度，回傳 /jobs/{id}/result 的 Response。"""
+    resp = post_table(f"/jobs/{path}", df)
+    if not resp.ok:
+        return resp
+    job_id = resp.json()["job_id"]
+    bar = st.progress(0.0, text=label)
+    while True:
+        status = requests.get(f"{BACKEND}/jobs/{job_id}").json()
+        if status["total"]:
+            bar.progress(min(status["done"] / status["total"], 1.0),
+                         text=f"{label}（{status['stage']} {status['done']}/{status['total']}）")
+        if status["status"] in ("done", "failed"):
+            break
+        time.sleep(0.5)
+    bar.empty()
+    return requests.get(f"{BACKEND}/jobs/{job_id}/result", headers={"Accept": ARROW_STREAM})
+
 st.title("Carbon-Aware Procurement MVP")
 st.sidebar.header("1. 上傳報價 PDF")
 
@@ -13,16 +50,23 @@ if not uploaded:
     st.sidebar.info("請先上傳 PDF 檔以解析表格。")
     st.stop()
 
-# 上傳並取得原始資料
-files = {"pdf": uploaded}
-resp = requests.post(f"{BACKEND}/upload_pdf", files=files)
-if not resp.ok:
-    st.sidebar.error(resp.text)
-    st.stop()
+# 上傳並取得原始資料：以內容 SHA-256 辨識文件，
+# 同一份檔案在 session 中只取一次，後端已解析過則不必重新上傳
+pdf_bytes = uploaded.getvalue()
+sha = hashlib.sha256(pdf_bytes).hexdigest()
+upload_key = f"upload:{sha}"
+if upload_key not in st.session_state:
+    resp = requests.get(f"{BACKEND}/uploads/{sha}", headers={"Accept": ARROW_STREAM})
+    if resp.status_code == 404:
+        files = {"pdf": (uploaded.name, pdf_bytes, "application/pdf")}
+        resp = requests.post(f"{BACKEND}/upload_pdf", files=files, headers={"Accept": ARROW_STREAM})
+    if not resp.ok:
+        st.sidebar.error(resp.text)
+        st.stop()
+    st.session_state[upload_key] = from_arrow(resp.content)
 
 # 建立 DataFrame
-data = resp.json()
-raw_df = pd.DataFrame(data["csv_data"])
+raw_df, data = st.session_state[upload_key]
 st.sidebar.success(f"解析成功，共 {len(raw_df)} 列")
 
 # 顯示原始表格
@@ -30,81 +74,18 @@ if st.sidebar.checkbox("顯示原始表格"):
     st.subheader("原始表格")
     st.dataframe(raw_df)
 
-# 整理邏輯：根據次級標籤行 mapping extras 欄位，對齊至主欄位
+# 整理邏輯（欄位對齊 + 段落分段）改由後端 /align_table 一次完成，
+# 並依上傳檔案快取在 session_state，避免 Streamlit 每次 rerun 重算
 desired_cols = ['項次','工程項目','單位','數量','單價','複價','說明']
-extras_cols = [c for c in raw_df.columns if c not in desired_cols]
-
-# 建立 mapping: extras 欄位 -> desired 欄位
-mapping = {}
-aligned_rows = []
-for _, raw_row in raw_df.iterrows():
-    # 判斷是否為次級標籤行：所有 desired_cols 為空、至少一個 extras 為 desired 標籤
-    is_label = True
-    any_extra = False
-    for c in extras_cols:
-        val = raw_row.get(c)
-        if val not in (None, ''):
-            any_extra = True
-            if val not in desired_cols:
-                is_label = False
-    for c in desired_cols:
-        if raw_row.get(c) not in (None, ''):
-            is_label = False
-    if is_label and any_extra:
-        # 更新 mapping
-        for c in extras_cols:
-            val = raw_row.get(c)
-            if val in desired_cols:
-                mapping[c] = val
-        # 對於次級標籤行，也保留一筆資料，用以呈現原始位置
-        new_row = {c: '' for c in desired_cols}
-        # 將 extras 中的標籤顯示在對應欄位
-        for c in extras_cols:
-            val = raw_row.get(c)
-            if val in desired_cols:
-                new_row[val] = val
-        aligned_rows.append(new_row)
-        continue
-    # 一般資料列：先以原本主欄位填值
-    new_row = {c: raw_row.get(c, '') for c in desired_cols}
-    # 再以 mapping 對應 extras 欄位資料
-    for c in extras_cols:
-        val = raw_row.get(c)
-        if val not in (None, '') and mapping.get(c):
-            if new_row.get(mapping[c], '') in (None, ''):
-                new_row[mapping[c]] = val
-    aligned_rows.append(new_row)
-
-# 取得對齊後 DataFrame
-disp_df = pd.DataFrame(aligned_rows)
-
-# 找出各段標題行：項次~說明全空，工程項目非空
-mask_title = (
-    (disp_df['項次']=='') & (disp_df['單位']=='') & (disp_df['數量']=='') &
-    (disp_df['單價']=='') & (disp_df['複價']=='') & (disp_df['說明']=='') &
-    (disp_df['工程項目']!='')
-)
-title_idxs = disp_df[mask_title].index.tolist()
-
-# 合併成單一表格：插入粗體標題行與資料
-rows = []
-if title_idxs:
-    title_idxs.append(len(disp_df))
-    for i in range(len(title_idxs)-1):
-        idx = title_idxs[i]
-        title = disp_df.at[idx,'工程項目']
-        # 只加段標題
-        title_row = {c: '' for c in desired_cols}
-        title_row['工程項目'] = f"**{title}**"
-        rows.append(title_row)
-        # 資料列（確保這些 row 沒有「項次」等於「項次」的行！）
-        block = disp_df.iloc[idx+1:title_idxs[i+1]].reset_index(drop=True)
-        block = block[block['工程項目'] != '工程項目']  # 過濾掉表頭行
-        for _, r in block.iterrows():
-            rows.append(r.to_dict())
-    df_merged = pd.DataFrame(rows)
-else:
-    df_merged = None
+align_key = f"aligned:{sha}"
+if align_key not in st.session_state:
+    resp_align = post_table("/align_table", raw_df)
+    if not resp_align.ok:
+        st.sidebar.error("整理表格失敗：" + resp_align.text)
+        st.stop()
+    # 204：找不到任何段落標題
+    st.session_state[align_key] = from_arrow(resp_align.content)[0] if resp_align.status_code != 204 else None
+df_merged = st.session_state[align_key]
 
 def zh2en_cols(df):
     mapping = {
@@ -122,7 +103,7 @@ def zh2en_cols(df):
 if st.sidebar.button("整理表格"):
     if df_merged is not None:
         st.subheader("整理後表格：帶標題分段與對齊")
-        st.write(df_merged.to_html(index=False, escape=False), unsafe_allow_html=True)
+        st.write(df_merged[desired_cols].to_html(index=False, escape=False), unsafe_allow_html=True)
 
          #直接在這裡過濾掉 amount/複價 為空的 row
         col_amt = "複價" if "複價" in df_merged.columns else "amount"
@@ -130,39 +111,31 @@ if st.sidebar.button("整理表格"):
 
         df_en = zh2en_cols(df_merged)
         # 1. 先補齊 gwp 與碳排
-        resp_gwp = requests.post(
-            f"{BACKEND}/fill_carbon_factors",
-            json={"data": df_en.to_dict(orient="records")}
-        )
+        resp_gwp = run_job("fill_carbon_factors", df_en, "碳排估算中")
         if not resp_gwp.ok:
             st.error("碳排自動補全失敗：" + resp_gwp.text)
             st.stop()
-        df_gwp = pd.DataFrame(resp_gwp.json()["csv_data"])
+        df_gwp, _ = from_arrow(resp_gwp.content)
 
         # 2. 顯示補齊碳排的表格
         st.subheader("自動補齊碳排後表格")
         st.dataframe(df_gwp)
 
         # 3. 再儲存（這時才丟補齊的 data 給 save_csv）
-        resp_save = requests.post(
-            f"{BACKEND}/save_csv",
-            json={
-                "data": df_gwp.to_dict(orient="records"),
-                "filename": data.get("csv_path", "").split("/")[-1].replace(".csv", "")
-            }
-        )
+        resp_save = post_table("/save_csv", df_gwp, params={"filename": data["sha256"]})
         if resp_save.ok:
             result = resp_save.json()
-            st.success(f"整理後表格已儲存成 CSV（共 {result['rows']} 列），路徑：{result['csv_path']}")
+            st.success(f"整理後表格已儲存（共 {result['rows']} 列），路徑：{result['path']}")
+            st.markdown(f"[下載 CSV]({BACKEND}{result['csv_url']})")
         else:
-            st.error("儲存 CSV 失敗：" + resp_save.text)
+            st.error("儲存表格失敗：" + resp_save.text)
     else:
         st.error("整理失敗：無法偵測到任何段落標題。")
 
 
 # 按鈕：進行優化
 if st.sidebar.button("進行優化"):
-    opt = requests.post(f"{BACKEND}/optimize", json={"data": df_merged.to_dict(orient="records")})
+    opt = run_job("optimize", df_merged, "優化中")
     if not opt.ok:
         st.error(opt.text)
         st.stop()
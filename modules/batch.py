@@ -0,0 +1,282 @@
+import os, re, sys, json, time, asyncio, logging, tarfile, zipfile, contextlib
+import pandas as pd
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from modules import ocr, openai_helper, table_format, uploads, storage, metrics
+
+# 批次處理多份標案 PDF：parse → format → estimate → save（→ optimize）。
+# 各階段有各自的並行額度並以管線方式執行：一份檔案在等 LLM 估算時，後面的檔案已在其他行程解析。
+# 估算共用 llm_engine 的全域並行 / 速率額度與 GWP 快取，同一材料在多份檔案間只問一次 LLM。
+#
+#     python -m modules.batch 標案資料夾/            # 或 .zip / .tar.gz；也可直接列出多個 PDF
+#     python -m modules.batch tenders.zip --optimize --name 2024-06 --csv out.csv
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = Path(os.getenv("DATA_DIR", "data"))
+BATCH_DIR = DATA_DIR / "batches"
+
+STAGES = ("parse", "format", "estimate", "save", "optimize")
+ARCHIVE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz")
+
+# 進度回呼：progress(已完成檔案數, 總檔案數)
+Progress = Optional[Callable[[int, int], None]]
+
+
+def batch_name(name: Optional[str] = None) -> str:
+    """
+    批次名稱（輸出表格與 DATA_DIR/batches/ 下的目錄名）：只取檔名部分，"." 與其他不適合當檔名的字元改為 "_"
+    （storage 會把最後一個 "." 之後視為副檔名，"2024.06" 會被截成 "2024"）；空白時以時間命名。
+    """
+    name = re.sub(r'[^\w\-]+', '_', os.path.basename(name or '')).strip('_')
+    return name or time.strftime("batch_%Y%m%d_%H%M%S")
+
+
+def _is_archive(path: Path) -> bool:
+    return path.name.lower().endswith(ARCHIVE_SUFFIXES)
+
+
+def _extract_archive(archive: Path, workdir: Path) -> List[Tuple[str, Path]]:
+    """解出壓縮檔內的 PDF；一律以流水號命名，不使用壓縮檔內的路徑（避免路徑穿越）。"""
+    out = []
+    workdir.mkdir(exist_ok=True, parents=True)
+    if archive.name.lower().endswith(".zip"):
+        with zipfile.ZipFile(archive) as zf:
+            for info in zf.infolist():
+                if info.is_dir() or not info.filename.lower().endswith(".pdf"):
+                    continue
+                dest = workdir / f"{len(out):05d}.pdf"
+                with zf.open(info) as src, open(dest, "wb") as dst:
+                    dst.write(src.read())
+                out.append((f"{archive.name}/{info.filename}", dest))
+        return out
+    with tarfile.open(archive) as tf:
+        for member in tf:
+            if not member.isfile() or not member.name.lower().endswith(".pdf"):
+                continue
+            dest = workdir / f"{len(out):05d}.pdf"
+            with tf.extractfile(member) as src, open(dest, "wb") as dst:
+                dst.write(src.read())
+            out.append((f"{archive.name}/{member.name}", dest))
+    return out
+
+
+def collect_pdfs(sources: List[Path], workdir: Path) -> List[Tuple[str, Path]]:
+    """
+    展開輸入為 [(來源名稱, PDF 路徑), ...]：資料夾（遞迴）、壓縮檔（zip / tar）或 PDF 檔。
+    來源名稱寫入輸出表格的 source 欄，用以區分各列出自哪份文件。
+    """
+    files = []
+    for n, source in enumerate(map(Path, sources)):
+        if source.is_dir():
+            pdfs = sorted(p for p in source.rglob("*") if p.is_file() and p.suffix.lower() == ".pdf")
+            files += [(p.relative_to(source).as_posix(), p) for p in pdfs]
+        elif _is_archive(source):
+            files += _extract_archive(source, workdir / f"archive_{n}")
+        elif source.suffix.lower() == ".pdf":
+            files.append((source.name, source))
+        else:
+            raise ValueError(f"不支援的輸入（需為資料夾、PDF 或 {' / '.join(ARCHIVE_SUFFIXES)}）：{source.name}")
+    if not files:
+        raise ValueError("輸入中沒有任何 PDF")
+    return files
+
+
+def _parse_worker_init():
+    # 每個行程只處理一份檔案、OCR 也在同一行程逐頁執行，不再各自開行程池
+    os.environ["OMP_THREAD_LIMIT"] = "1"
+
+
+def _parse_file(pdf_file: str) -> pd.DataFrame:
+    """子行程工作：解析單一 PDF（掃描頁的 OCR 也在此行程內完成）。"""
+    return ocr.pdf_to_dataframe(Path(pdf_file), mode="stream", workers=1)
+
+
+def format_rows(raw: pd.DataFrame) -> pd.DataFrame:
+    """
+    相當於 Dashboard「整理表格」：對齊欄位並分段後，只留有複價的明細列，欄名改為英文。
+    找不到段落標題時退回 /format_table 的規則（濾掉表頭、小計與全空行）。
+    """
+    merged = table_format.align_and_section(raw)
+    if merged is None:
+        merged = table_format.clean_detail_rows(raw)
+    else:
+        merged = merged[merged['複價'].notna() & (merged['複價'] != '')]
+    return merged.rename(columns=openai_helper.COLUMN_MAP).reset_index(drop=True)
+
+
+def _optimize(df: pd.DataFrame) -> Dict[str, Any]:
+    from modules import optimizer
+    return optimizer.optimize_materials(df)
+
+
+async def run_batch(files: List[Tuple[str, Path]], name: Optional[str] = None, optimize: bool = False,
+                    parse_workers: Optional[int] = None, estimate_files: Optional[int] = None,
+                    progress: Progress = None) -> Dict[str, Any]:
+    """
+    以管線方式處理多份 PDF，回傳 {"name", "rows", "files", "failed", "summary", "solutions", ...}。
+    - parse：行程池平行解析（BATCH_PARSE_WORKERS，預設 CPU 核心數），已解析過的文件（同 SHA-256）直接讀回
+    - estimate：同時估算的檔案數（BATCH_ESTIMATE_FILES，預設 4）；實際 LLM 呼叫數仍受 LLM_CONCURRENCY 限制
+    - optimize：一次一份（優化本身已用多行程跑多個 seed）
+    在途檔案數上限 BATCH_INFLIGHT（預設 parse_workers * 2 + estimate_files），解析結果不會無限堆積。
+    單一檔案失敗只記錄在 summary，不影響其他檔案。
+    彙整表格（每列帶 source 欄）存為 storage 表格 name，可由 /tables/{name}、/tables/{name}/csv 取得；
+    逐檔摘要與優化結果寫入 DATA_DIR/batches/{name}/。
+    """
+    name = batch_name(name)
+    parse_workers = parse_workers or int(os.getenv("BATCH_PARSE_WORKERS", "0")) or os.cpu_count() or 1
+    estimate_files = estimate_files or int(os.getenv("BATCH_ESTIMATE_FILES", 4))
+    inflight = asyncio.Semaphore(int(os.getenv("BATCH_INFLIGHT", "0")) or parse_workers * 2 + estimate_files)
+    limits = {
+        "parse": asyncio.Semaphore(parse_workers),
+        "estimate": asyncio.Semaphore(estimate_files),
+        "optimize": asyncio.Semaphore(1),
+    }
+    loop = asyncio.get_running_loop()
+    total = len(files)
+    done = 0
+    if progress is not None:
+        progress(0, total)
+
+    @contextlib.asynccontextmanager
+    async def stage(record: Dict[str, Any], key: str):
+        limit = limits.get(key)
+        if limit is not None:
+            await limit.acquire()
+        start = time.perf_counter()
+        try:
+            with metrics.span(f"batch_{key}"):
+                yield
+        finally:
+            record[f"{key}_s"] = round(time.perf_counter() - start, 3)
+            if limit is not None:
+                limit.release()
+
+    async def parse(record, path: Path, pool) -> pd.DataFrame:
+        content = await loop.run_in_executor(None, path.read_bytes)
+        sha = record["sha256"] = uploads.content_hash(content)
+        df = await loop.run_in_executor(None, uploads.load_parsed, sha)
+        record["cached"] = df is not None
+        if df is None:
+            _, stored = await loop.run_in_executor(None, uploads.store_pdf, content)
+            df = await loop.run_in_executor(pool, _parse_file, str(stored))
+            await loop.run_in_executor(None, uploads.save_parsed, sha, df)
+        return df
+
+    async def one(source: str, path: Path, pool) -> Tuple[Dict[str, Any], Optional[pd.DataFrame], Any]:
+        nonlocal done
+        record: Dict[str, Any] = {"source": source, "sha256": None, "status": "ok", "error": None,
+                                  "cached": False, "rows": 0, "carbon": 0.0, "table": None}
+        df, solutions = None, None
+        async with inflight:
+            try:
+                async with stage(record, "parse"):
+                    raw = await parse(record, path, pool)
+                async with stage(record, "format"):
+                    df = await loop.run_in_executor(None, format_rows, raw)
+                del raw
+                async with stage(record, "estimate"):
+                    df = await openai_helper.afill_carbon_factors(df)
+                df.insert(0, "source", source)
+                async with stage(record, "save"):
+                    # 與 Dashboard 存檔同名（{sha256}_sorted），單一文件也能直接取用
+                    table = f"{record['sha256']}_sorted"
+                    await loop.run_in_executor(None, storage.write_table, df, table)
+                record.update(rows=len(df), table=table,
+                              carbon=float(pd.to_numeric(df['碳排放量'], errors='coerce').fillna(0).sum()))
+                if optimize and len(df):
+                    async with stage(record, "optimize"):
+                        solutions = await loop.run_in_executor(None, _optimize, df)
+            except Exception as e:
+                logger.warning("批次處理失敗：%s（%s）", source, e, exc_info=logger.isEnabledFor(logging.DEBUG))
+                record.update(status="failed", error=str(e))
+            finally:
+                done += 1
+                if progress is not None:
+                    progress(done, total)
+        return record, df if record["status"] == "ok" else None, solutions
+
+    pool = ProcessPoolExecutor(max_workers=min(parse_workers, total), initializer=_parse_worker_init) \
+        if parse_workers > 1 and total > 1 else None
+    try:
+        results = await asyncio.gather(*(one(source, path, pool) for source, path in files))
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    records = [r for r, _, _ in results]
+    frames = [df for _, df, _ in results if df is not None]
+    combined = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame({"source": []})
+    storage.write_table(combined, name)
+
+    out_dir = BATCH_DIR / name
+    out_dir.mkdir(exist_ok=True, parents=True)
+    columns = ["source", "sha256", "status", "error", "cached", "rows", "carbon", "table"] + \
+        [f"{s}_s" for s in STAGES if s != "optimize" or optimize]
+    summary = pd.DataFrame(records).reindex(columns=columns)
+    summary.to_parquet(out_dir / "summary.parquet", index=False)
+    # 以內容的 SHA-256 為 key：不同資料夾中同名的文件不會互相覆蓋
+    solutions = {r["sha256"]: {"source": r["source"], **s} for r, _, s in results if s is not None}
+    if optimize:
+        (out_dir / "solutions.json").write_text(json.dumps(solutions, ensure_ascii=False, indent=2),
+                                                encoding="utf-8")
+    return {
+        "name": name,
+        "files": total,
+        "failed": int((summary["status"] != "ok").sum()),
+        "rows": len(combined),
+        "carbon": float(summary["carbon"].fillna(0).sum()),
+        "path": str(storage.table_path(name)),
+        "output_dir": str(out_dir),
+        "summary": summary,
+        "solutions": solutions,
+    }
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(prog="python -m modules.batch",
+                                     description="批次解析多份標案 PDF 並估算碳排，輸出彙整表格。")
+    parser.add_argument("sources", nargs="+", type=Path, help="資料夾、壓縮檔（zip / tar）或 PDF")
+    parser.add_argument("--name", help="輸出表格名稱（預設 batch_<時間>）")
+    parser.add_argument("--optimize", action="store_true", help="估算後對每份文件執行材料組合優化")
+    parser.add_argument("--parse-workers", type=int, help="解析行程數（預設 BATCH_PARSE_WORKERS 或 CPU 核心數）")
+    parser.add_argument("--estimate-files", type=int, help="同時估算的檔案數（預設 BATCH_ESTIMATE_FILES 或 4）")
+    parser.add_argument("--csv", type=Path, help="另匯出彙整表格 CSV")
+    parser.add_argument("--verbose", action="store_true", help="顯示逐列估算輸出")
+    args = parser.parse_args(argv)
+
+    from modules import llm_backend
+    llm_backend.load_env()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    # 與 /batch 相同的名稱規則；解壓目錄、輸出與 --csv 讀回都用正規化後的名稱
+    name = batch_name(args.name)
+    start = time.perf_counter()
+
+    def report(done, total):
+        print(f"\r{done}/{total} 份完成", end="", file=sys.stderr, flush=True)
+
+    files = collect_pdfs(args.sources, BATCH_DIR / name / "input")
+    with contextlib.ExitStack() as stack:
+        # 估算流程會逐列 print，預設不輸出
+        if not args.verbose:
+            stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, "w"))))
+        result = asyncio.run(run_batch(files, name=name, optimize=args.optimize,
+                                       parse_workers=args.parse_workers, estimate_files=args.estimate_files,
+                                       progress=report))
+    elapsed = time.perf_counter() - start
+    print(file=sys.stderr)
+    with pd.option_context("display.max_rows", None, "display.width", 200):
+        print(result["summary"].drop(columns=["sha256", "table"]).to_string(index=False))
+    print(f"\n{result['files']} 份（失敗 {result['failed']}），{result['rows']} 列，"
+          f"總碳排 {result['carbon']:,.1f}，耗時 {elapsed:.1f} 秒（{result['files'] / elapsed:.2f} 份/秒）")
+    print(f"彙整表格：{result['path']}")
+    print(f"逐檔摘要：{result['output_dir']}")
+    if args.csv:
+        print(f"CSV：{storage.export_csv(storage.read_table(name), args.csv)}")
+    sys.exit(1 if result["failed"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+import os, threading
+import numpy as np
+import pandas as pd
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+from modules.gwp_cache import norm_text
+
+# 本地排放係數庫（EPD）：在呼叫 LLM 之前，先以工程項目名稱 + 單位模糊比對
+DEFAULT_THRESHOLD = 0.8
+# 單位不一致時的分數折扣（雙方都有單位才比較）
+UNIT_PENALTY = 0.7
+NGRAM_RANGE = (2, 3)
+# 每批查詢 × 係數庫筆數的上限，限制稀疏相似度矩陣（最壞情況接近稠密）的記憶體
+CHUNK_CELLS = 4_000_000
+
+# 係數庫欄位：名稱、單位、GWP（可含上下限與來源）
+LIBRARY_COLUMNS = {
+    'name': ['name', 'item', '材料名稱', '工程項目', '名稱'],
+    'unit': ['unit', '單位'],
+    'gwp': ['gwp', 'GWP', 'mean', '碳排係數'],
+    'gwp_low': ['gwp_low', 'low'],
+    'gwp_high': ['gwp_high', 'high'],
+    'source': ['source', 'epd_id', '來源'],
+}
+
+# 常見單位寫法統一（NFKC 後 m³ 已轉為 m3）
+UNIT_ALIASES = {
+    '立方公尺': 'm3', '立方米': 'm3', 'cum': 'm3', 'cmt': 'm3',
+    '平方公尺': 'm2', '平方米': 'm2', 'sqm': 'm2', 'm2': 'm2',
+    '公尺': 'm', '米': 'm', 'meter': 'm',
+    '公斤': 'kg', 'kgs': 'kg',
+    '公噸': 't', '噸': 't', 'ton': 't', 'tons': 't', 'mt': 't',
+    '公升': 'l', 'liter': 'l',
+}
+
+
+def norm_unit(value) -> str:
+    unit = norm_text(value).replace(' ', '')
+    return UNIT_ALIASES.get(unit, unit)
+
+
+def _ngrams(text: str) -> List[str]:
+    padded = f" {text} "
+    lo, hi = NGRAM_RANGE
+    return [padded[i:i + n] for n in range(lo, hi + 1) for i in range(len(padded) - n + 1)]
+
+
+def _pick(df: pd.DataFrame, key: str) -> Optional[pd.Series]:
+    for col in LIBRARY_COLUMNS[key]:
+        if col in df.columns:
+            return df[col]
+    return None
+
+
+def load_library(path) -> pd.DataFrame:
+    """讀取係數庫（.csv / .parquet），欄名統一為 name、unit、gwp、gwp_low、gwp_high、source。"""
+    path = Path(path)
+    if path.suffix.lower() == '.parquet':
+        raw = pd.read_parquet(path)
+    else:
+        raw = pd.read_csv(path, dtype=str, keep_default_na=False, encoding='utf-8-sig')
+    out = pd.DataFrame(index=raw.index)
+    for key in LIBRARY_COLUMNS:
+        col = _pick(raw, key)
+        out[key] = col if col is not None else None
+    if out['name'].isna().all() or out['gwp'].isna().all():
+        raise ValueError(f"係數庫缺少名稱或 GWP 欄位：{path}")
+    for key in ('gwp', 'gwp_low', 'gwp_high'):
+        out[key] = pd.to_numeric(out[key], errors='coerce')
+    out = out[out['gwp'].notna() & out['name'].notna()]
+    return out.reset_index(drop=True)
+
+
+class FactorIndex:
+    """
+    字元 n-gram TF-IDF 索引（scipy 稀疏矩陣，純 CPU）。
+    查詢時以 cosine 相似度找最相近的係數，單位不一致者乘上 UNIT_PENALTY。
+    """
+
+    def __init__(self, library: pd.DataFrame, threshold: float = DEFAULT_THRESHOLD):
+        self.library = library.reset_index(drop=True)
+        self.threshold = threshold
+        names = [norm_text(n) for n in self.library['name']]
+        self.units = np.array([norm_unit(u) for u in self.library['unit']], dtype=object)
+
+        grams = [Counter(_ngrams(n)) for n in names]
+        self.vocab: Dict[str, int] = {}
+        for g in grams:
+            for k in g:
+                self.vocab.setdefault(k, len(self.vocab))
+        df = np.zeros(len(self.vocab))
+        for g in grams:
+            df[[self.vocab[k] for k in g]] += 1
+        self.idf = np.log((1 + len(names)) / (1 + df)) + 1
+        self.matrix = self._vectorize(grams).T.tocsr()
+
+    def __len__(self) -> int:
+        return len(self.library)
+
+    def _vectorize(self, grams: Sequence[Counter]):
+        # scipy 只在建立 / 查詢索引時載入（未設定 EPD_LIBRARY 時不需要）
+        from scipy import sparse
+        rows, cols, vals = [], [], []
+        for r, g in enumerate(grams):
+            for k, tf in g.items():
+                c = self.vocab.get(k)
+                if c is not None:
+                    rows.append(r)
+                    cols.append(c)
+                    vals.append(tf * self.idf[c])
+        m = sparse.csr_matrix((vals, (rows, cols)), shape=(len(grams), len(self.vocab)))
+        norm = np.sqrt(np.asarray(m.multiply(m).sum(axis=1)).ravel())
+        return sparse.diags(1 / np.where(norm > 0, norm, 1)) @ m
+
+    def match(self, items: Sequence, units: Sequence, chunk: int = 512):
+        """
+        回傳每個查詢最相近的係數索引與分數（0~1）；完全沒有共同 n-gram 時索引為 -1。
+        相似度維持稀疏矩陣，只在非零項上套用單位折扣並逐列取最大值，不展開成 查詢數 × 係數庫 的稠密矩陣；
+        每批查詢數另依係數庫大小縮小（CHUNK_CELLS）。
+        """
+        n = len(items)
+        best = np.full(n, -1, dtype=int)
+        score = np.zeros(n)
+        if n == 0 or len(self) == 0:
+            return best, score
+        q_units = np.array([norm_unit(u) for u in units], dtype=object)
+        chunk = max(1, min(chunk, CHUNK_CELLS // len(self)))
+        for start in range(0, n, chunk):
+            stop = min(start + chunk, n)
+            grams = [Counter(_ngrams(norm_text(t))) for t in items[start:stop]]
+            sim = (self._vectorize(grams) @ self.matrix).tocsr()
+            rows = np.repeat(np.arange(stop - start), np.diff(sim.indptr))
+            qu, lu = q_units[start:stop][rows], self.units[sim.indices]
+            data = np.where((qu != '') & (lu != '') & (qu != lu), sim.data * UNIT_PENALTY, sim.data)
+            keep = data > 0
+            rows, cols, data = rows[keep], sim.indices[keep], data[keep]
+            # 依 (列, 分數由高到低, 係數索引) 排序，每列第一筆即最大值（同分取索引最小者，同 argmax）
+            order = np.lexsort((cols, -data, rows))
+            first = order[np.r_[True, np.diff(rows[order]) != 0]] if len(order) else order
+            best[start + rows[first]] = cols[first]
+            score[start + rows[first]] = data[first]
+        return best, score
+
+    def lookup(self, rows: List[Dict[str, Any]]) -> List[Optional[Dict[str, Any]]]:
+        """
+        rows 同 openai_helper 的 row dict；分數 >= threshold 者回傳與 LLM 估算相同格式的 dict，
+        其餘為 None（交給 LLM）。
+        """
+        items = [r.get('item') or r.get('工程項目') or '' for r in rows]
+        units = [r.get('unit') or r.get('單位') or '' for r in rows]
+        best, score = self.match(items, units)
+        out = []
+        for i, s in zip(best, score):
+            if i < 0 or s < self.threshold:
+                out.append(None)
+                continue
+            hit = self.library.iloc[i]
+            low, high = hit['gwp_low'], hit['gwp_high']
+            source = f"，來源 {hit['source']}" if isinstance(hit['source'], str) and hit['source'] else ''
+            out.append({
+                "mean": float(hit['gwp']),
+                "low": None if pd.isna(low) else float(low),
+                "high": None if pd.isna(high) else float(high),
+                "confidence": f"EPD 係數庫比對：{hit['name']}（{hit['unit'] or '-'}，相似度 {s:.2f}{source}）",
+            })
+        return out
+
+
+_index: Optional[FactorIndex] = None
+_index_path: Optional[str] = None
+_index_lock = threading.Lock()
+
+
+def get_index() -> Optional[FactorIndex]:
+    """依 EPD_LIBRARY 載入全域索引（未設定或檔案不存在時回傳 None）；門檻為 FACTOR_MATCH_THRESHOLD。"""
+    global _index, _index_path
+    path = os.getenv("EPD_LIBRARY")
+    if not path or not os.path.exists(path):
+        return None
+    if _index is None or _index_path != path:
+        with _index_lock:
+            if _index is None or _index_path != path:
+                threshold = float(os.getenv("FACTOR_MATCH_THRESHOLD", DEFAULT_THRESHOLD))
+                _index = FactorIndex(load_library(path), threshold=threshold)
+                _index_path = path
+    return _index
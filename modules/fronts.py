@@ -0,0 +1,270 @@
+import os, json, hashlib, threading
+import numpy as np
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from modules import metrics
+
+# Pareto 前緣快取：以「正規化後的輸入表格 + 優化參數」的雜湊為 key（即 front_id）
+DATA_DIR = Path(os.getenv("DATA_DIR", "data"))
+FRONT_DIR = DATA_DIR / "fronts"
+
+DEFAULT_MAX_ENTRIES = 500        # 磁碟上保留的前緣數
+DEFAULT_MEM_ENTRIES = 32         # 記憶體內保留的前緣數
+
+
+def front_key(items: List[str], coef: np.ndarray, params: Dict[str, Any]) -> str:
+    """
+    items：各列的工程項目；coef：(列數 × 目標數) 的目標係數。
+    數值取到小數第 9 位，避免 1 與 1.0、浮點誤差產生不同 key。
+    """
+    h = hashlib.sha256()
+    h.update('\x1f'.join(items).encode('utf-8'))
+    h.update(np.ascontiguousarray(np.round(np.asarray(coef, dtype=float), 9)).tobytes())
+    h.update(json.dumps(params, sort_keys=True, default=str).encode('utf-8'))
+    return h.hexdigest()
+
+
+def _valid_key(key: str) -> bool:
+    return len(key) == 64 and all(c in "0123456789abcdef" for c in key)
+
+
+class Front:
+    """一個 Pareto 前緣：X 為 (解數 × 列數) 的選取遮罩，F 為 (解數 × 目標數)。"""
+
+    def __init__(self, key: str, X: np.ndarray, F: np.ndarray, items: List[str], engine: str):
+        self.key = key
+        self.X = np.asarray(X, dtype=bool)
+        self.F = np.asarray(F, dtype=float)
+        self.items = list(items)
+        self.engine = engine
+
+    def __len__(self) -> int:
+        return len(self.F)
+
+    def solution(self, i: int) -> Dict[str, Any]:
+        items = np.asarray(self.items, dtype=object)[self.X[i]]
+        return {
+            "id": int(i),
+            "items": [str(item) for item in items],
+            "total_cost": float(self.F[i, 0]),
+            "total_carbon": float(self.F[i, 1]),
+            "total_eta": float(self.F[i, 2]),
+        }
+
+
+class FrontCache:
+    """
+    前緣以 npz 存於 DATA_DIR/fronts/<key>.npz（遮罩以 packbits 壓縮），
+    最近使用的前緣另保留在記憶體中；磁碟上超過 max_entries 時刪除最舊的檔案。
+    """
+
+    def __init__(self, path: Optional[Path] = None, max_entries: Optional[int] = None,
+                 mem_entries: int = DEFAULT_MEM_ENTRIES):
+        self.path = Path(path or os.getenv("FRONT_CACHE_PATH", FRONT_DIR))
+        self.max_entries = int(max_entries if max_entries is not None
+                               else os.getenv("FRONT_CACHE_MAX", DEFAULT_MAX_ENTRIES))
+        self.mem_entries = mem_entries
+        self.hits = 0
+        self.misses = 0
+        self._mem = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _file(self, key: str) -> Path:
+        return self.path / f"{key}.npz"
+
+    def _remember(self, front: Front) -> None:
+        self._mem[front.key] = front
+        self._mem.move_to_end(front.key)
+        while len(self._mem) > self.mem_entries:
+            self._mem.popitem(last=False)
+
+    def get(self, key: str) -> Optional[Front]:
+        if not _valid_key(key):
+            return None
+        with self._lock:
+            front = self._mem.get(key)
+            if front is not None:
+                self._mem.move_to_end(key)
+                self.hits += 1
+                return front
+        path = self._file(key)
+        if not path.exists():
+            with self._lock:
+                self.misses += 1
+            return None
+        with np.load(path, allow_pickle=False) as z:
+            n_rows = int(z["n_rows"])
+            X = np.unpackbits(z["X"], axis=1, count=n_rows).astype(bool)
+            front = Front(key, X, z["F"], z["items"].tolist(), str(z["engine"]))
+        with self._lock:
+            self._remember(front)
+            self.hits += 1
+        return front
+
+    def put(self, front: Front) -> None:
+        self.path.mkdir(exist_ok=True, parents=True)
+        path = self._file(front.key)
+        # 先寫暫存檔再 rename，與 uploads 相同
+        tmp = path.with_name(f".{front.key}.{os.getpid()}.tmp.npz")
+        np.savez(tmp, X=np.packbits(front.X, axis=1), F=front.F,
+                 items=np.asarray(front.items, dtype=str), engine=np.str_(front.engine),
+                 n_rows=np.int64(front.X.shape[1]))
+        os.replace(tmp, path)
+        with self._lock:
+            self._remember(front)
+        self._evict()
+
+    def _evict(self) -> None:
+        files = sorted(self.path.glob("*.npz"), key=lambda p: p.stat().st_mtime)
+        for p in files[:max(0, len(files) - self.max_entries)]:
+            p.unlink(missing_ok=True)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "entries": len(list(self.path.glob("*.npz"))) if self.path.exists() else 0,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+_cache: Optional[FrontCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> Optional[FrontCache]:
+    """取得全域前緣快取；設定 FRONT_CACHE=0 可停用。"""
+    global _cache
+    if os.getenv("FRONT_CACHE", "1") == "0":
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = FrontCache()
+    return _cache
+
+
+@metrics.register_collector
+def _collect():
+    cache = _cache
+    if cache is None:
+        return []
+    return [
+        ("front_cache_hits_total", "counter", "Pareto 前緣快取命中次數", [({}, cache.hits)]),
+        ("front_cache_misses_total", "counter", "Pareto 前緣快取未命中次數", [({}, cache.misses)]),
+    ]
+
+
+# ---------------------------------------------------------------------
+# 前緣查詢：篩選 + 挑選代表解
+
+def _normalized(F: np.ndarray) -> np.ndarray:
+    span = F.max(axis=0) - F.min(axis=0)
+    return (F - F.min(axis=0)) / np.where(span > 0, span, 1)
+
+
+def filter_mask(F: np.ndarray, max_cost: Optional[float] = None, max_carbon: Optional[float] = None,
+                max_eta: Optional[float] = None) -> np.ndarray:
+    mask = np.ones(len(F), dtype=bool)
+    for col, cap in enumerate((max_cost, max_carbon, max_eta)):
+        if cap is not None:
+            mask &= F[:, col] <= cap
+    return mask
+
+
+def knee_index(F: np.ndarray) -> int:
+    """
+    膝點：正規化後，離「各目標最佳解（anchor）所成超平面」最遠（往理想點方向）的解；
+    超平面無法決定時（目標數多於極端解、或共線）改取最接近理想點者。
+    """
+    Fn = _normalized(F)
+    active = np.flatnonzero(np.ptp(Fn, axis=0) > 0)
+    if len(active) == 0:
+        return 0
+    Fn = Fn[:, active]
+    extremes = Fn[Fn.argmin(axis=0)] if len(active) > 1 else None
+    if extremes is not None:
+        try:
+            a = np.linalg.solve(extremes, np.ones(len(active)))
+            if np.all(np.isfinite(a)):
+                return int(np.argmax((1 - Fn @ a) / np.linalg.norm(a)))
+        except np.linalg.LinAlgError:
+            pass
+    return int(np.argmin(np.linalg.norm(Fn, axis=1)))
+
+
+def spread_indices(F: np.ndarray, k: int) -> List[int]:
+    """
+    從前緣挑出 k 個分散的代表解：先取成本最低者，
+    之後每次取與已選解（正規化後）最遠的解。
+    """
+    if len(F) == 0:
+        return []
+    Fn = _normalized(F)
+    picked = [int(np.argmin(F[:, 0]))]
+    dist = np.linalg.norm(Fn - Fn[picked[0]], axis=1)
+    while len(picked) < min(k, len(F)):
+        i = int(np.argmax(dist))
+        if dist[i] <= 0:
+            break
+        picked.append(i)
+        dist = np.minimum(dist, np.linalg.norm(Fn - Fn[i], axis=1))
+    return picked
+
+
+def crowding_distance(F: np.ndarray) -> np.ndarray:
+    """NSGA-II 的擁擠距離（正規化後各目標相鄰解距離之和），兩端點為 inf。"""
+    n, m = F.shape
+    if n <= 2:
+        return np.full(n, np.inf)
+    Fn = _normalized(F)
+    dist = np.zeros(n)
+    for j in range(m):
+        order = np.argsort(Fn[:, j], kind='stable')
+        col = Fn[order, j]
+        gap = np.empty(n)
+        gap[[0, -1]] = np.inf
+        gap[1:-1] = col[2:] - col[:-2]
+        dist[order] += gap
+    return dist
+
+
+def crowding_top_k(F: np.ndarray, k: int) -> List[int]:
+    """擁擠距離最大的 k 個解（兩端的極端解優先），即前緣上最分散的代表解。"""
+    order = np.argsort(-crowding_distance(F), kind='stable')
+    return [int(i) for i in order[:k]]
+
+
+SELECTIONS = ("spread", "knee", "crowding", "all")
+
+
+def query(front: Front, select: str = "crowding", k: int = 5, **filters) -> Dict[str, Any]:
+    """
+    依篩選條件（max_cost / max_carbon / max_eta）縮小前緣後挑選解：
+    knee（膝點 1 個）、crowding（擁擠距離前 k 個）、spread（依序取最遠者 k 個）、all（全部，依成本排序）。
+    """
+    if select not in SELECTIONS:
+        raise ValueError(f"未知的挑選方式：{select}")
+    if k < 1:
+        raise ValueError("k 必須 >= 1")
+    idx = np.flatnonzero(filter_mask(front.F, **filters))
+    F = front.F[idx]
+    if len(idx) == 0:
+        picked = []
+    elif select == "knee":
+        picked = [knee_index(F)]
+    elif select == "crowding":
+        picked = crowding_top_k(F, k)
+    elif select == "spread":
+        picked = spread_indices(F, k)
+    else:
+        picked = list(np.argsort(F[:, 0], kind='stable'))
+    return {
+        "front_id": front.key,
+        "engine": front.engine,
+        "front_size": len(front),
+        "matched": int(len(idx)),
+        "solutions": [front.solution(int(idx[i])) for i in picked],
+    }
@@ -0,0 +1,193 @@
+import os, json, math, time, sqlite3, hashlib, threading, unicodedata
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional
+from modules import metrics
+
+# 預設存放於 DATA_DIR，與 app/main.py 一致
+DATA_DIR = Path(os.getenv("DATA_DIR", "data"))
+
+DEFAULT_TTL = 30 * 24 * 3600      # 30 天
+DEFAULT_MAX_ENTRIES = 100_000
+# 單次 SELECT ... IN (...) 的參數上限（舊版 SQLite 限制為 999）
+_QUERY_CHUNK = 500
+# 每寫入幾筆才執行一次過期 / 超量淘汰（淘汰需掃描索引，不必每筆都做）；筆數最多暫時超出上限這麼多
+EVICT_EVERY = 256
+
+
+def norm_text(value) -> str:
+    """全形轉半形、去頭尾空白、合併連續空白、轉小寫，確保同義字串得到同一 key。"""
+    if value is None:
+        return ''
+    if isinstance(value, float) and math.isnan(value):
+        return ''
+    text = unicodedata.normalize("NFKC", str(value))
+    return ' '.join(text.split()).lower()
+
+
+def _qty_bucket(qty) -> str:
+    """數量只取數量級（10 的次方），GWP 因子本身與數量無關，避免 1 與 1.0 產生不同 key。"""
+    try:
+        q = float(str(qty).replace(',', ''))
+    except (TypeError, ValueError):
+        return ''
+    if math.isnan(q) or q <= 0:
+        return '0'
+    return str(int(math.floor(math.log10(q))))
+
+
+def make_key(item, unit, qty, remark, model: str, prompt_version: str) -> str:
+    parts = [
+        norm_text(item), norm_text(unit), _qty_bucket(qty),
+        norm_text(remark), model or '', prompt_version or '',
+    ]
+    return hashlib.sha256('\x1f'.join(parts).encode('utf-8')).hexdigest()
+
+
+class GwpCache:
+    """
+    以 SQLite 保存 estimate_factor 的結果（content-addressed）。
+    - TTL：超過 ttl 秒的資料視為過期
+    - LRU：筆數超過 max_entries 時，依最後使用時間淘汰
+    淘汰每 EVICT_EVERY 次寫入（上限較小時為上限的 1/10）才做一次，筆數可能暫時略超過上限。
+    """
+
+    def __init__(self, path: Optional[Path] = None, ttl: Optional[float] = None,
+                 max_entries: Optional[int] = None):
+        self.path = Path(path or os.getenv("GWP_CACHE_PATH", DATA_DIR / "gwp_cache.sqlite3"))
+        self.ttl = float(ttl if ttl is not None else os.getenv("GWP_CACHE_TTL", DEFAULT_TTL))
+        self.max_entries = int(max_entries if max_entries is not None
+                               else os.getenv("GWP_CACHE_MAX", DEFAULT_MAX_ENTRIES))
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._evict_every = min(EVICT_EVERY, max(1, self.max_entries // 10)) if self.max_entries > 0 \
+            else EVICT_EVERY
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(exist_ok=True, parents=True)
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS gwp_cache ("
+            " key TEXT PRIMARY KEY,"
+            " item TEXT,"
+            " value TEXT NOT NULL,"
+            " created REAL NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_gwp_cache_last_used ON gwp_cache(last_used)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_gwp_cache_created ON gwp_cache(created)")
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        一次查詢多個 key，回傳 {key: value}（未命中或已過期的 key 不會出現）。
+        查詢分段合併成少數幾次 SELECT，過期刪除與 last_used 更新各以一次 executemany 寫入、
+        只 commit 一次，避免每筆命中都觸發一次寫入。
+        """
+        keys = list(dict.fromkeys(keys))
+        now = time.time()
+        found: Dict[str, Dict[str, Any]] = {}
+        with self._lock:
+            rows = []
+            for i in range(0, len(keys), _QUERY_CHUNK):
+                chunk = keys[i:i + _QUERY_CHUNK]
+                rows += self._conn.execute(
+                    f"SELECT key, value, created FROM gwp_cache WHERE key IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall()
+            expired = []
+            for key, value, created in rows:
+                if self.ttl > 0 and now - created > self.ttl:
+                    expired.append((key,))
+                else:
+                    found[key] = value
+            if expired:
+                self._conn.executemany("DELETE FROM gwp_cache WHERE key = ?", expired)
+            if found:
+                self._conn.executemany("UPDATE gwp_cache SET last_used = ? WHERE key = ?",
+                                       [(now, key) for key in found])
+            if expired or found:
+                self._conn.commit()
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return {key: json.loads(value) for key, value in found.items()}
+
+    def put(self, key: str, value: Dict[str, Any], item: str = '') -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO gwp_cache (key, item, value, created, last_used)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (key, norm_text(item), json.dumps(value, ensure_ascii=False), now, now),
+            )
+            self._puts += 1
+            if self._puts >= self._evict_every:
+                self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now: float) -> None:
+        # 呼叫端需持有 self._lock；過期的資料在 get 時也會被略過，延後刪除不影響結果
+        self._puts = 0
+        if self.ttl > 0:
+            self._conn.execute("DELETE FROM gwp_cache WHERE created < ?", (now - self.ttl,))
+        if self.max_entries > 0:
+            self._conn.execute(
+                "DELETE FROM gwp_cache WHERE key IN ("
+                " SELECT key FROM gwp_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def invalidate(self, item: Optional[str] = None) -> int:
+        """item 為 None 時清空全部，否則只刪除該工程項目的所有快取；回傳刪除筆數。"""
+        with self._lock:
+            if item is None:
+                cur = self._conn.execute("DELETE FROM gwp_cache")
+            else:
+                cur = self._conn.execute("DELETE FROM gwp_cache WHERE item = ?", (norm_text(item),))
+            self._conn.commit()
+            return cur.rowcount
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM gwp_cache").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            "path": str(self.path),
+            "entries": size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "ttl": self.ttl,
+            "max_entries": self.max_entries,
+        }
+
+
+_cache: Optional[GwpCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> Optional[GwpCache]:
+    """取得全域快取；設定 GWP_CACHE=0 可停用。"""
+    global _cache
+    if os.getenv("GWP_CACHE", "1") == "0":
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = GwpCache()
+    return _cache
+
+
+@metrics.register_collector
+def _collect():
+    # 只讀取已存在的快取物件上的計數，不在 scrape 時建立快取
+    cache = _cache
+    if cache is None:
+        return []
+    return [
+        ("gwp_cache_hits_total", "counter", "GWP 快取命中次數", [({}, cache.hits)]),
+        ("gwp_cache_misses_total", "counter", "GWP 快取未命中次數", [({}, cache.misses)]),
+    ]
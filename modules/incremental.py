@@ -0,0 +1,331 @@
+import os, time, uuid, asyncio, threading
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+from modules import openai_helper
+
+CARBON_COL = '碳排放量'
+# 由估算 / 計算產生的欄位，不列入列指紋（gwp 另外比對：有填值才視為手動修改）
+DERIVED_COLS = ('gwp', 'gwp_low', 'gwp_high', 'gwp_remark', CARBON_COL)
+# 估算時一併寫入的上下限（uncertainty 用）
+BOUND_COLS = ('gwp_low', 'gwp_high')
+
+
+def input_columns(df: pd.DataFrame) -> List[str]:
+    return [c for c in df.columns if c not in DERIVED_COLS]
+
+
+def _canonical(col: pd.Series) -> pd.Series:
+    # 數字統一格式（10、10.0、"10" 視為相同），其餘轉字串；缺值一律為 "None"
+    num = pd.to_numeric(col, errors='coerce')
+    text = col.astype(object).where(col.notna(), None).astype(str)
+    return text.where(num.isna(), num.astype(float).astype(str))
+
+
+def row_fingerprints(df: pd.DataFrame) -> np.ndarray:
+    """每列內容的 64-bit 雜湊（逐欄向量化），用於比對整張表格重送時哪些列有變動。"""
+    if df.empty:
+        return np.empty(0, dtype=np.uint64)
+    text = pd.DataFrame({i: _canonical(df.iloc[:, i]) for i in range(df.shape[1])})
+    return pd.util.hash_pandas_object(text, index=False).to_numpy()
+
+
+def _pair(old_keys, new_keys) -> np.ndarray:
+    """依 key 與同 key 內的出現次序一對一配對，回傳新各列對應的舊列位置（沒有對應為 -1）。"""
+    old = pd.DataFrame({'k': old_keys, 'pos': np.arange(len(old_keys))})
+    old['n'] = old.groupby('k', sort=False).cumcount()
+    new = pd.DataFrame({'k': new_keys})
+    new['n'] = new.groupby('k', sort=False).cumcount()
+    # left merge 保留新表格的列順序
+    return new.merge(old, on=['k', 'n'], how='left')['pos'].fillna(-1).to_numpy(dtype=int)
+
+
+def _identity(df: pd.DataFrame, idx) -> List[str]:
+    # item + unit，判斷內容有變動的列是否為「同一列被修改」
+    parts = [df[c].iloc[idx].astype(str).to_numpy(dtype=object) if c in df.columns
+             else np.full(len(idx), '', dtype=object) for c in ('item', 'unit')]
+    return list(parts[0] + '\x1f' + parts[1])
+
+
+class Project:
+    """
+    可編輯的估碳表格：保存每列的 GWP 來源與估算 key、碳排量，以及各段落 / 全案合計。
+    編輯時只處理變動的列：
+    - 估算欄位（item、unit、數量級、remark）變動且 GWP 為估算值 → 重新估算（先查表內 memo 與 gwp_cache）
+    - 其他變動（如同數量級內改數量、手動填 gwp）→ 只重算該列碳排量
+    合計以差額更新，不重新加總整張表；已無任何列的段落自合計移除。
+    """
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.df = pd.DataFrame()
+        self.fp = np.empty(0, dtype=np.uint64)
+        self.keys: List[str] = []
+        self.estimated = np.empty(0, dtype=bool)
+        self.section_totals: Dict[str, float] = {}
+        self.section_rows: Dict[str, int] = {}
+        self.total = 0.0
+        self.version = 0
+        self.updated = time.time()
+        # 表內估算結果：key -> 估算 dict，同一表格內重複項目只問一次
+        self._memo: Dict[str, Dict[str, Any]] = {}
+        self._lock = asyncio.Lock()
+
+    # -----------------------------------------------------------------
+    def _sections(self, idx) -> np.ndarray:
+        if 'section' not in self.df.columns:
+            return np.full(len(idx), '', dtype=object)
+        return self.df['section'].iloc[idx].fillna('').astype(str).to_numpy(dtype=object)
+
+    def _carbon(self, idx) -> np.ndarray:
+        gwp = pd.to_numeric(self.df['gwp'].iloc[idx], errors='coerce').fillna(0).to_numpy(dtype=float)
+        qty = pd.to_numeric(self.df['qty'].iloc[idx], errors='coerce').fillna(1).to_numpy(dtype=float)
+        return gwp * qty
+
+    def _add_totals(self, idx, carbon: np.ndarray, sign: float) -> None:
+        groups = pd.Series(carbon).groupby(self._sections(idx), sort=False)
+        for (section, value), count in zip(groups.sum().items(), groups.size()):
+            self.section_totals[section] = self.section_totals.get(section, 0.0) + sign * float(value)
+            self.section_rows[section] = self.section_rows.get(section, 0) + int(sign) * int(count)
+        self.total += sign * float(carbon.sum())
+
+    def _prune_sections(self) -> None:
+        for section in [s for s, n in self.section_rows.items() if n <= 0]:
+            del self.section_rows[section]
+            self.section_totals.pop(section, None)
+
+    def _row_keys(self, idx) -> List[str]:
+        rows = self.df.iloc[idx].to_dict(orient="records")
+        return [openai_helper._cache_key(r) for r in rows]
+
+    async def _estimate(self, idx: np.ndarray, progress=None) -> int:
+        """估算 idx 中 GWP 缺值的列，回傳實際送出估算的列數（memo 命中不計）。"""
+        missing = openai_helper._missing_gwp(self.df.iloc[idx]).to_numpy()
+        todo = idx[missing]
+        if len(todo) == 0:
+            return 0
+        keys = [self.keys[i] for i in todo]
+        ask = [i for i, k in zip(todo, keys) if k not in self._memo]
+        if ask:
+            rows = self.df.iloc[ask].to_dict(orient="records")
+            ests = await openai_helper.estimate_rows(rows, progress=progress)
+            for i, est in zip(ask, ests):
+                if est.get("mean") is not None:
+                    self._memo[self.keys[i]] = est
+        else:
+            ests = []
+        fresh = dict(zip(ask, ests))
+        gwp_col = self.df.columns.get_loc('gwp')
+        low_col, high_col = (self.df.columns.get_loc(c) for c in BOUND_COLS)
+        remark_col = self.df.columns.get_loc('gwp_remark')
+        for i, key in zip(todo, keys):
+            est = self._memo.get(key) or fresh.get(i) or openai_helper.FAILED
+            self.df.iat[i, gwp_col] = est.get("mean") if est.get("mean") is not None else 0
+            self.df.iat[i, low_col] = est.get("low")
+            self.df.iat[i, high_col] = est.get("high")
+            self.df.iat[i, remark_col] = est.get("confidence") or ""
+        self.estimated[todo] = True
+        return len(ask)
+
+    async def _refresh(self, idx: np.ndarray, progress=None) -> Dict[str, Any]:
+        """重新估算 / 計算 idx 各列並以差額更新合計（呼叫前先扣除舊值）。"""
+        idx = np.asarray(idx, dtype=int)
+        for i, key in zip(idx, self._row_keys(idx)):
+            self.keys[i] = key
+        asked = await self._estimate(idx, progress=progress)
+        carbon = self._carbon(idx)
+        self.df.iloc[idx, self.df.columns.get_loc(CARBON_COL)] = carbon
+        self._add_totals(idx, carbon, +1)
+        self._prune_sections()
+        self.fp[idx] = row_fingerprints(self.df[input_columns(self.df)].iloc[idx])
+        self.version += 1
+        self.updated = time.time()
+        return {"changed": [int(i) for i in idx], "estimated": asked}
+
+    def _retract(self, idx: np.ndarray) -> None:
+        if len(idx) == 0:
+            return
+        old = pd.to_numeric(self.df[CARBON_COL].iloc[idx], errors='coerce').fillna(0).to_numpy(dtype=float)
+        self._add_totals(idx, old, -1)
+
+    def _reset_estimates(self, idx: np.ndarray, before: pd.DataFrame) -> None:
+        """估算欄位變動、且 GWP 原為估算值（使用者未同時修改 gwp）的列，清空 GWP 以重新估算。"""
+        if len(idx) == 0:
+            return
+        after = self.df.iloc[idx]
+        keys = self._row_keys(idx)
+        changed_key = np.array([k != self.keys[i] for i, k in zip(idx, keys)], dtype=bool)
+        same_gwp = _canonical(after['gwp']).to_numpy() == _canonical(before['gwp']).to_numpy()
+        stale = idx[changed_key & self.estimated[idx] & same_gwp]
+        self.df.iloc[stale, self.df.columns.get_loc('gwp')] = None
+        # 使用者手動填入的 gwp 不再視為估算值，估算的上下限也一併清除
+        manual = idx[~same_gwp]
+        self.estimated[manual] = False
+        for col in BOUND_COLS:
+            self.df.iloc[manual, self.df.columns.get_loc(col)] = None
+        self.df.iloc[manual, self.df.columns.get_loc('gwp_remark')] = ""
+
+    # -----------------------------------------------------------------
+    def _match(self, df: pd.DataFrame, fp: np.ndarray):
+        """
+        新表格各列對應到的舊列位置（-1 為新增列），以及該列內容是否完全相同。
+        先以列指紋比對內容相同的列（不受插入 / 刪除造成的位移影響），
+        其餘的列再以 item + unit 配對，視為同一列被修改（可沿用先前的 gwp）。
+        """
+        src = np.full(len(df), -1, dtype=int)
+        if self.df.empty or input_columns(df) != input_columns(self.df):
+            # 欄位結構不同時無法逐列比對，整表重算（估算仍會命中 memo / gwp_cache）
+            return src, np.zeros(len(df), dtype=bool)
+        src = _pair(self.fp, fp)
+        same = src >= 0
+        free_new = np.flatnonzero(~same)
+        free_old = np.setdiff1d(np.arange(len(self.df)), src[same])
+        if len(free_new) and len(free_old):
+            pos = _pair(_identity(self.df, free_old), _identity(df, free_new))
+            src[free_new] = np.where(pos >= 0, free_old[pos], -1)
+        return src, same
+
+    async def load(self, df: pd.DataFrame, progress=None) -> Dict[str, Any]:
+        """
+        載入整張表格（首次建立或整表重送）。以列指紋比對：內容未變的列（不論位置是否移動）
+        直接沿用先前的 gwp / 碳排量，只處理變動或新增的列；少掉的列自合計扣除。
+        重送的表格可不含 gwp（沿用估算值）；gwp 有填且與先前不同時視為手動修改。
+        """
+        async with self._lock:
+            df = openai_helper._prepare(df.reset_index(drop=True).astype(object))
+            for col in (*BOUND_COLS, 'gwp_remark', CARBON_COL):
+                if col not in df.columns:
+                    df[col] = None
+            fp = row_fingerprints(df[input_columns(df)])
+            n_old = len(self.df)
+            src, same = self._match(df, fp)
+            paired = np.flatnonzero(src >= 0)
+            unchanged = np.zeros(len(df), dtype=bool)
+            if len(paired):
+                old, new = self.df.iloc[src[paired]], df.iloc[paired]
+                given = ~openai_helper._missing_gwp(new).to_numpy()
+                gwp_edit = given & (_canonical(new['gwp']).to_numpy() != _canonical(old['gwp']).to_numpy())
+                unchanged[paired] = same[paired] & ~gwp_edit
+                keep = unchanged[paired]
+                for col in DERIVED_COLS:
+                    df.iloc[paired[keep], df.columns.get_loc(col)] = old[col].iloc[keep].to_numpy(dtype=object)
+                # 修改過的列若未重填 gwp，先帶入舊值，再由 _reset_estimates 判斷是否需重新估算
+                carry = ~keep & ~given
+                for col in ('gwp', *BOUND_COLS):
+                    df.iloc[paired[carry], df.columns.get_loc(col)] = old[col].iloc[carry].to_numpy(dtype=object)
+
+            self._retract(np.setdiff1d(np.arange(n_old), src[unchanged]))
+            stale = paired[~unchanged[paired]]
+            before = self.df.iloc[src[stale]].copy()
+            hit = src >= 0
+            fp_new = np.zeros(len(df), dtype=np.uint64)
+            fp_new[hit] = self.fp[src[hit]]
+            estimated = np.zeros(len(df), dtype=bool)
+            estimated[hit] = self.estimated[src[hit]]
+            self.keys = [self.keys[i] if i >= 0 else '' for i in src]
+            self.fp, self.estimated, self.df = fp_new, estimated, df
+            self._reset_estimates(stale, before)
+            dirty = np.flatnonzero(~unchanged)
+            if len(dirty):
+                return await self._refresh(dirty, progress=progress)
+            self._prune_sections()
+            if n_old != len(df) or (src != np.arange(len(df))).any():
+                # 只有刪除或重新排列列
+                self.version += 1
+                self.updated = time.time()
+            return {"changed": [], "estimated": 0}
+
+    async def edit(self, updates: Optional[List[Dict[str, Any]]] = None,
+                   append: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+        """
+        updates：[{"row": 列號, 欄位: 新值, ...}]；append：新增的列。
+        成本與變動列數成正比，與表格大小無關。
+        """
+        async with self._lock:
+            updates = updates or []
+            append = append or []
+            n = len(self.df)
+            rows = []
+            for u in updates:
+                i = u.get("row")
+                if not isinstance(i, int) or not 0 <= i < n:
+                    raise IndexError(f"列號超出範圍：{i}")
+                rows.append(i)
+            idx = np.array(sorted(set(rows)), dtype=int)
+            before = self.df.iloc[idx].copy()
+            self._retract(idx)
+            for u in updates:
+                for col, value in u.items():
+                    if col == "row":
+                        continue
+                    # 中文欄名寫入對應的英文欄位（估算與計算皆以英文欄為準）；原表格已有該中文欄時一併更新，
+                    # 但不新增中文欄，否則下次整表重送時欄位結構不同而整表重算
+                    en = openai_helper.COLUMN_MAP.get(col, col)
+                    if en not in self.df.columns:
+                        self.df[en] = None
+                    self.df.at[u["row"], en] = value
+                    if col != en and col in self.df.columns:
+                        self.df.at[u["row"], col] = value
+            self._reset_estimates(idx, before)
+
+            if append:
+                extra = openai_helper._prepare(pd.DataFrame(append).astype(object))
+                self.df = pd.concat([self.df, extra.reindex(columns=self.df.columns).astype(object)],
+                                    ignore_index=True)
+                new = np.arange(n, len(self.df))
+                self.fp = np.concatenate([self.fp, np.zeros(len(new), dtype=np.uint64)])
+                self.keys += [''] * len(new)
+                self.estimated = np.concatenate([self.estimated, np.zeros(len(new), dtype=bool)])
+                idx = np.concatenate([idx, new])
+            return await self._refresh(idx)
+
+    def totals(self) -> Dict[str, Any]:
+        return {
+            "total": self.total,
+            "sections": [{"section": s, "carbon": v} for s, v in self.section_totals.items()],
+        }
+
+    def rows(self, idx) -> pd.DataFrame:
+        return self.df.iloc[list(idx)]
+
+    def info(self) -> Dict[str, Any]:
+        return {"project_id": self.id, "rows": len(self.df), "version": self.version,
+                **self.totals()}
+
+
+class ProjectRegistry:
+    """記憶體內的可編輯表格；超過 keep 份時淘汰最久未更新者。"""
+
+    def __init__(self, keep: int = 50):
+        self.keep = keep
+        self._projects: "OrderedDict[str, Project]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self) -> Project:
+        project = Project()
+        with self._lock:
+            self._projects[project.id] = project
+            while len(self._projects) > self.keep:
+                self._projects.popitem(last=False)
+        return project
+
+    def get(self, project_id: str) -> Optional[Project]:
+        with self._lock:
+            project = self._projects.get(project_id)
+            if project is not None:
+                self._projects.move_to_end(project_id)
+            return project
+
+
+_registry: Optional[ProjectRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_registry() -> ProjectRegistry:
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = ProjectRegistry(keep=int(os.getenv("PROJECT_KEEP", 50)))
+    return _registry
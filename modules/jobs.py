@@ -0,0 +1,122 @@
+import os, time, uuid, threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Protocol
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+
+class Job:
+    """單一背景工作的狀態；version 每次更新遞增，供 SSE / 輪詢判斷是否有新進度。"""
+
+    def __init__(self, kind: str):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.status = QUEUED
+        self.stage = ''
+        self.done = 0
+        self.total = 0
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.created = time.time()
+        self.updated = self.created
+        self.version = 0
+        self._lock = threading.Lock()
+
+    def update(self, **fields) -> None:
+        with self._lock:
+            for k, v in fields.items():
+                setattr(self, k, v)
+            self.updated = time.time()
+            self.version += 1
+
+    def progress(self, done: int, total: int, stage: Optional[str] = None) -> None:
+        """傳給各模組的進度回呼（progress(done, total)）。"""
+        if stage is None:
+            self.update(done=done, total=total)
+        else:
+            self.update(done=done, total=total, stage=stage)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (DONE, FAILED)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "stage": self.stage,
+            "done": self.done,
+            "total": self.total,
+            "error": self.error,
+            "created": self.created,
+            "updated": self.updated,
+        }
+
+
+class JobBackend(Protocol):
+    """執行工作的後端；目前只有本機執行緒池，之後可換成外部佇列。"""
+
+    def submit(self, fn: Callable[[], None]) -> None: ...
+
+
+class LocalBackend:
+    def __init__(self, workers: int = 2):
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="job")
+
+    def submit(self, fn: Callable[[], None]) -> None:
+        self._pool.submit(fn)
+
+
+class JobManager:
+    def __init__(self, backend: Optional[JobBackend] = None, keep: int = 200):
+        self.backend = backend or LocalBackend(int(os.getenv("JOB_WORKERS", 2)))
+        self.keep = keep
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, kind: str, fn: Callable[[Job], Any]) -> Job:
+        """fn(job) 在背景執行，回傳值存為 job.result；可透過 job.progress 回報進度。"""
+        job = Job(kind)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+
+        def run():
+            job.update(status=RUNNING)
+            try:
+                result = fn(job)
+            except Exception as e:
+                detail = getattr(e, "detail", None) or str(e)
+                job.update(status=FAILED, error=str(detail))
+            else:
+                job.update(status=DONE, result=result)
+
+        self.backend.submit(run)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _prune(self) -> None:
+        # 只淘汰已結束的舊工作，執行中的保留
+        excess = len(self._jobs) - self.keep
+        if excess <= 0:
+            return
+        for jid in [j.id for j in self._jobs.values() if j.finished][:excess]:
+            del self._jobs[jid]
+
+
+_manager: Optional[JobManager] = None
+_manager_lock = threading.Lock()
+
+
+def get_manager() -> JobManager:
+    global _manager
+    if _manager is None:
+        with _manager_lock:
+            if _manager is None:
+                _manager = JobManager(keep=int(os.getenv("JOB_KEEP", 200)))
+    return _manager
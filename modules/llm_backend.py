@@ -0,0 +1,180 @@
+import os, re, json, time, random, hashlib, threading
+from typing import Any, Dict, List, Optional
+from modules import metrics
+
+# LLM 後端：openai_helper 只透過 get_backend().chat(messages, model) 取得回應文字。
+# LLM_BACKEND=openai（預設）呼叫 OpenAI API；LLM_BACKEND=fake 為離線、可重現的替身，
+# 用於壓測與基準量測，不需 API key。
+
+BACKENDS = ("openai", "fake")
+
+
+class OpenAIBackend:
+    """OpenAI Chat Completions；client 於第一次呼叫時才建立（OPENAI_BASE_URL 可指向相容服務）。"""
+
+    name = "openai"
+
+    def __init__(self):
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._build_client()
+        return self._client
+
+    @staticmethod
+    def _build_client():
+        # openai SDK 載入成本高，第一次呼叫時才 import；
+        # 全域共用一個 client，連線池大小對齊 LLM_CONCURRENCY，keep-alive 連線在執行緒間重用
+        import httpx
+        from openai import OpenAI, DefaultHttpxClient
+        size = int(os.getenv("LLM_CONCURRENCY", 8))
+        limits = httpx.Limits(max_connections=size, max_keepalive_connections=size)
+        return OpenAI(http_client=DefaultHttpxClient(limits=limits),
+                      timeout=float(os.getenv("LLM_TIMEOUT", 60)))
+
+    def chat(self, messages: List[Dict[str, str]], model: str) -> str:
+        resp = self.client.chat.completions.create(model=model, messages=messages)
+        usage = getattr(resp, "usage", None)
+        if usage is not None:
+            metrics.LLM_TOKENS.inc(usage.prompt_tokens or 0, backend=self.name, type="prompt")
+            metrics.LLM_TOKENS.inc(usage.completion_tokens or 0, backend=self.name, type="completion")
+        return resp.choices[0].message.content
+
+
+class FakeBackendError(RuntimeError):
+    pass
+
+
+# 批次 prompt 會寫明「長度必須為 N」
+_BATCH_LEN = re.compile(r"長度必須為\s*(\d+)")
+
+
+class FakeBackend:
+    """
+    離線 LLM 替身：回應內容由 prompt 的雜湊決定（同一列永遠得到同一個估算值），
+    並可模擬延遲、錯誤與格式錯誤的 JSON：
+    - latency / jitter：每次呼叫 sleep latency ± jitter 秒
+    - error_rate：拋出 FakeBackendError 的機率
+    - malformed_rate：回傳無法解析之 JSON 的機率
+    - seed：錯誤 / 延遲抽樣的亂數種子
+    """
+
+    name = "fake"
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 malformed_rate: float = 0.0, seed: Optional[int] = None):
+        self.latency = max(0.0, float(latency))
+        self.jitter = max(0.0, float(jitter))
+        self.error_rate = float(error_rate)
+        self.malformed_rate = float(malformed_rate)
+        self.calls = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "FakeBackend":
+        seed = os.getenv("LLM_FAKE_SEED")
+        return cls(latency=float(os.getenv("LLM_FAKE_LATENCY", 0.0)),
+                   jitter=float(os.getenv("LLM_FAKE_JITTER", 0.0)),
+                   error_rate=float(os.getenv("LLM_FAKE_ERROR_RATE", 0.0)),
+                   malformed_rate=float(os.getenv("LLM_FAKE_MALFORMED_RATE", 0.0)),
+                   seed=int(seed) if seed else None)
+
+    @staticmethod
+    def _estimate(text: str) -> Dict[str, Any]:
+        h = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big")
+        mean = round(1 + (h % 99900) / 100, 2)
+        return {"mean": mean, "low": round(mean * 0.8, 2), "high": round(mean * 1.2, 2),
+                "confidence": "離線模擬估算（FakeBackend）"}
+
+    def reply(self, messages: List[Dict[str, str]]) -> str:
+        """不含延遲與錯誤的回應內容。"""
+        prompt = messages[-1]["content"] if messages else ""
+        m = _BATCH_LEN.search(prompt)
+        if m:
+            n = int(m.group(1))
+            return json.dumps([self._estimate(f"{prompt}\x1f{i}") for i in range(n)], ensure_ascii=False)
+        return json.dumps(self._estimate(prompt), ensure_ascii=False)
+
+    def chat(self, messages: List[Dict[str, str]], model: str) -> str:
+        with self._lock:
+            self.calls += 1
+            delay = self.latency + self._rng.uniform(-self.jitter, self.jitter)
+            roll = self._rng.random()
+        if delay > 0:
+            time.sleep(delay)
+        if roll < self.error_rate:
+            raise FakeBackendError("模擬 LLM 呼叫失敗")
+        text = self.reply(messages)
+        metrics.LLM_TOKENS.inc(sum(len(m.get("content") or "") for m in messages), backend=self.name, type="prompt")
+        metrics.LLM_TOKENS.inc(len(text), backend=self.name, type="completion")
+        if roll < self.error_rate + self.malformed_rate:
+            return text[:len(text) // 2]
+        return text
+
+
+def fake_server(backend: Optional[FakeBackend] = None):
+    """
+    OpenAI 相容的本機假服務（POST /v1/chat/completions），讓 OpenAIBackend 走完整 HTTP 路徑：
+        uvicorn "modules.llm_backend:fake_server()" --factory --port 8900
+        OPENAI_BASE_URL=http://127.0.0.1:8900/v1
+    """
+    from fastapi import FastAPI, HTTPException
+    from fastapi.concurrency import run_in_threadpool
+
+    backend = backend or FakeBackend.from_env()
+    app = FastAPI(title="Fake LLM")
+
+    @app.post("/v1/chat/completions")
+    async def completions(body: Dict[str, Any]):
+        try:
+            text = await run_in_threadpool(backend.chat, body.get("messages") or [], body.get("model", ""))
+        except FakeBackendError as e:
+            raise HTTPException(status_code=500, detail=str(e))
+        return {
+            "id": f"fake-{backend.calls}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", ""),
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": text}}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        }
+
+    return app
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def load_env() -> None:
+    """載入 .env（不覆寫既有環境變數）；app.main 啟動時已呼叫，CLI / 背景腳本則在第一次用到 LLM 時載入。"""
+    from dotenv import load_dotenv
+    load_dotenv()
+
+
+def get_backend():
+    """依 LLM_BACKEND 建立全域後端（openai / fake）。"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                load_env()
+                name = os.getenv("LLM_BACKEND", "openai").lower()
+                if name not in BACKENDS:
+                    raise ValueError(f"LLM_BACKEND 必須為 {', '.join(BACKENDS)} 之一：{name}")
+                _backend = FakeBackend.from_env() if name == "fake" else OpenAIBackend()
+    return _backend
+
+
+def set_backend(backend) -> None:
+    """替換全域後端（壓測腳本直接注入已設定好的 FakeBackend）。"""
+    global _backend
+    with _backend_lock:
+        _backend = backend
@@ -0,0 +1,118 @@
+import os, time, random, asyncio, threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterable, List, Optional
+
+# 進度回呼：progress(已完成筆數, 總筆數)
+Progress = Optional[Callable[[int, int], None]]
+
+
+class TokenBucket:
+    """
+    執行緒安全的 token bucket。reserve() 預約一個 token 並回傳需等待的秒數，
+    不在鎖內 sleep，因此可同時被多個 event loop / 執行緒共用（例如多個背景工作）。
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = float(rate)
+        self.burst = max(1, int(burst))
+        self._tokens = float(self.burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+
+class EstimationEngine:
+    """
+    以有上限的執行緒池執行同步的 LLM 呼叫，外層用 asyncio 排程：
+    - concurrency：同時進行的呼叫數（即執行緒池大小，全域共用）
+    - rate / burst：每秒請求數上限（token bucket）
+    - max_retries / base_delay：失敗時以指數退避加隨機抖動重試
+    - batch_size：每次 prompt 打包的項目數，由呼叫端決定如何分批
+    """
+
+    def __init__(self, concurrency: int = 8, rate: float = 5.0, burst: int = 5,
+                 max_retries: int = 3, base_delay: float = 1.0, batch_size: int = 1):
+        self.concurrency = max(1, int(concurrency))
+        self.max_retries = max(0, int(max_retries))
+        self.base_delay = float(base_delay)
+        self.batch_size = max(1, int(batch_size))
+        self.bucket = TokenBucket(rate, burst)
+        self._pool = ThreadPoolExecutor(max_workers=self.concurrency,
+                                        thread_name_prefix="llm")
+
+    async def run(self, fn: Callable[..., Any], *args) -> Any:
+        """執行單一呼叫；超過重試次數後拋出最後一次的例外。"""
+        loop = asyncio.get_running_loop()
+        attempt = 0
+        while True:
+            wait = self.bucket.reserve()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            try:
+                return await loop.run_in_executor(self._pool, fn, *args)
+            except Exception:
+                if attempt >= self.max_retries:
+                    raise
+                # full jitter：避免大量請求同時重試
+                delay = self.base_delay * (2 ** attempt) * random.uniform(0.5, 1.5)
+                attempt += 1
+                await asyncio.sleep(delay)
+
+    async def map(self, fn: Callable[[Any], Any], items: Iterable[Any],
+                  progress: Progress = None,
+                  weight: Callable[[Any], int] = lambda _: 1) -> List[Any]:
+        """
+        並行執行 fn(item)，結果順序與 items 相同。
+        最終仍失敗的項目以例外物件放在對應位置，由呼叫端決定如何處理。
+        weight 用於進度計算（例如一個批次代表多列）。
+        """
+        items = list(items)
+        total = sum(weight(it) for it in items)
+        done = 0
+
+        async def one(it):
+            nonlocal done
+            try:
+                return await self.run(fn, it)
+            except Exception as e:
+                return e
+            finally:
+                done += weight(it)
+                if progress is not None:
+                    progress(done, total)
+
+        if progress is not None:
+            progress(0, total)
+        return await asyncio.gather(*(one(it) for it in items))
+
+
+_engine: Optional[EstimationEngine] = None
+_engine_lock = threading.Lock()
+
+
+def get_engine() -> EstimationEngine:
+    """全域共用的估算引擎，讓所有請求共用同一份並行與速率額度。"""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = EstimationEngine(
+                    concurrency=int(os.getenv("LLM_CONCURRENCY", 8)),
+                    rate=float(os.getenv("LLM_RPS", 5)),
+                    burst=int(os.getenv("LLM_BURST", 5)),
+                    max_retries=int(os.getenv("LLM_MAX_RETRIES", 3)),
+                    base_delay=float(os.getenv("LLM_RETRY_DELAY", 1.0)),
+                    batch_size=int(os.getenv("LLM_BATCH_SIZE", 1)),
+                )
+    return _engine
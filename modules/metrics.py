@@ -0,0 +1,252 @@
+import os, time, math, threading, logging, contextvars
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# 內建指標：計數器 / 直方圖，以 Prometheus 文字格式輸出（GET /metrics）。
+# 不依賴 prometheus_client；每次紀錄只是一次加鎖的加法，可常駐開啟。
+# METRICS=0 時 span / 計數皆不紀錄。
+
+logger = logging.getLogger("carbon.trace")
+
+# 秒；涵蓋單次 LLM 呼叫到整份 PDF 解析
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+GENERATION_BUCKETS = (10, 20, 50, 100, 150, 200, 300, 500, 1000)
+
+
+def enabled() -> bool:
+    return os.getenv("METRICS", "1") != "0"
+
+
+def _fmt(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        if not enabled():
+            return
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(str(labels.get(n, "")) for n in self.labelnames), 0.0)
+
+    def expose(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        lines += [f"{self.name}{_labels(self.labelnames, k)} {_fmt(v)}" for k, v in items]
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: Iterable[str] = (), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # key -> [各 bucket 計數（非累積）..., sum, count]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        if not enabled():
+            return
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        i = next(i for i, b in enumerate(self.buckets) if value <= b)
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                row = self._values[key] = [0.0] * (len(self.buckets) + 2)
+            row[i] += 1
+            row[-2] += value
+            row[-1] += 1
+
+    def count(self, **labels) -> float:
+        row = self._values.get(tuple(str(labels.get(n, "")) for n in self.labelnames))
+        return row[-1] if row else 0.0
+
+    def expose(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._values.items())
+        for key, row in items:
+            acc = 0.0
+            for b, n in zip(self.buckets, row):
+                acc += n
+                le = 'le="%s"' % _fmt(b)
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {_fmt(acc)}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_fmt(row[-2])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {_fmt(row[-1])}")
+        return lines
+
+
+# 收集時才讀取的指標（例如快取物件上既有的 hits / misses）：
+# fn() 回傳 [(name, type, help, [(labels dict, value), ...]), ...]
+Collector = Callable[[], List[Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]]]
+_collectors: List[Collector] = []
+
+
+def register_collector(fn: Collector) -> Collector:
+    _collectors.append(fn)
+    return fn
+
+
+HTTP_REQUESTS = Counter("http_requests_total", "HTTP 請求數", ("method", "route", "status"))
+HTTP_SECONDS = Histogram("http_request_duration_seconds", "HTTP 請求處理時間", ("method", "route"))
+STAGE_SECONDS = Histogram("stage_duration_seconds", "各處理階段耗時", ("stage",))
+ROWS = Counter("rows_processed_total", "各階段處理的列數", ("stage",))
+LLM_CALLS = Counter("llm_calls_total", "LLM 呼叫次數（status：ok / error）", ("backend", "status"))
+LLM_MALFORMED = Counter("llm_malformed_responses_total", "無法解析的 LLM 回應數")
+LLM_SECONDS = Histogram("llm_call_duration_seconds", "單次 LLM 呼叫耗時", ("backend",))
+LLM_TOKENS = Counter("llm_tokens_total", "LLM token 用量（type：prompt / completion；fake 後端以字元數估計）",
+                     ("backend", "type"))
+LOOKUPS = Counter("estimate_lookups_total", "估算列的來源（source：epd / cache / llm）", ("source",))
+OPT_GENERATIONS = Histogram("optimizer_generations", "NSGA-II 每個 seed 實際執行的世代數",
+                            ("problem",), buckets=GENERATION_BUCKETS)
+OPT_RUNS = Counter("optimizer_runs_total", "前緣求解次數", ("engine",))
+OCR_PAGES = Counter("ocr_pages_total", "以 Tesseract 辨識的掃描頁數（status：ok / timeout / error）", ("status",))
+
+METRICS = [HTTP_REQUESTS, HTTP_SECONDS, STAGE_SECONDS, ROWS, LLM_CALLS, LLM_MALFORMED, LLM_SECONDS, LLM_TOKENS,
+           LOOKUPS, OPT_GENERATIONS, OPT_RUNS, OCR_PAGES]
+
+
+def render() -> str:
+    """Prometheus 文字格式（text/plain; version=0.0.4）。"""
+    lines = []
+    for m in METRICS:
+        lines += m.expose()
+    for fn in _collectors:
+        try:
+            families = fn()
+        except Exception:
+            logger.exception("metrics collector 失敗")
+            continue
+        for name, kind, help, samples in families:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{name}{_labels(tuple(labels), tuple(labels.values()))} {_fmt(value)}")
+    return "\n".join(lines) + "\n"
+
+
+# ---------------------------------------------------------------------
+# 階段計時：span 紀錄到 STAGE_SECONDS，同時累加到目前請求的 trace（供 Server-Timing）
+
+_trace: contextvars.ContextVar[Optional[List[Tuple[str, float]]]] = contextvars.ContextVar("trace", default=None)
+
+
+def start_trace() -> contextvars.Token:
+    return _trace.set([])
+
+
+def end_trace(token: contextvars.Token) -> List[Tuple[str, float]]:
+    spans = _trace.get() or []
+    _trace.reset(token)
+    return spans
+
+
+@contextmanager
+def span(stage: str):
+    if not enabled():
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        spans = _trace.get()
+        if spans is not None:
+            spans.append((stage, elapsed))
+
+
+def timed(stage: str):
+    """以 span 包住整個函式（同步函式用）。"""
+    def deco(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+
+def server_timing(spans: List[Tuple[str, float]], total: float) -> str:
+    """同名階段合併，格式：stage;dur=12.3, ..., total;dur=45.6（毫秒）。"""
+    merged: Dict[str, float] = {}
+    for stage, elapsed in spans:
+        merged[stage] = merged.get(stage, 0.0) + elapsed
+    parts = [f"{stage};dur={elapsed * 1e3:.1f}" for stage, elapsed in merged.items()]
+    parts.append(f"total;dur={total * 1e3:.1f}")
+    return ", ".join(parts)
+
+
+class TimingMiddleware:
+    """
+    ASGI middleware：紀錄每個請求的路由、狀態碼與耗時，並收集請求內的 span。
+    server_timing=True 時於回應加上 Server-Timing 標頭（瀏覽器 DevTools 可直接檢視）；
+    trace_log=True 時另以 logging（carbon.trace）輸出每個請求的各階段耗時。
+    """
+
+    def __init__(self, app, server_timing: bool = True, trace_log: bool = False):
+        self.app = app
+        self.server_timing = server_timing
+        self.trace_log = trace_log
+        if trace_log and not logger.handlers:
+            logger.addHandler(logging.StreamHandler())
+            logger.setLevel(logging.INFO)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not enabled():
+            await self.app(scope, receive, send)
+            return
+        token = start_trace()
+        start = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if self.server_timing:
+                    value = server_timing(_trace.get() or [], time.perf_counter() - start)
+                    message = {**message, "headers": [*message.get("headers", []),
+                                                      (b"server-timing", value.encode("latin-1"))]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            spans = end_trace(token)
+            # 以路由樣板（/jobs/{job_id}）為 label，避免 label 數量隨 id 成長
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            HTTP_REQUESTS.inc(method=scope["method"], route=route, status=status)
+            HTTP_SECONDS.observe(elapsed, method=scope["method"], route=route)
+            if self.trace_log:
+                logger.info("%s %s %d %.1fms %s", scope["method"], scope["path"], status,
+                            elapsed * 1e3, server_timing(spans, elapsed))
@@ -1,47 +1,392 @@
-import pdfplumber
+import os
+import logging
+import numpy as np
 import pandas as pd
 from pathlib import Path
+from collections import deque
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+from modules import metrics
 
+logger = logging.getLogger(__name__)
 
-def pdf_to_dataframe(pdf_path: Path) -> pd.DataFrame:
+# pdfplumber 擷取出的原始表格：第一列為 header，其餘為資料列
+RawTable = List[List[Optional[str]]]
+
+# 全形 ASCII（！～）與全形空白轉半形
+_FULLWIDTH = str.maketrans({**{chr(0xFF01 + i): chr(0x21 + i) for i in range(94)}, '\u3000': ' '})
+# 千分位數字，例如 "2,982,201"、"-1,234.5"
+_THOUSANDS = r'[+-]?\d{1,3}(?:,\d{3})+(?:\.\d+)?'
+
+
+def dedupe_headers_bulk(headers: List[list]) -> List[List[str]]:
     """
-    使用 pdfplumber 擷取 PDF 中所有表格，將每個表格的標頭與資料行解析後串接，
-    並回傳合併後的 DataFrame。
+    一次處理多個表格的標頭：與 normalize_cells 相同先全形轉半形、去頭尾空白，None 轉空字串，
+    同一表格內重複的欄名以 "名稱.n" 區分，避免重複導致 reindex 錯誤。
+    """
+    lens = [len(h) for h in headers]
+    names = pd.Series([x.translate(_FULLWIDTH).strip() if isinstance(x, str) else ''
+                       for h in headers for x in h], dtype=object)
+    if names.empty:
+        return [[] for _ in headers]
+    table_id = np.repeat(np.arange(len(headers)), lens)
+    n = names.groupby([table_id, names.to_numpy()], sort=False).cumcount().to_numpy()
+    out = np.where(n == 0, names, names + '.' + n.astype(str)).tolist()
+    bounds = np.cumsum([0] + lens)
+    return [out[a:b] for a, b in zip(bounds[:-1], bounds[1:])]
+
+
+def dedupe_headers(header) -> List[str]:
+    return dedupe_headers_bulk([header])[0]
+
+
+def normalize_cells(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    向量化清理所有 cell：全形轉半形、去頭尾空白、去除數字千分位，NaN 一律轉為 None。
+    表格中重複值很多（單位、空白、None），因此只對唯一值做字串處理再映射回去。
+    """
+    if df.empty:
+        return df.astype(object)
+    values = df.to_numpy(dtype=object).ravel()
+    codes, uniques = pd.factorize(values)
+    orig = pd.Series(uniques, dtype=object)
+    s = orig.str.translate(_FULLWIDTH).str.strip()
+    s = s.mask(s.str.fullmatch(_THOUSANDS, na=False), s.str.replace(',', '', regex=False))
+    s = s.where(s.notna(), orig)  # 非字串值維持原樣
+    # codes == -1 代表缺值，對應到最後一格的 None
+    lut = np.append(s.to_numpy(dtype=object), None)
+    return pd.DataFrame(lut[codes].reshape(df.shape), columns=df.columns, index=df.index)
+
+
+def _valid(tables) -> List[RawTable]:
+    # 每個 table 至少要有 header + 一列資料
+    return [t for t in tables if t and len(t) >= 2]
+
+
+def combine_tables(tables: List[RawTable], normalize: bool = True) -> pd.DataFrame:
+    """
+    將多個原始表格合併為單一 DataFrame（欄位取聯集，依首次出現順序），
+    不逐表建立 DataFrame，而是直接寫入一個 object 陣列後一次清理。
+    """
+    tables = _valid(tables)
+    headers = dedupe_headers_bulk([t[0] for t in tables])
+    columns = list(dict.fromkeys(h for hs in headers for h in hs))
+    pos = {c: i for i, c in enumerate(columns)}
+    out = np.full((sum(len(t) - 1 for t in tables), len(columns)), None, dtype=object)
+    r = 0
+    for table, hs in zip(tables, headers):
+        body = table[1:]
+        block = np.empty((len(body), len(hs)), dtype=object)
+        block[:] = body
+        out[r:r + len(body), [pos[h] for h in hs]] = block
+        r += len(body)
+    df = pd.DataFrame(out, columns=columns)
+    return normalize_cells(df) if normalize else df
+
+
+def _open_pdf(pdf_file: str):
+    # pdfplumber（含 pdfminer）載入成本高，第一次解析時才 import，不拖慢服務啟動
+    import pdfplumber
+    return pdfplumber.open(pdf_file)
+
+
+def _page_raw_tables(page) -> List[RawTable]:
+    return _valid(page.extract_tables())
+
+
+def _extract_page_range(pdf_file: str, start: int, stop: int) -> List[Tuple[int, List[RawTable]]]:
+    """子行程工作：開啟 PDF 並擷取 [start, stop) 頁的原始表格（純 list，序列化成本低）。"""
+    out = []
+    with _open_pdf(pdf_file) as pdf:
+        for no in range(start, stop):
+            page = pdf.pages[no]
+            out.append((no, _page_raw_tables(page)))
+            page.close()  # 釋放該頁的物件快取
+    return out
+
+
+def _iter_raw_serial(pdf_path: Path) -> Iterator[Tuple[int, List[RawTable]]]:
+    with _open_pdf(str(pdf_path)) as pdf:
+        for no, page in enumerate(pdf.pages):
+            yield no, _page_raw_tables(page)
+            page.close()
+
+
+def _iter_raw_parallel(pdf_path: Path, workers: Optional[int] = None,
+                       chunk: int = 8) -> Iterator[Tuple[int, List[RawTable]]]:
+    pdf_file = str(pdf_path)
+    with _open_pdf(pdf_file) as pdf:
+        n_pages = len(pdf.pages)
+    workers = workers or os.cpu_count() or 1
+    ranges = [(i, min(i + chunk, n_pages)) for i in range(0, n_pages, chunk)]
+    if workers <= 1 or len(ranges) <= 1:
+        yield from _iter_raw_serial(pdf_path)
+        return
+    with ProcessPoolExecutor(max_workers=min(workers, len(ranges))) as pool:
+        pending = deque()
+        it = iter(ranges)
+        for start, stop in islice(it, workers * 2):
+            pending.append(pool.submit(_extract_page_range, pdf_file, start, stop))
+        while pending:
+            # 依提交順序取回，確保輸出順序固定
+            results = pending.popleft().result()
+            nxt = next(it, None)
+            if nxt is not None:
+                pending.append(pool.submit(_extract_page_range, pdf_file, *nxt))
+            yield from results
+
+
+def iter_raw_tables(pdf_path: Path, mode: str = "stream",
+                    workers: Optional[int] = None) -> Iterator[Tuple[int, List[RawTable]]]:
+    """
+    逐頁產生 (頁碼, 該頁原始表格)，頁碼順序固定。
+    mode: "stream" 單行程逐頁，處理完的頁面立即釋放；
+          "process" 多行程分段平行（每段 8 頁，在途分段數上限 workers * 2），記憶體有上限。
+    """
+    if mode == "process":
+        return _iter_raw_parallel(pdf_path, workers=workers)
+    if mode == "stream":
+        return _iter_raw_serial(pdf_path)
+    raise ValueError(f"未知的解析模式：{mode}")
+
+
+def iter_tables(pdf_path: Path, mode: str = "stream",
+                workers: Optional[int] = None) -> Iterator[Tuple[int, List[pd.DataFrame]]]:
+    """同 iter_raw_tables，但每個表格已轉為清理過的 DataFrame。"""
+    for no, tables in iter_raw_tables(pdf_path, mode, workers):
+        yield no, [combine_tables([t]) for t in tables]
+
+
+# =====================================================================
+# 掃描檔備援：沒有文字層的頁面以 PyMuPDF 轉成影像，Tesseract 辨識後由字詞框重建表格
+
+# 文字層字元數少於此值的頁面視為掃描頁
+DEFAULT_MIN_CHARS = 20
+# 300 DPI 是 Tesseract 對 8~10pt 字的建議解析度；再高只會變慢，準確度幾乎不變
+DEFAULT_DPI = 300
+DEFAULT_LANG = "chi_tra+eng"
+DEFAULT_PAGE_TIMEOUT = 60
+
+# (x0, y0, x1, y1, text)，座標單位為像素
+Word = Tuple[float, float, float, float, str]
+
+
+def scanned_pages(pdf_path: Path, min_chars: Optional[int] = None) -> List[int]:
+    """回傳沒有（或幾乎沒有）文字層的頁碼（0 起算）。"""
+    import fitz
+    min_chars = int(min_chars if min_chars is not None else os.getenv("OCR_MIN_CHARS", DEFAULT_MIN_CHARS))
+    with fitz.open(str(pdf_path)) as doc:
+        return [no for no, page in enumerate(doc) if len(page.get_text("text").strip()) < min_chars]
+
+
+def _is_cjk(ch: str) -> bool:
+    return '\u2e80' <= ch <= '\u9fff' or '\uf900' <= ch <= '\ufaff' or '\uff00' <= ch <= '\uffef'
+
+
+def _join(a: str, b: str) -> str:
+    # 中文字之間不加空白（Tesseract 常把每個中文字切成一個 word）
+    if not a:
+        return b
+    return a + b if _is_cjk(a[-1]) and _is_cjk(b[0]) else f"{a} {b}"
+
+
+def words_to_table(words: List[Word], gap: float = 0.9, gutter: float = 0.05) -> Optional[RawTable]:
+    """
+    由字詞框重建表格（第一列為 header，同 pdfplumber 的原始表格）：
+    1. 依字詞中心的 y 座標分行（差距小於字高的 0.6 倍視為同一行）
+    2. 同一行內，水平間距小於 gap × 字高的相鄰字詞合併成一格
+    3. 將所有格子投影到 x 軸，覆蓋的行數不超過 gutter 比例的位置視為欄間空白，以此切出欄位
+    4. 從第一個填滿至少一半欄位的列開始（略過表格上方的標題文字）
+    """
+    words = [w for w in words if w[4].strip()]
+    if not words:
+        return None
+    W = np.array([w[:4] for w in words], dtype=float)
+    h = float(np.median(W[:, 3] - W[:, 1])) or 1.0
+    yc = (W[:, 1] + W[:, 3]) / 2
+
+    # 1. 分行
+    rows: List[List[int]] = []
+    row_y = None
+    for i in np.argsort(yc, kind='stable'):
+        if row_y is None or yc[i] - row_y > 0.6 * h:
+            rows.append([])
+        rows[-1].append(int(i))
+        row_y = float(np.mean(yc[rows[-1]]))
+
+    # 2. 行內合併成格子 (x0, x1, text)
+    cells: List[List[Tuple[float, float, str]]] = []
+    for idx in rows:
+        idx.sort(key=lambda i: W[i, 0])
+        line = []
+        for i in idx:
+            x0, _, x1, _ = W[i]
+            if line and x0 - line[-1][1] <= gap * h:
+                px0, px1, text = line[-1]
+                line[-1] = (px0, max(px1, x1), _join(text, words[i][4].strip()))
+            else:
+                line.append((x0, x1, words[i][4].strip()))
+        cells.append(line)
+
+    # 3. 欄位：x 軸覆蓋次數低的區段為欄間空白
+    width = int(np.ceil(W[:, 2].max())) + 2
+    cover = np.zeros(width + 1, dtype=int)
+    for line in cells:
+        for x0, x1, _ in line:
+            cover[int(x0)] += 1
+            cover[int(np.ceil(x1)) + 1] -= 1
+    cover = np.cumsum(cover)[:width]
+    empty = cover <= gutter * len(cells)
+    edges = np.flatnonzero(np.diff(empty.astype(int)))
+    # 欄間空白的中點即欄位邊界（不含左右兩端的空白）
+    starts = edges[empty[edges + 1]] + 1     # 空白開始
+    ends = edges[~empty[edges + 1]] + 1      # 空白結束
+    bounds = [(s + e) / 2 for s in starts for e in ends[ends > s][:1]]
+    n_cols = len(bounds) + 1
+
+    table = []
+    for line in cells:
+        row = [''] * n_cols
+        for x0, x1, text in line:
+            col = int(np.searchsorted(bounds, (x0 + x1) / 2))
+            row[col] = _join(row[col], text)
+        table.append(row)
+
+    # 4. 略過表格上方的標題列
+    filled = [sum(1 for c in row if c) for row in table]
+    start = next((i for i, n in enumerate(filled) if n >= max(2, n_cols // 2)), None)
+    if start is None or len(table) - start < 2:
+        return None
+    return table[start:]
+
+
+def _render_page(pdf_file: str, no: int, dpi: int):
+    """
+    以 PyMuPDF 將單頁轉成灰階 PIL 影像。每次呼叫開啟並關閉文件：序列模式在 API 行程內執行，
+    不能留下開啟的檔案；開檔成本相對於 Tesseract 辨識一頁可忽略。
     """
+    import fitz
+    from PIL import Image
+    with fitz.open(pdf_file) as doc:
+        pix = doc[no].get_pixmap(dpi=dpi, colorspace=fitz.csGRAY, alpha=False)
+    return Image.frombytes("L", (pix.width, pix.height), pix.samples)
+
+
+def _tesseract_words(image, lang: str, timeout: float) -> List[Word]:
+    import pytesseract
+    data = pytesseract.image_to_data(image, lang=lang, config="--psm 6",
+                                     output_type=pytesseract.Output.DICT, timeout=timeout)
+    return [(l, t, l + w, t + h, text)
+            for text, conf, l, t, w, h in zip(data["text"], data["conf"], data["left"], data["top"],
+                                              data["width"], data["height"])
+            if text and text.strip() and float(conf) >= 0]
+
+
+def _ocr_page(pdf_file: str, no: int, dpi: int, lang: str, timeout: float) -> Tuple[int, str, List[RawTable]]:
+    """子行程工作：轉影像 → Tesseract → 重建表格，回傳 (頁碼, 狀態, 表格)。"""
+    try:
+        words = _tesseract_words(_render_page(pdf_file, no, dpi), lang, timeout)
+    except RuntimeError as e:
+        # pytesseract 逾時時會終止 tesseract 並拋出 RuntimeError("Tesseract process timeout")
+        if "timeout" in str(e).lower():
+            return no, "timeout", []
+        return no, f"error: {e}", []
+    except Exception as e:
+        return no, f"error: {e}", []
+    table = words_to_table(words)
+    return no, "ok", [table] if table else []
+
+
+def _ocr_worker_init():
+    # 每個子行程只跑一個 tesseract，避免 OpenMP 執行緒與行程數相乘後超額使用 CPU
+    os.environ["OMP_THREAD_LIMIT"] = "1"
+
+
+def ocr_pages(pdf_path: Path, pages: List[int], workers: Optional[int] = None,
+              dpi: Optional[int] = None, lang: Optional[str] = None,
+              timeout: Optional[float] = None) -> Iterator[Tuple[int, List[RawTable]]]:
+    """
+    以行程池平行辨識指定頁面，依頁碼順序產生 (頁碼, 原始表格)。
+    每頁的 tesseract 最多執行 timeout 秒（OCR_PAGE_TIMEOUT），逾時或失敗的頁面回傳空表格，
+    因此總時間上限約為 頁數 / 行程數 × timeout。
+    """
+    dpi = int(dpi or os.getenv("OCR_DPI", DEFAULT_DPI))
+    lang = lang or os.getenv("OCR_LANG", DEFAULT_LANG)
+    timeout = float(timeout or os.getenv("OCR_PAGE_TIMEOUT", DEFAULT_PAGE_TIMEOUT))
+    workers = workers or int(os.getenv("OCR_WORKERS", "0")) or os.cpu_count() or 1
     pdf_file = str(pdf_path)
-    dfs = []
-    with pdfplumber.open(pdf_file) as pdf:
-        for page in pdf.pages:
-            tables = page.extract_tables()
-            for table in tables:
-                # 每個 table 至少要有 header + 一列資料
-                if not table or len(table) < 2:
-                    continue
-                header, *rows = table
-                # 清理 header 前後空白並處理 None
-                cleaned = [h.strip() if isinstance(h, str) else '' for h in header]
-                # 生成唯一欄名，避免重複導致 reindex 錯誤
-                seen = {}
-                unique_header = []
-                for h in cleaned:
-                    if h in seen:
-                        seen[h] += 1
-                        unique_header.append(f"{h}.{seen[h]}")
-                    else:
-                        seen[h] = 0
-                        unique_header.append(h)
-                # 建立 DataFrame
-                df = pd.DataFrame(rows, columns=unique_header)
-                # 清理 cell 前後空白
-                df = df.applymap(lambda x: x.strip() if isinstance(x, str) else x)
-                dfs.append(df)
-    if not dfs:
-        raise ValueError("PDF 中未偵測到任何表格。")
-    combined = pd.concat(dfs, ignore_index=True)
-    # 清理全空列
-    combined = combined.dropna(how='all').reset_index(drop=True)
-    # 將 NaN 替換成 None，以便 JSON 序列化
-    combined = combined.where(pd.notnull(combined), None)
+
+    def record(no, status, tables):
+        kind = status.split(":")[0]
+        metrics.OCR_PAGES.inc(status=kind)
+        if kind != "ok":
+            logger.warning("第 %d 頁 OCR 失敗：%s", no + 1, status)
+        return no, tables
+
+    if workers <= 1 or len(pages) <= 1:
+        for no in pages:
+            yield record(*_ocr_page(pdf_file, no, dpi, lang, timeout))
+        return
+    with ProcessPoolExecutor(max_workers=min(workers, len(pages)), initializer=_ocr_worker_init) as pool:
+        # 依提交順序取回，確保輸出順序固定；在途頁數上限 workers * 2
+        pending = deque()
+        it = iter(pages)
+        for no in islice(it, workers * 2):
+            pending.append(pool.submit(_ocr_page, pdf_file, no, dpi, lang, timeout))
+        while pending:
+            result = pending.popleft().result()
+            nxt = next(it, None)
+            if nxt is not None:
+                pending.append(pool.submit(_ocr_page, pdf_file, nxt, dpi, lang, timeout))
+            yield record(*result)
+
+
+def _ocr_mode() -> str:
+    # auto：只辨識沒有文字層的頁面（預設）；force：全部頁面；off：停用
+    mode = os.getenv("OCR_FALLBACK", "auto").lower()
+    if mode not in ("auto", "force", "off"):
+        raise ValueError(f"OCR_FALLBACK 必須為 auto / force / off：{mode}")
+    return mode
+
+
+def pdf_to_dataframe(pdf_path: Path, mode: str = "stream",
+                     workers: Optional[int] = None) -> pd.DataFrame:
+    """
+    使用 pdfplumber 擷取 PDF 中所有表格，將每個表格的標頭與資料行解析後串接，
+    並回傳合併後的 DataFrame。mode 見 iter_raw_tables。
+    沒有文字層的掃描頁改以 Tesseract 辨識（OCR_FALLBACK，見 ocr_pages），結果依頁碼順序合併。
+    """
+    ocr_mode = _ocr_mode()
+    by_page: Dict[int, List[RawTable]] = {}
+    scanned: List[int] = []
+    if ocr_mode == "force":
+        import fitz
+        with fitz.open(str(pdf_path)) as doc:
+            scanned = list(range(len(doc)))
+    else:
+        with metrics.span("pdf_extract"):
+            for no, page_tables in iter_raw_tables(pdf_path, mode, workers):
+                if page_tables:
+                    by_page[no] = page_tables
+        if ocr_mode == "auto":
+            scanned = [no for no in scanned_pages(pdf_path) if no not in by_page]
+    if scanned:
+        with metrics.span("ocr"):
+            for no, page_tables in ocr_pages(pdf_path, scanned, workers=workers):
+                if page_tables:
+                    by_page[no] = page_tables
+    tables = [t for no in sorted(by_page) for t in by_page[no]]
+    if not tables:
+        hint = "（掃描頁的 OCR 也沒有辨識出表格，請確認已安裝 Tesseract 與語言檔）" if scanned else ""
+        raise ValueError(f"PDF 中未偵測到任何表格。{hint}")
+    with metrics.span("pdf_cleanup"):
+        combined = combine_tables(tables, normalize=False)
+        # 清理全空列
+        combined = combined.dropna(how='all').reset_index(drop=True)
+        # 清理 cell，並將 NaN 替換成 None，以便 JSON 序列化
+        combined = normalize_cells(combined)
+    metrics.ROWS.inc(len(combined), stage="pdf")
     return combined
 
 # =====================================================================
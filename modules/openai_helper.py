@@ -1,38 +1,70 @@
-from dotenv import load_dotenv
-import os, json, pandas as pd
-from openai import OpenAI
+import os, json, time, asyncio, numpy as np, pandas as pd
+from modules import gwp_cache, llm_engine, llm_backend, factor_index, metrics
 
-# 加載 .env 檔案
-load_dotenv()
+# prompt 內容變動時請遞增，讓舊的快取自動失效
+PROMPT_VERSION = "1"
 
-client = OpenAI()
+def _model():
+    return os.getenv("MODEL", "gpt-4o-mini")
 
-# 從環境變數中取得 OpenAI API Key
-OpenAI.api_key = os.getenv("OPENAI_API_KEY")
+def _chat(messages, model=None):
+    # 實際呼叫交給 llm_backend（LLM_BACKEND=openai / fake）
+    backend = llm_backend.get_backend()
+    start = time.perf_counter()
+    try:
+        txt = backend.chat(messages, model or _model())
+    except Exception:
+        metrics.LLM_CALLS.inc(backend=backend.name, status="error")
+        raise
+    finally:
+        metrics.LLM_SECONDS.observe(time.perf_counter() - start, backend=backend.name)
+    metrics.LLM_CALLS.inc(backend=backend.name, status="ok")
+    return txt
 
-# 驗證是否成功讀取到 API Key
-print("OpenAI API Key:", OpenAI.api_key)
+FAILED = {"mean": None, "low": None, "high": None, "confidence": "API/解析失敗"}
 
-def _chat(messages, model=None):
-    model = model or os.getenv("MODEL", "gpt-4o-mini")
-    resp = client.chat.completions.create(model=model, messages=messages)
-    return resp.choices[0].message.content
+SYS_PROMPT = "你是一位碳排估算助手，只回傳 JSON 格式 {mean, low, high, confidence}"
 
-def estimate_factor(row):
+RULES = """請根據你對建築工程標案與台灣常見造價經驗，「即使是大項、分類項，也要盡量推論或給一個常見平均值」，僅在資料毫無意義或純粹是格式分隔時（如純「合計」、「分隔線」），才填 null。
+    所有回答皆需說明推論依據（如估算邏輯、比對經驗、合理假設等）。"""
+
+def _row_fields(row):
     item = row.get('item') or row.get('工程項目') or ''
     qty = row.get('qty') or row.get('數量') or ''
     unit = row.get('unit') or row.get('單位') or ''
     gwp = row.get('gwp', '未知')
     remark = row.get('remark', '') or row.get('說明', '')
+    return item, qty, unit, gwp, remark
+
+def _cache_key(row):
+    item, qty, unit, _, remark = _row_fields(row)
+    return gwp_cache.make_key(item, unit, qty, remark, _model(), PROMPT_VERSION)
+
+def _cache_store(row, data):
+    # 只快取成功的估算，失敗的下次重新詢問
+    cache = gwp_cache.get_cache()
+    if cache is not None and isinstance(data, dict) and data.get("mean") is not None:
+        cache.put(_cache_key(row), data, item=_row_fields(row)[0])
+
+def _parse_json(txt):
+    """容忍模型把 JSON 包在 ```json ... ``` 中。"""
+    txt = (txt or '').strip()
+    if txt.startswith("```"):
+        txt = txt.strip('`')
+        if txt.lower().startswith("json"):
+            txt = txt[4:]
+    return json.loads(txt)
 
+def _estimate_raw(row):
+    """呼叫 LLM 估算單列；API 或 JSON 解析失敗時直接拋出例外，交由呼叫端重試。"""
+    item, qty, unit, gwp, remark = _row_fields(row)
     prompt = f"""
     材料/工程項目名稱: {item}
     數量: {qty}
     單位: {unit}
     已知 GWP: {gwp}
     說明: {remark}
-    請根據你對建築工程標案與台灣常見造價經驗，「即使是大項、分類項，也要盡量推論或給一個常見平均值」，僅在資料毫無意義或純粹是格式分隔時（如純「合計」、「分隔線」），才填 null。
-    所有回答皆需說明推論依據（如估算邏輯、比對經驗、合理假設等）。
+    {RULES}
     只回傳 JSON 格式，例如：
     {{
       "mean": 123.4,         // 合理值，若無法判斷請填 null
@@ -41,45 +73,171 @@ def estimate_factor(row):
       "confidence": "推論依據與說明" // 必填
     }}
     """
-    sys = "你是一位碳排估算助手，只回傳 JSON 格式 {mean, low, high, confidence}"
     txt = _chat([
-        {"role": "system", "content": sys},
+        {"role": "system", "content": SYS_PROMPT},
         {"role": "user", "content": prompt}
     ])
     try:
-        data = json.loads(txt)
-        return data  # 直接回傳所有欄位
+        data = _parse_json(txt)
     except Exception as e:
+        metrics.LLM_MALFORMED.inc()
         print("JSON decode error:", e, "GPT回應：", txt)
-        return {"mean": None, "low": None, "high": None, "confidence": "API/解析失敗"}
-
-def fill_carbon_factors(df: pd.DataFrame):
-    # 中英文自動映射
-    col_map = {
-        '項次':'idx', '工程項目':'item', '單位':'unit',
-        '數量':'qty', '單價':'unit_price', '複價':'amount', '說明':'remark'
-    }
-    for zh, en in col_map.items():
+        raise
+    if not isinstance(data, dict):
+        metrics.LLM_MALFORMED.inc()
+        raise ValueError(f"GPT 回應不是 JSON 物件：{txt}")
+    _cache_store(row, data)
+    return data
+
+def _estimate_batch_raw(rows):
+    """把多列打包成一個 prompt，要求回傳等長的 JSON 陣列。"""
+    if len(rows) == 1:
+        return [_estimate_raw(rows[0])]
+    items = []
+    for n, row in enumerate(rows, 1):
+        item, qty, unit, gwp, remark = _row_fields(row)
+        items.append({"no": n, "item": str(item), "qty": str(qty), "unit": str(unit),
+                      "gwp": str(gwp), "remark": str(remark or '')})
+    prompt = f"""
+    以下是 {len(rows)} 個材料/工程項目（JSON 陣列，依 no 編號）：
+    {json.dumps(items, ensure_ascii=False)}
+    {RULES}
+    只回傳 JSON 陣列，長度必須為 {len(rows)}，順序與 no 相同，每個元素格式為：
+    {{"mean": 123.4, "low": 100.0, "high": 150.0, "confidence": "推論依據與說明"}}
+    """
+    txt = _chat([
+        {"role": "system", "content": "你是一位碳排估算助手，只回傳 JSON 陣列，每個元素為 {mean, low, high, confidence}"},
+        {"role": "user", "content": prompt}
+    ])
+    try:
+        data = _parse_json(txt)
+    except Exception:
+        metrics.LLM_MALFORMED.inc()
+        raise
+    if isinstance(data, dict):
+        # 有些模型會包成 {"results": [...]}
+        data = next((v for v in data.values() if isinstance(v, list)), None)
+    if not isinstance(data, list) or len(data) != len(rows) \
+            or not all(isinstance(d, dict) for d in data):
+        metrics.LLM_MALFORMED.inc()
+        raise ValueError(f"批次回應格式不符（預期 {len(rows)} 筆）：{txt}")
+    for row, d in zip(rows, data):
+        _cache_store(row, d)
+    return data
+
+def estimate_factor(row):
+    cache = gwp_cache.get_cache()
+    if cache is not None:
+        hit = cache.get(_cache_key(row))
+        if hit is not None:
+            return hit
+    try:
+        return _estimate_raw(row)  # 直接回傳所有欄位
+    except Exception:
+        return dict(FAILED)
+
+async def estimate_rows(rows, progress=None):
+    """
+    並行估算多列：先比對本地 EPD 係數庫、再查快取，同一 key 只問一次，剩餘的依
+    LLM_BATCH_SIZE 分批交給 llm_engine；批次失敗時退回逐列估算。回傳順序與 rows 相同。
+    """
+    engine = llm_engine.get_engine()
+    cache = gwp_cache.get_cache()
+    keys = [_cache_key(r) for r in rows]
+    unique = dict(zip(keys, rows))
+    results = {}
+    # 係數庫在第一次使用時載入並建立 TF-IDF 矩陣，與比對一樣是 CPU 工作，移到執行緒中執行不阻塞 event loop
+    index = await asyncio.to_thread(factor_index.get_index) if unique else None
+    if index is not None:
+        with metrics.span("epd_match"):
+            hits = await asyncio.to_thread(index.lookup, list(unique.values()))
+        for key, hit in zip(unique, hits):
+            if hit is not None:
+                results[key] = hit
+    n_epd = len(results)
+    lookup = [key for key in unique if key not in results]
+    if cache is not None and lookup:
+        # 一次批次查詢，並移到執行緒中執行，不在 event loop 上阻塞 SQLite I/O
+        results.update(await asyncio.to_thread(cache.get_many, lookup))
+    pending = {key: unique[key] for key in lookup if key not in results}
+    metrics.ROWS.inc(len(rows), stage="estimate")
+    metrics.LOOKUPS.inc(n_epd, source="epd")
+    metrics.LOOKUPS.inc(len(results) - n_epd, source="cache")
+    metrics.LOOKUPS.inc(len(pending), source="llm")
+
+    total = len(pending)
+    base = 0
+    def report(done, _):
+        if progress is not None:
+            progress(base + done, total)
+
+    with metrics.span("llm"):
+        todo = list(pending.items())
+        size = engine.batch_size
+        if size > 1 and len(todo) > 1:
+            batches = [todo[i:i + size] for i in range(0, len(todo), size)]
+            out = await engine.map(lambda b: _estimate_batch_raw([r for _, r in b]), batches,
+                                   progress=report, weight=len)
+            retry = []
+            for batch, res in zip(batches, out):
+                if isinstance(res, Exception):
+                    retry.extend(batch)
+                else:
+                    for (key, _), d in zip(batch, res):
+                        results[key] = d
+            todo = retry
+            base = total - len(retry)
+        if todo:
+            out = await engine.map(lambda kr: _estimate_raw(kr[1]), todo, progress=report)
+            for (key, _), res in zip(todo, out):
+                results[key] = dict(FAILED) if isinstance(res, Exception) else res
+    return [results[k] for k in keys]
+
+# 中英文自動映射
+COLUMN_MAP = {
+    '項次':'idx', '工程項目':'item', '單位':'unit',
+    '數量':'qty', '單價':'unit_price', '複價':'amount', '說明':'remark'
+}
+
+def _prepare(df: pd.DataFrame):
+    for zh, en in COLUMN_MAP.items():
         if en not in df.columns and zh in df.columns:
             df[en] = df[zh]
     if 'gwp' not in df.columns:
         df['gwp'] = None
     if 'qty' not in df.columns:
         df['qty'] = 1
+    return df
 
-    gwp_filled = []
-    remarks = []
-    for i, row in df.iterrows():
-        value = row['gwp']
-        if pd.isna(value) or value in (None, '', 0, '0'):
-            est = estimate_factor(row)
-            print(f"Row {i}: item={row.get('item') or row.get('工程項目')}, est_gwp={est}")
-            gwp_filled.append(est.get("mean") if est.get("mean") is not None else 0)
-            remarks.append(est.get("confidence") or "")
-        else:
-            gwp_filled.append(value)
-            remarks.append(row.get('remark', '')[:50] if 'remark' in row else '')
-    df['gwp'] = gwp_filled
+def _missing_gwp(df: pd.DataFrame):
+    gwp = df['gwp']
+    return gwp.isna() | gwp.astype(str).str.strip().isin(['', '0', '0.0'])
+
+async def afill_carbon_factors(df: pd.DataFrame, progress=None):
+    """fill_carbon_factors 的非同步版本，可直接在 FastAPI handler 中 await。"""
+    df = _prepare(df)
+    missing = _missing_gwp(df).to_numpy()
+    rows = [r for r, m in zip(df.to_dict(orient="records"), missing) if m]
+    ests = await estimate_rows(rows, progress=progress)
+
+    gwp_filled = df['gwp'].astype(object).to_numpy(copy=True)
+    # 估算的上下限（low / high）一併保存，供 uncertainty 計算碳排分佈；已有 gwp 的列沿用輸入的上下限
+    bounds = {col: df[col].astype(object).to_numpy(copy=True) if col in df.columns
+              else np.full(len(df), None, dtype=object) for col in ('gwp_low', 'gwp_high')}
+    if 'remark' in df.columns:
+        remarks = df['remark'].fillna('').astype(str).str[:50].to_numpy(dtype=object, copy=True)
+    else:
+        remarks = pd.Series([''] * len(df), dtype=object).to_numpy()
+    pos = missing.nonzero()[0]
+    for i, row, est in zip(pos, rows, ests):
+        print(f"Row {i}: item={row.get('item') or row.get('工程項目')}, est_gwp={est}")
+        gwp_filled[i] = est.get("mean") if est.get("mean") is not None else 0
+        bounds['gwp_low'][i] = est.get("low")
+        bounds['gwp_high'][i] = est.get("high")
+        remarks[i] = est.get("confidence") or ""
+    df['gwp'] = pd.to_numeric(pd.Series(gwp_filled, index=df.index), errors='coerce').fillna(0)
+    for col, values in bounds.items():
+        df[col] = pd.to_numeric(pd.Series(values, index=df.index), errors='coerce')
     df['gwp_remark'] = remarks
 
     # 計算碳排量
@@ -87,6 +245,10 @@ def fill_carbon_factors(df: pd.DataFrame):
     df['碳排放量'] = df['gwp'] * df['qty']
     return df
 
+def fill_carbon_factors(df: pd.DataFrame, progress=None):
+    """同步介面（CLI / 背景執行緒用）；在 event loop 內請改用 afill_carbon_factors。"""
+    return asyncio.run(afill_carbon_factors(df, progress=progress))
+
 def generate_negotiation_note(best_plan: dict):
     sys = "你是採購談判顧問，請用專業但友善的語氣。"
     user = f"""以下是我們選定的採購方案:
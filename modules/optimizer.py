@@ -1,16 +1,30 @@
+import os, threading, multiprocessing
 import pandas as pd
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from pymoo.algorithms.moo.nsga2 import NSGA2
-from pymoo.operators.sampling.rnd import BinaryRandomSampling
 from pymoo.operators.crossover.pntx import TwoPointCrossover
 from pymoo.operators.mutation.bitflip import BitflipMutation
 from pymoo.optimize import minimize
+from pymoo.termination.default import DefaultMultiObjectiveTermination
+from pymoo.util.nds.non_dominated_sorting import NonDominatedSorting
 from pymoo.core.problem import Problem
+from pymoo.core.repair import Repair
+from pymoo.core.duplicate import DuplicateElimination
+from pymoo.operators.sampling.rnd import IntegerRandomSampling
+from pymoo.operators.crossover.sbx import SBX
+from pymoo.operators.mutation.pm import PM
+from typing import Optional
 import numpy as np
+from modules import fronts, metrics, uncertainty
 
 class ProcProblem(Problem):
-    def __init__(self, df: pd.DataFrame):
+    def __init__(self, df: pd.DataFrame, robust: Optional["RobustCarbon"] = None):
         self.df = df
+        self.robust = robust
         n_var = len(df)
+        # 目標係數先轉成 float 陣列，缺值視為 0
+        self.price, self.carbon, self.eta = _coefficients(df)
         super().__init__(n_var=n_var,
                          n_obj=3,
                          n_constr=0,
@@ -18,56 +32,618 @@ class ProcProblem(Problem):
                          xu=np.ones(n_var))
     def _evaluate(self, X, out, *args, **kwargs):
         # X shape (pop, n_var) binary selection mask
-        cost = X @ self.df['unit_price'].values
-        carbon = X @ (self.df['gwp'].values * self.df['qty'].values)
-        eta = X @ self.df['eta'].values  # where eta present else 0
-        out["F"] = np.column_stack([cost, carbon, eta])
+        # 整個族群一次矩陣乘法，逐個體分派到其他行程反而更慢
+        X = X.astype(float)
+        carbon = self.robust.quantile(X) if self.robust is not None else X @ self.carbon
+        out["F"] = np.column_stack([X @ self.price, carbon, X @ self.eta])
 
-def optimize_materials(df: pd.DataFrame, pop_size=50, n_gen=100):
-    df = df.copy()
-    if 'eta' not in df.columns:
-        df['eta'] = 0
-    problem = ProcProblem(df)
+
+def _numeric(df: pd.DataFrame, col: str) -> np.ndarray:
+    if col not in df.columns:
+        return np.zeros(len(df))
+    return pd.to_numeric(df[col], errors='coerce').fillna(0).to_numpy(dtype=float)
+
+
+def _coefficients(df: pd.DataFrame):
+    return _numeric(df, 'unit_price'), _numeric(df, 'gwp') * _numeric(df, 'qty'), _numeric(df, 'eta')
+
+
+def _objective_frame(df: pd.DataFrame) -> pd.DataFrame:
+    # 只保留目標函數需要的數值欄，傳給子行程的資料量最小
+    return pd.DataFrame({c: _numeric(df, c) for c in ('unit_price', 'gwp', 'qty', 'eta')})
+
+
+class RobustCarbon:
+    """
+    穩健碳排目標：以蒙地卡羅情境下所選列總碳排的分位數（例如 P90）取代期望值。
+    S 為 (列數 × 情境數) 的各列碳排抽樣（uncertainty.sample），情境固定，同一輸入的目標值可重現。
+    分位數對各列碳排是單調的，因此「碳排恆為正的列不選較好」等逐列判斷仍成立；
+    linear 為各列自身的分位數（各列完全相關時總碳排的分位數），供權重掃描作線性代理。
+    """
+
+    def __init__(self, df: pd.DataFrame, q: float, n_scenarios: int, seed: int = 0):
+        if not 0 < q < 1:
+            raise ValueError("carbon_quantile 必須介於 0 與 1 之間")
+        self.q = q
+        self.S = uncertainty.sample(df, n_scenarios, seed=seed).T
+        self.linear = uncertainty.row_quantiles(df, [q]).iloc[:, 0].to_numpy()
+
+    def quantile(self, X: np.ndarray, cols=None, base=None, block: int = 8192) -> np.ndarray:
+        """X：(解數 × 列數) 的選取遮罩；cols / base 表示 X 只涵蓋部分列，其餘列的情境合計為 base。"""
+        S = self.S if cols is None else self.S[cols]
+        out = np.empty(len(X))
+        for start in range(0, len(X), block):
+            T = np.asarray(X[start:start + block], dtype=float) @ S
+            if base is not None:
+                T += base
+            out[start:start + block] = np.quantile(T, self.q, axis=1)
+        return out
+
+    def summary(self, X: np.ndarray, quantiles=uncertainty.QUANTILES) -> list:
+        """各解在同一組情境下的總碳排分位數 [{p10, p50, p90}, ...]，與 quantile() 的目標值一致。"""
+        T = np.asarray(X, dtype=float) @ self.S
+        qs = np.quantile(T, quantiles, axis=1)
+        return [{uncertainty._labels(q): float(qs[i, j]) for i, q in enumerate(quantiles)}
+                for j in range(len(T))]
+
+
+def row_keys(df: pd.DataFrame) -> list:
+    """
+    每列的識別鍵（item + unit + 同名出現次序），與數量 / 單價無關，
+    用於比對前後兩次輸入中「同一列」。
+    """
+    ident = pd.DataFrame({c: df[c].astype(str).to_numpy() if c in df.columns else ''
+                          for c in ('item', 'unit')})
+    nth = ident.groupby(['item', 'unit'], sort=False).cumcount().astype(str)
+    return (ident['item'] + '\x1f' + ident['unit'] + '\x1f' + nth).tolist()
+
+
+class FrontStore:
+    """
+    保存最近幾次的 Pareto 前緣（以列識別鍵對應），作為下一次優化的初始族群。
+    只在輸入表格與先前某次高度重疊（overlap 比例 >= min_overlap）時使用。
+    """
+
+    def __init__(self, max_entries: int = 32, min_overlap: float = 0.8):
+        self.max_entries = max_entries
+        self.min_overlap = min_overlap
+        self._fronts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, keys: list, X: np.ndarray) -> None:
+        sig = hash(tuple(keys))
+        with self._lock:
+            self._fronts[sig] = (keys, np.asarray(X, dtype=bool))
+            self._fronts.move_to_end(sig)
+            while len(self._fronts) > self.max_entries:
+                self._fronts.popitem(last=False)
+
+    def seed(self, keys: list) -> Optional[np.ndarray]:
+        """回傳對應到新表格各列的前緣解（新增的列不選），找不到相近的前緣時回傳 None。"""
+        with self._lock:
+            entries = list(self._fronts.values())
+        if not keys:
+            return None
+        new = set(keys)
+        best, best_overlap = None, 0.0
+        for old_keys, X in reversed(entries):
+            overlap = len(new.intersection(old_keys)) / max(len(new), len(old_keys))
+            if overlap > best_overlap:
+                best, best_overlap = (old_keys, X), overlap
+        if best is None or best_overlap < self.min_overlap:
+            return None
+        old_keys, X = best
+        pos = {k: i for i, k in enumerate(old_keys)}
+        src = np.array([pos.get(k, -1) for k in keys])
+        out = np.zeros((len(X), len(keys)), dtype=bool)
+        hit = src >= 0
+        out[:, hit] = X[:, src[hit]]
+        return out
+
+
+_front_store = FrontStore()
+
+# 收斂判斷的世代上限
+MAX_GEN = 300
+
+
+def _initial_population(X0: Optional[np.ndarray], pop_size: int, n_var: int, seed: int) -> np.ndarray:
+    # 暖啟動：前緣解 + 隨機個體補足族群，保留多樣性
+    rng = np.random.default_rng(seed)
+    X = rng.random((pop_size, n_var)) < 0.5
+    if X0 is not None and len(X0):
+        n = min(len(X0), pop_size // 2 or 1)
+        X[:n] = X0[rng.permutation(len(X0))[:n]]
+    return X
+
+
+def _run_seed(frame: pd.DataFrame, pop_size: int, n_gen: Optional[int], seed: int,
+              X0: Optional[np.ndarray] = None, robust: Optional[RobustCarbon] = None):
+    """子行程工作：以單一 seed 執行 NSGA-II，回傳最後一代的非支配解 (X, F) 與實際世代數。"""
+    problem = ProcProblem(frame, robust)
     algorithm = NSGA2(
         pop_size=pop_size,
-        sampling=BinaryRandomSampling(),
+        sampling=_initial_population(X0, pop_size, problem.n_var, seed),
         crossover=TwoPointCrossover(),
-        mutation=BitflipMutation()
+        mutation=BitflipMutation(),
+        eliminate_duplicates=True
     )
-    res = minimize(problem,
-                   algorithm,
-                   ('n_gen', n_gen),
-                   verbose=False)
-    # pick first 3 non-dominated sols
-    sols = []
-    for i, x in enumerate(res.X[:3]):
-        mask = x.astype(bool)
-        sel = df[mask]
-
-        if "item" in sel.columns:
-            items_col = sel["item"]
-            # 若出現多欄位 item，僅取第一欄
-            if hasattr(items_col, "columns"):
-                items_col = items_col.iloc[:, 0]
-            items = [str(item) for item in items_col.tolist()]
+    # 前緣收斂即停止；n_gen 僅作為上限
+    termination = DefaultMultiObjectiveTermination(period=20, n_max_gen=n_gen or MAX_GEN)
+    res = minimize(problem, algorithm, termination, seed=seed, verbose=False)
+    return np.atleast_2d(res.X).astype(bool), np.atleast_2d(res.F), res.algorithm.n_gen
+
+
+def merge_fronts(results) -> tuple:
+    """合併多個 seed 的結果，去除重複解後只保留非支配解。"""
+    X = np.vstack([x for x, _ in results])
+    F = np.vstack([f for _, f in results])
+    _, first = np.unique(X, axis=0, return_index=True)
+    X, F = X[first], F[first]
+    front = NonDominatedSorting().do(F, only_non_dominated_front=True)
+    return X[front], F[front]
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+
+def _get_pool(workers: int) -> ProcessPoolExecutor:
+    """
+    NSGA-II 共用的行程池，所有優化請求共用、不逐次重建。
+    呼叫端是 Starlette / 背景工作的執行緒，以 fork 從多執行緒行程產生子行程可能複製到他人持有的鎖而死結，
+    因此改用 forkserver（不支援的平台如 Windows 用 spawn）。需要更多行程時重建較大的池。
+    """
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or workers > _pool_workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(method))
+            _pool_workers = workers
+        return _pool
+
+
+def _solve_front(frame: pd.DataFrame, pop_size: int, n_gen: Optional[int], seeds: list,
+                 X0: Optional[np.ndarray], workers: int, robust: Optional[RobustCarbon] = None):
+    if workers <= 1 or len(seeds) <= 1:
+        results = [_run_seed(frame, pop_size, n_gen, s, X0, robust) for s in seeds]
+    else:
+        pool = _get_pool(min(workers, len(seeds)))
+        futures = [pool.submit(_run_seed, frame, pop_size, n_gen, s, X0, robust) for s in seeds]
+        results = [f.result() for f in futures]
+    # 世代數在子行程算出，回到主行程才紀錄
+    for _, _, n in results:
+        metrics.OPT_GENERATIONS.observe(n, problem="materials")
+    return merge_fronts([(X, F) for X, F, _ in results])
+
+
+# ---------------------------------------------------------------------
+# 快速路徑：ProcProblem 的目標皆為選取遮罩的線性加總且無限制式，
+# 各列可依係數正負獨立判斷；取捨列不多時窮舉即得完整前緣，不需要基因演算法。
+
+# 取捨列（係數正負混合）數量不超過此值時窮舉 2^k 組合，求得完整前緣
+EXACT_MAX_ITEMS = 16
+# 前緣解數少於此值時（例如係數全為非負，前緣只剩「全不選」），以次一層的解補足
+MIN_FRONT_SIZE = 5
+ENGINES = ("auto", "exact-enum", "weighted-sum", "nsga2")
+
+
+def nondominated(F: np.ndarray, block: int = 512) -> np.ndarray:
+    """
+    回傳非支配解的索引（重複的目標值只留一個）。
+    依字典序排序後分塊比對，只需與已確定的前緣及同一塊內的點比較，
+    記憶體為 O(block × 前緣大小)，可處理數萬個點。
+    """
+    _, first = np.unique(F, axis=0, return_index=True)
+    order = first[np.lexsort(F[first].T[::-1])]
+    kept = []
+    front = np.empty((0, F.shape[1]))
+    for start in range(0, len(order), block):
+        idx = order[start:start + block]
+        B = F[idx]
+        # dom[i, j]：j 支配 i
+        dom = (front[None] <= B[:, None]).all(axis=2) & (front[None] < B[:, None]).any(axis=2)
+        mask = ~dom.any(axis=1)
+        inner = (B[None] <= B[:, None]).all(axis=2) & (B[None] < B[:, None]).any(axis=2)
+        mask &= ~inner.any(axis=1)
+        kept.append(idx[mask])
+        front = np.vstack([front, B[mask]])
+    return np.concatenate(kept) if kept else np.empty(0, dtype=int)
+
+
+def _sign_split(C: np.ndarray):
+    """
+    C：(列數 × 目標數) 的係數。所有係數 <= 0 的列必選（選了只會更好），
+    所有係數 >= 0 的列必不選；其餘為需要取捨的列。
+    """
+    always = (C <= 0).all(axis=1) & (C < 0).any(axis=1)
+    tradeoff = np.flatnonzero((C < 0).any(axis=1) & (C > 0).any(axis=1))
+    return always, tradeoff
+
+
+def _expand(always: np.ndarray, tradeoff: np.ndarray, B: np.ndarray) -> np.ndarray:
+    X = np.repeat(always[None, :], len(B), axis=0)
+    X[:, tradeoff] = B
+    return X
+
+
+def _evaluate(X: np.ndarray, C: np.ndarray, robust: Optional[RobustCarbon] = None) -> np.ndarray:
+    F = X.astype(float) @ C
+    if robust is not None:
+        F[:, 1] = robust.quantile(X)
+    return F
+
+
+def _enumerate_front(C: np.ndarray, robust: Optional[RobustCarbon] = None):
+    always, tradeoff = _sign_split(C)
+    k = len(tradeoff)
+    B = ((np.arange(2 ** k)[:, None] >> np.arange(k)) & 1).astype(bool)
+    F = B @ C[tradeoff] + C[always].sum(axis=0)
+    if robust is not None:
+        F[:, 1] = robust.quantile(B, cols=tradeoff, base=robust.S[always].sum(axis=0))
+    keep = nondominated(F)
+    return _expand(always, tradeoff, B[keep]), F[keep]
+
+
+def _simplex_weights(n_obj: int, n_div: int) -> np.ndarray:
+    """目標權重格點（各權重為 1/n_div 的倍數且總和為 1）。"""
+    grid = np.stack(np.meshgrid(*[np.arange(n_div + 1)] * (n_obj - 1), indexing='ij'), -1)
+    grid = grid.reshape(-1, n_obj - 1)
+    grid = grid[grid.sum(axis=1) <= n_div]
+    return np.column_stack([grid, n_div - grid.sum(axis=1)]) / n_div
+
+
+def _weighted_select(C: np.ndarray, W: np.ndarray) -> np.ndarray:
+    """每組權重下的最佳選取：加權係數為負的列才選（線性無限制式，逐列獨立）。"""
+    # 依各目標的尺度正規化，權重才有意義
+    scale = np.abs(C).sum(axis=0)
+    Cn = C / np.where(scale > 0, scale, 1)
+    return (W @ Cn.T) < 0
+
+
+def _weighted_sum_front(C: np.ndarray, n_div: int = 12, robust: Optional[RobustCarbon] = None):
+    """
+    權重掃描（近似）：每組權重的解都在前緣上，但只能找到前緣的凸包（supported）部分，
+    凸包以內的非支配解（NSGA-II 可能找到的）會遺漏。
+    穩健碳排目標不是線性的，此時以 C 中的線性代理挑選，再以實際分位數評估。
+    """
+    X = _weighted_select(C, _simplex_weights(C.shape[1], n_div))
+    F = _evaluate(X, C, robust)
+    keep = nondominated(F)
+    return X[keep], F[keep]
+
+
+def _pad_front(X: np.ndarray, F: np.ndarray, C: np.ndarray, robust: Optional[RobustCarbon] = None,
+               size: int = MIN_FRONT_SIZE):
+    """
+    前緣解數不足 size 時，以「前緣解增減一列」為候選，依非支配層級（同層內取分散者）補到 size 個，
+    接在前緣之後（補上的解可能被前緣支配）。避免係數全為非負時只回傳一個全不選的解。
+    """
+    need = size - len(F)
+    n = C.shape[0]
+    if need <= 0 or n == 0 or len(F) == 0:
+        return X, F
+    # 翻轉一列時線性目標的變化量即 ±C；穩健目標先以線性代理排序，選定後再以分位數評估
+    base = X.astype(float) @ C
+    cand = (base[:, None, :] + np.where(X, -1.0, 1.0)[..., None] * C[None]).reshape(-1, C.shape[1])
+    _, first = np.unique(cand, axis=0, return_index=True)
+    known = {tuple(f) for f in base}
+    remaining = np.array([i for i in np.sort(first) if tuple(cand[i]) not in known], dtype=int)
+    picked = []
+    while len(picked) < need and len(remaining):
+        layer = remaining[nondominated(cand[remaining])]
+        picked += [int(layer[i]) for i in fronts.spread_indices(cand[layer], need - len(picked))]
+        remaining = np.setdiff1d(remaining, layer)
+    if not picked:
+        return X, F
+    src, row = np.divmod(np.asarray(picked), n)
+    extra = X[src].copy()
+    extra[np.arange(len(picked)), row] ^= True
+    return np.vstack([X, extra]), np.vstack([F, _evaluate(extra, C, robust)])
+
+
+def solve_front(df: pd.DataFrame, engine: str = "auto", weights=None, pop_size=50, n_gen=None,
+                n_seeds=None, workers=None, warm_start=True, seed=None,
+                carbon_quantile: Optional[float] = None, n_scenarios: Optional[int] = None):
+    """
+    求 ProcProblem 的 Pareto 前緣，回傳 (X, F, 使用的引擎)。
+    engine="auto"：取捨列 <= EXACT_MAX_ITEMS 時窮舉（exact-enum，完整前緣），否則以 NSGA-II 求解，
+    並把權重掃描的解（必在前緣上）併入初始族群與結果；
+    engine="weighted-sum" 只做權重掃描（近似，只含凸包上的解）；engine="nsga2" 只用 NSGA-II。
+    給定 weights（各目標權重）時只求該權重下的單一最佳解。
+    exact-enum / weighted-sum 的前緣少於 MIN_FRONT_SIZE 個解時以次一層的解補足（見 _pad_front）。
+    carbon_quantile（例如 0.9）時碳排目標改為 gwp_low / gwp_high 不確定性下總碳排的分位數（見 RobustCarbon），
+    情境數 n_scenarios 預設 OPT_SCENARIOS（200）。
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"未知的優化引擎：{engine}")
+    frame = _objective_frame(df)
+    C = np.column_stack(_coefficients(frame))
+    robust = None
+    if carbon_quantile is not None:
+        n_scenarios = n_scenarios or int(os.getenv("OPT_SCENARIOS", 200))
+        robust = RobustCarbon(df, carbon_quantile, n_scenarios)
+        C[:, 1] = robust.linear
+
+    if weights is not None:
+        W = np.asarray(weights, dtype=float).reshape(1, -1)
+        if W.shape[1] != C.shape[1]:
+            raise ValueError(f"weights 需有 {C.shape[1]} 個值")
+        X = _weighted_select(C, W)
+        return X, _evaluate(X, C, robust), "weighted-sum"
+    supported = None
+    if engine == "auto":
+        _, tradeoff = _sign_split(C)
+        if len(tradeoff) <= EXACT_MAX_ITEMS:
+            engine = "exact-enum"
         else:
-            items = []
+            engine = "nsga2"
+            supported = _weighted_sum_front(C, robust=robust)
+    if engine == "exact-enum":
+        X, F = _pad_front(*_enumerate_front(C, robust), C, robust)
+        return X, F, engine
+    if engine == "weighted-sum":
+        X, F = _pad_front(*_weighted_sum_front(C, robust=robust), C, robust)
+        return X, F, engine
+
+    cpus = os.cpu_count() or 1
+    n_seeds = n_seeds or int(os.getenv("OPT_SEEDS", "0")) or min(4, cpus)
+    workers = workers or int(os.getenv("OPT_WORKERS", "0")) or min(n_seeds, cpus)
+    base = seed if seed is not None else int(np.random.SeedSequence().entropy % (2 ** 31))
+    seeds = [base + i for i in range(n_seeds)]
+
+    keys = row_keys(df)
+    X0 = _front_store.seed(keys) if warm_start else None
+    if supported is not None:
+        X0 = supported[0] if X0 is None else np.vstack([X0, supported[0]])
+    X, F = _solve_front(frame, pop_size, n_gen, seeds, X0, workers, robust)
+    if supported is not None:
+        X, F = merge_fronts([(X, F), supported])
+    _front_store.put(keys, X)
+    return X, F, engine
+
 
+def _items(df: pd.DataFrame) -> list:
+    if "item" not in df.columns:
+        return [''] * len(df)
+    items_col = df["item"]
+    # 若出現多欄位 item，僅取第一欄
+    if hasattr(items_col, "columns"):
+        items_col = items_col.iloc[:, 0]
+    return [str(item) for item in items_col.tolist()]
 
-        total_cost = float(sel["unit_price"].sum()) if "unit_price" in sel.columns else 0.0
-        if "gwp" in sel.columns and "qty" in sel.columns:
-            total_carbon = float((sel["gwp"].fillna(0) * sel["qty"].fillna(0)).sum())
+
+def optimize_materials(df: pd.DataFrame, pop_size=50, n_gen=None, n_seeds=None,
+                       workers=None, warm_start=True, n_solutions=3, seed=None,
+                       engine="auto", weights=None, use_cache=True,
+                       carbon_quantile: Optional[float] = None, n_scenarios: Optional[int] = None):
+    """
+    求 Pareto 前緣（引擎見 solve_front）後回傳 n_solutions 個分散的代表解。
+    NSGA-II 以多個 seed 平行執行（各自在獨立行程）再合併前緣；
+    n_gen 為世代上限（預設 MAX_GEN，前緣收斂即提早停止）；
+    n_seeds / workers 預設取 OPT_SEEDS / OPT_WORKERS，未設定時依 CPU 核心數（seed 最多 4 個）。
+    warm_start=True 時，若先前優化過幾乎相同的表格（以列識別鍵比對），以其前緣作為初始族群。
+    前緣以輸入與參數的雜湊（front_id）快取，之後可用 fronts.query 篩選 / 挑選其他解。
+    carbon_quantile（例如 0.9）時以穩健碳排（P90）為目標，total_carbon 即為 OPT_SCENARIOS 組情境下的該分位數，
+    各代表解另附同一組情境的 carbon_p10 / carbon_p50 / carbon_p90（與 total_carbon 一致，
+    與 /uncertainty 以更多樣本估計的值會有些微差異）。
+    """
+    df = df.copy()
+    if 'eta' not in df.columns:
+        df['eta'] = 0
+    items = _items(df)
+    coef = np.column_stack(_coefficients(df))
+    params = {"engine": engine, "weights": weights, "pop_size": pop_size, "n_gen": n_gen}
+    if carbon_quantile is not None:
+        # 上下限也影響目標值，需納入 key
+        coef = np.column_stack([coef, *uncertainty.carbon_bounds(df)])
+        params.update(carbon_quantile=carbon_quantile,
+                      n_scenarios=n_scenarios or int(os.getenv("OPT_SCENARIOS", 200)))
+    key = fronts.front_key(items, coef, params)
+    cache = fronts.get_cache() if use_cache else None
+    front = cache.get(key) if cache is not None else None
+    cached = front is not None
+    metrics.ROWS.inc(len(df), stage="optimize")
+    if front is None:
+        with metrics.span("optimize"):
+            X, F, used = solve_front(df, engine=engine, weights=weights, pop_size=pop_size, n_gen=n_gen,
+                                     n_seeds=n_seeds, workers=workers, warm_start=warm_start, seed=seed,
+                                     carbon_quantile=carbon_quantile, n_scenarios=n_scenarios)
+        metrics.OPT_RUNS.inc(engine=used)
+        front = fronts.Front(key, X, F, items, used)
+        if cache is not None:
+            cache.put(front)
+
+    result = fronts.query(front, select="spread", k=n_solutions)
+    solutions = result["solutions"]
+    if carbon_quantile is not None and solutions:
+        # 與優化時相同的固定情境（同一輸入重建出相同的 S），分位數才會與 total_carbon 一致
+        robust = RobustCarbon(df, carbon_quantile, params["n_scenarios"])
+        X = front.X[[s["id"] for s in solutions]]
+        for sol, dist in zip(solutions, robust.summary(X)):
+            sol.update({f"carbon_{k}": v for k, v in dist.items()})
+    return {"solutions": solutions, "front_size": len(front), "engine": front.engine,
+            "front_id": key, "cached": cached}
+
+
+# =====================================================================
+# 多供應商 / 替代材料選擇：每個工程項目（group）從多個方案（option）中擇一，
+# 在預算與交期上限下同時最小化成本 / 碳 / 交期。
+
+class ChoiceMatrices:
+    """
+    將方案表轉成 (項目數 × 最大方案數) 的矩陣，方案數不足的位置以 inf 補齊
+    （決策變數上限 xu 會排除這些位置）。成本、碳排或交期缺值 / 非數字的方案同樣填 inf，
+    視為不可選（valid 為 False），避免缺資料的方案被當成免費或零交期。
+    方案表欄位：group、option，以及 cost 或 unit_price*qty、carbon 或 gwp*qty、lead_time（可省略）。
+    """
+
+    def __init__(self, alts: pd.DataFrame):
+        alts = alts.reset_index(drop=True)
+        qty = pd.to_numeric(alts['qty'], errors='coerce').fillna(1) if 'qty' in alts.columns else 1
+        if 'cost' in alts.columns:
+            cost = pd.to_numeric(alts['cost'], errors='coerce')
         else:
-            total_carbon = 0.0
-        total_eta = float(sel["eta"].sum()) if "eta" in sel.columns else 0.0
+            cost = pd.to_numeric(alts['unit_price'], errors='coerce') * qty
+        if 'carbon' in alts.columns:
+            carbon = pd.to_numeric(alts['carbon'], errors='coerce')
+        else:
+            carbon = pd.to_numeric(alts['gwp'], errors='coerce') * qty
+        lead = pd.to_numeric(alts['lead_time'], errors='coerce') if 'lead_time' in alts.columns \
+            else pd.Series(0.0, index=alts.index)
+
+        codes, self.groups = pd.factorize(alts['group'], sort=False)
+        slot = pd.Series(codes).groupby(codes).cumcount().to_numpy()
+        self.n_alts = np.bincount(codes)
+        shape = (len(self.groups), int(self.n_alts.max()))
+
+        def matrix(values, fill):
+            m = np.full(shape, fill, dtype=float)
+            m[codes, slot] = np.nan_to_num(np.asarray(values, dtype=float), nan=np.inf)
+            return m
 
+        self.cost = matrix(cost, np.inf)
+        self.carbon = matrix(carbon, np.inf)
+        self.lead = matrix(lead, np.inf)
+        self.valid = np.isfinite(self.cost) & np.isfinite(self.carbon) & np.isfinite(self.lead)
+        empty = ~self.valid.any(axis=1)
+        if empty.any():
+            names = ', '.join(str(g) for g in self.groups[empty][:5])
+            raise ValueError(f"以下項目沒有成本、碳排、交期皆完整的方案：{names}")
+        self.options = np.full(shape, None, dtype=object)
+        self.options[codes, slot] = alts['option'].to_numpy(dtype=object)
+        self.rows = np.arange(shape[0])
+
+    def take(self, m: np.ndarray, X: np.ndarray) -> np.ndarray:
+        """X: (pop, 項目數) 的方案索引，回傳每個個體各項目所選方案的值。"""
+        return m[self.rows, X]
+
+
+class ChoiceProblem(Problem):
+    def __init__(self, mats: ChoiceMatrices, budget: Optional[float] = None,
+                 max_lead_time: Optional[float] = None):
+        self.mats = mats
+        self.budget = budget
+        self.max_lead_time = max_lead_time
+        n_var = len(mats.groups)
+        n_constr = int(budget is not None) + int(max_lead_time is not None)
+        super().__init__(n_var=n_var,
+                         n_obj=3,
+                         n_ieq_constr=n_constr,
+                         xl=np.zeros(n_var),
+                         xu=(mats.n_alts - 1).astype(float),
+                         vtype=int)
+
+    def _evaluate(self, X, out, *args, **kwargs):
+        # 整個族群一次以 fancy indexing 計算，不逐個體迴圈
+        X = X.astype(int)
+        cost = self.mats.take(self.mats.cost, X).sum(axis=1)
+        carbon = self.mats.take(self.mats.carbon, X).sum(axis=1)
+        lead = self.mats.take(self.mats.lead, X).max(axis=1)
+        out["F"] = np.column_stack([cost, carbon, lead])
+        G = []
+        if self.budget is not None:
+            G.append(cost - self.budget)
+        if self.max_lead_time is not None:
+            G.append(lead - self.max_lead_time)
+        if G:
+            out["G"] = np.column_stack(G)
+
+
+class ChoiceRepair(Repair):
+    """
+    修復不可行的子代（整批向量化）：
+    1. 四捨五入並限制在各項目的方案範圍內；選到缺資料（不可選）方案的項目改選替代方案
+    2. 交期超過上限的項目，改選交期內碳排最低的方案
+    3. 超出預算的個體，依可省金額由大到小，將項目換成最便宜方案直到符合預算
+    """
+
+    def _do(self, problem, X, **kwargs):
+        mats = problem.mats
+        X = np.clip(np.round(X), 0, problem.xu).astype(int)
+
+        cap = problem.max_lead_time
+        lead_ok = mats.valid & (mats.lead <= cap) if cap is not None else mats.valid
+        has_ok = lead_ok.any(axis=1)
+        # 每個項目的替代方案：交期內碳排最低（沒有交期內方案則取可選方案中交期最短）
+        shortest = np.where(mats.valid, mats.lead, np.inf).argmin(axis=1)
+        greenest = np.where(has_ok, np.where(lead_ok, mats.carbon, np.inf).argmin(axis=1), shortest)
+        cheapest = np.where(has_ok, np.where(lead_ok, mats.cost, np.inf).argmin(axis=1), shortest)
+        X = np.where(mats.take(mats.valid, X), X, greenest[None, :])
+        if cap is not None:
+            late = mats.take(mats.lead, X) > cap
+            X = np.where(late, greenest[None, :], X)
+
+        if problem.budget is not None:
+            chosen = mats.take(mats.cost, X)
+            need = chosen.sum(axis=1) - problem.budget
+            over = need > 0
+            if over.any():
+                Xo = X[over]
+                saving = np.maximum(chosen[over] - mats.cost[mats.rows, cheapest][None, :], 0)
+                order = np.argsort(-saving, axis=1)
+                cum = np.cumsum(np.take_along_axis(saving, order, axis=1), axis=1)
+                n_swap = (cum < need[over][:, None]).sum(axis=1) + 1
+                swap_sorted = np.arange(X.shape[1])[None, :] < n_swap[:, None]
+                swap = np.zeros_like(swap_sorted)
+                np.put_along_axis(swap, order, swap_sorted, axis=1)
+                X[over] = np.where(swap, cheapest[None, :], Xo)
+        return X
+
+
+class ChoiceDuplicates(DuplicateElimination):
+    """
+    以整數解的位元組內容判斷重複（hash 比對），
+    取代預設的兩兩距離矩陣；項目數上千時 cdist 會成為主要成本。
+    """
+
+    def _do(self, pop, other, is_duplicate):
+        seen = set()
+        if other is not None:
+            seen.update(x.tobytes() for x in np.asarray(other.get("X")).astype(int))
+        for i, x in enumerate(np.asarray(pop.get("X")).astype(int)):
+            key = x.tobytes()
+            if key in seen:
+                is_duplicate[i] = True
+            else:
+                seen.add(key)
+        return is_duplicate
+
+
+def optimize_choices(alts: pd.DataFrame, budget: Optional[float] = None,
+                     max_lead_time: Optional[float] = None,
+                     pop_size=100, n_gen=200, seed=None, n_solutions=5):
+    """在預算 / 交期上限下，為每個項目選出一個方案；回傳前 n_solutions 個可行的非支配解。"""
+    mats = ChoiceMatrices(alts)
+    problem = ChoiceProblem(mats, budget=budget, max_lead_time=max_lead_time)
+    algorithm = NSGA2(
+        pop_size=pop_size,
+        sampling=IntegerRandomSampling(),
+        crossover=SBX(prob=0.9, eta=3.0, vtype=float),
+        mutation=PM(eta=3.0, vtype=float),
+        repair=ChoiceRepair(),
+        eliminate_duplicates=ChoiceDuplicates()
+    )
+    with metrics.span("optimize_choices"):
+        res = minimize(problem, algorithm, ('n_gen', n_gen), seed=seed, verbose=False)
+    metrics.OPT_GENERATIONS.observe(res.algorithm.n_gen, problem="choices")
+    metrics.OPT_RUNS.inc(engine="nsga2-choices")
+    if res.X is None:
+        return {"solutions": [], "feasible": False}
+
+    X = np.atleast_2d(res.X).astype(int)
+    F = np.atleast_2d(res.F)
+    sols = []
+    for i in np.argsort(F[:, 0])[:n_solutions]:
+        picks = mats.take(mats.options, X[i:i + 1])[0]
         sols.append({
             "id": int(i),
-            "items": items,
-            "total_cost": total_cost,
-            "total_carbon": total_carbon,
-            "total_eta": total_eta
+            "choices": {str(g): (None if o is None else str(o)) for g, o in zip(mats.groups, picks)},
+            "total_cost": float(F[i, 0]),
+            "total_carbon": float(F[i, 1]),
+            "lead_time": float(F[i, 2]),
         })
-
-    return {"solutions": list(sols)}
-
+    return {"solutions": sols, "feasible": True}
@@ -0,0 +1,122 @@
+import os
+import pandas as pd
+import pyarrow as pa
+from pyarrow import feather
+from pathlib import Path
+from typing import Optional
+
+# 整理後表格的固定欄位與型別；其餘欄位（remark、gwp_remark、section…）一律存為字串
+DATA_DIR = Path(os.getenv("DATA_DIR", "data"))
+TABLE_DIR = DATA_DIR / "tables"
+
+SCHEMA = pa.schema([
+    ("idx", pa.string()),
+    ("item", pa.string()),
+    ("unit", pa.string()),
+    ("qty", pa.float64()),
+    ("unit_price", pa.float64()),
+    ("amount", pa.float64()),
+    ("gwp", pa.float64()),
+    ("gwp_low", pa.float64()),
+    ("gwp_high", pa.float64()),
+    ("carbon", pa.float64()),
+])
+STRING_COLS = [f.name for f in SCHEMA if pa.types.is_string(f.type)]
+NUMERIC_COLS = [f.name for f in SCHEMA if pa.types.is_floating(f.type)]
+
+# 字串欄以 Arrow 為底層，讀檔時不必逐一建立 Python 字串
+STRING_DTYPE = pd.StringDtype("pyarrow")
+
+# 中文欄名 -> 英文欄名
+COLUMN_MAP = {
+    '項次': 'idx', '工程項目': 'item', '單位': 'unit', '數量': 'qty',
+    '單價': 'unit_price', '複價': 'amount', '說明': 'remark', '碳排放量': 'carbon',
+}
+
+
+def parse_number(s: pd.Series) -> pd.Series:
+    """字串數字（可含千分位，如 "2,982,201"）轉 float64，無法解析者為 NaN。"""
+    if pd.api.types.is_numeric_dtype(s) and not pd.api.types.is_bool_dtype(s):
+        return s.astype('float64')
+    txt = s.astype(STRING_DTYPE).str.replace(',', '', regex=False).str.strip()
+    return pd.to_numeric(txt, errors='coerce').astype('float64')
+
+
+def to_typed(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    轉成固定 schema：中文欄名改為英文（已有英文欄時捨棄中文重複欄）、
+    數字欄轉 float64、缺少的欄位補空值；carbon 缺值時以 gwp * qty 計算。
+    """
+    df = df.loc[:, ~df.columns.duplicated()]
+    drop = [zh for zh, en in COLUMN_MAP.items() if zh in df.columns and en in df.columns]
+    df = df.drop(columns=drop).rename(columns=COLUMN_MAP)
+
+    out = pd.DataFrame(index=range(len(df)))
+    for col in STRING_COLS:
+        out[col] = df[col].astype(STRING_DTYPE).to_numpy() if col in df.columns else pd.NA
+        out[col] = out[col].astype(STRING_DTYPE)
+    for col in NUMERIC_COLS:
+        out[col] = parse_number(df[col]).to_numpy() if col in df.columns else float('nan')
+    missing = out['carbon'].isna()
+    if missing.any():
+        out.loc[missing, 'carbon'] = out['gwp'][missing] * out['qty'][missing]
+    for col in df.columns:
+        if col not in out.columns:
+            out[col] = df[col].astype(STRING_DTYPE).to_numpy()
+            out[col] = out[col].astype(STRING_DTYPE)
+    return out
+
+
+def _arrow_schema(df: pd.DataFrame) -> pa.Schema:
+    extras = [pa.field(c, pa.string()) for c in df.columns if c not in SCHEMA.names]
+    return pa.schema(list(SCHEMA) + extras)
+
+
+def to_arrow(df: pd.DataFrame) -> pa.Table:
+    df = to_typed(df)
+    return pa.Table.from_pandas(df, schema=_arrow_schema(df), preserve_index=False)
+
+
+def table_path(name: str) -> Path:
+    # 只取檔名，避免路徑穿越
+    name = os.path.splitext(os.path.basename(name))[0]
+    if not name:
+        raise ValueError("表格名稱不可為空")
+    return TABLE_DIR / f"{name}.arrow"
+
+
+def write_table(df: pd.DataFrame, name: str) -> Path:
+    """以未壓縮 Feather（Arrow IPC 檔）保存，讀取時可直接 memory-map。"""
+    path = table_path(name)
+    path.parent.mkdir(exist_ok=True, parents=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    feather.write_feather(to_arrow(df), str(tmp), compression='uncompressed')
+    os.replace(tmp, path)
+    return path
+
+
+def read_arrow(name: str, memory_map: bool = True) -> Optional[pa.Table]:
+    path = table_path(name)
+    if not path.exists():
+        return None
+    return feather.read_table(str(path), memory_map=memory_map)
+
+
+def read_table(name: str, memory_map: bool = True) -> Optional[pd.DataFrame]:
+    table = read_arrow(name, memory_map=memory_map)
+    if table is None:
+        return None
+    return table.to_pandas(types_mapper={pa.string(): STRING_DTYPE, pa.large_string(): STRING_DTYPE}.get)
+
+
+def export_csv(df: pd.DataFrame, path) -> Path:
+    """CSV 僅作為匯出格式（UTF-8-SIG，Excel 可直接開啟）。"""
+    path = Path(path)
+    to_typed(df).to_csv(path, index=False, encoding="utf-8-sig")
+    return path
+
+
+def import_csv(path) -> pd.DataFrame:
+    """讀取舊版 CSV（如 data/aa_sorted.csv）並轉為固定 schema。"""
+    return to_typed(pd.read_csv(path, dtype=str, keep_default_na=False, encoding="utf-8-sig")
+                    .replace('', pd.NA))
@@ -0,0 +1,131 @@
+import numpy as np
+import pandas as pd
+from typing import Optional
+from modules import metrics
+
+# 主欄位（報價單明細表頭）
+DESIRED_COLS = ['項次', '工程項目', '單位', '數量', '單價', '複價', '說明']
+# 段落標題判斷用：除了工程項目以外的主欄位
+_NON_ITEM_COLS = [c for c in DESIRED_COLS if c != '工程項目']
+
+
+def _blank(df: pd.DataFrame) -> pd.DataFrame:
+    """None / NaN / 空字串 視為空白。"""
+    return df.isna() | (df == '')
+
+
+def _ffill_where(values: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    """逐欄向下延續 mask 為 True 的值，之前沒有值的位置為 None。"""
+    n = len(values)
+    idx = np.where(mask, np.arange(n)[:, None], -1)
+    idx = np.maximum.accumulate(idx, axis=0)
+    padded = np.vstack([values, np.full((1, values.shape[1]), None, dtype=object)])
+    return padded[idx, np.arange(values.shape[1])]
+
+
+def title_mask(df: pd.DataFrame) -> pd.Series:
+    """段落標題行：項次~說明全空，工程項目非空。"""
+    return (df[_NON_ITEM_COLS] == '').all(axis=1) & (df['工程項目'] != '')
+
+
+def header_mask(df: pd.DataFrame) -> pd.Series:
+    """重複出現的表頭行。"""
+    return df['項次'].astype(str).str.contains('項次', na=False)
+
+
+def summary_mask(df: pd.DataFrame) -> pd.Series:
+    """小計 / 合計行。"""
+    return (
+        df['工程項目'].astype(str).str.contains('小計|合計|subtotal|total', na=False) |
+        df['項次'].astype(str).str.contains('小計|合計|subtotal|total', na=False)
+    )
+
+
+def align_columns(raw: pd.DataFrame) -> pd.DataFrame:
+    """
+    將 PDF 解析後多出來的欄位（extras）依「次級標籤行」對齊回主欄位。
+    次級標籤行：主欄位全空，且 extras 中至少一格、且所有非空格都是主欄位名稱；
+    之後的資料列，extras 欄位的值會填入該標籤指向、且仍為空的主欄位（先出現的欄位優先）。
+    以欄為單位向量化，成本為 O(欄數)，不逐列處理。
+    """
+    raw = raw.reset_index(drop=True)
+    extras = [c for c in raw.columns if c not in DESIRED_COLS]
+    # 原表沒有的主欄位補空字串；原有欄位的缺值維持 None
+    main = raw.reindex(columns=DESIRED_COLS).astype(object)
+    main = main.where(main.notna(), None)
+    for c in DESIRED_COLS:
+        if c not in raw.columns:
+            main[c] = ''
+    ex = raw[extras].astype(object)
+
+    ex_blank = _blank(ex)
+    ex_is_label = ex.isin(DESIRED_COLS)
+    is_label = (
+        (ex_blank | ex_is_label).all(axis=1) &
+        ~ex_blank.all(axis=1) &
+        _blank(main).all(axis=1)
+    )
+
+    # 各 extras 欄位目前對應到哪個主欄位：在標籤行取值後向下延續
+    label_cells = ex_is_label.to_numpy(dtype=bool) & is_label.to_numpy(dtype=bool)[:, None]
+    mapping = pd.DataFrame(_ffill_where(ex.to_numpy(dtype=object), label_cells),
+                           index=ex.index, columns=extras)
+
+    out = main.copy()
+    for c in extras:
+        val = ex[c]
+        has_val = ~ex_blank[c] & ~is_label
+        for target in mapping[c].dropna().unique():
+            # 先出現的 extras 欄位優先，已填值的主欄位不覆蓋
+            cond = has_val & (mapping[c] == target) & (out[target].isna() | (out[target] == ''))
+            out[target] = out[target].where(~cond, val)
+
+    # 次級標籤行也保留一筆，將標籤顯示在對應欄位，用以呈現原始位置
+    if is_label.any():
+        label_rows = pd.DataFrame('', index=out.index[is_label], columns=DESIRED_COLS, dtype=object)
+        lab = ex[is_label]
+        for c in extras:
+            for target in lab[c][ex_is_label[c][is_label]].unique():
+                label_rows.loc[lab.index[lab[c] == target], target] = target
+        out.loc[is_label] = label_rows
+    return out
+
+
+def section_table(df: pd.DataFrame, with_section: bool = False) -> Optional[pd.DataFrame]:
+    """
+    依段落標題分段：每段以粗體標題行開頭，接著該段資料列（去除重複表頭）。
+    第一個標題之前的列不輸出；找不到任何標題時回傳 None。
+    with_section=True 時多一個 section 欄位，記錄每列所屬段落。
+    """
+    title = title_mask(df)
+    if not title.any():
+        return None
+    section_no = title.cumsum()
+    keep = (section_no > 0) & (title | (df['工程項目'] != '工程項目'))
+    out = df[keep].copy()
+    t = title[keep]
+    # 每列所屬段落的標題（依段落編號取值，標題本身為 None 也照樣保留）
+    section_titles = df['工程項目'].to_numpy(dtype=object)[title.to_numpy()]
+    titles = pd.Series(section_titles[section_no[keep].to_numpy() - 1], index=out.index)
+    out.loc[t, :] = ''
+    out.loc[t, '工程項目'] = '**' + titles[t].astype(str) + '**'
+    if with_section:
+        out['section'] = titles
+    return out.reset_index(drop=True)
+
+
+def align_and_section(raw: pd.DataFrame, with_section: bool = True) -> Optional[pd.DataFrame]:
+    """對齊欄位後分段，相當於 Dashboard 原本「整理表格」的處理。"""
+    with metrics.span("align"):
+        metrics.ROWS.inc(len(raw), stage="align")
+        return section_table(align_columns(raw), with_section=with_section)
+
+
+def clean_detail_rows(records) -> pd.DataFrame:
+    """/format_table：統一欄位後濾掉表頭、段落標題、小計與全空行，只留明細。"""
+    with metrics.span("format"):
+        df = pd.DataFrame(records).reindex(columns=DESIRED_COLS).fillna('')
+        metrics.ROWS.inc(len(df), stage="format")
+        is_not_empty = ~(df == '').all(axis=1)
+        mask = ~header_mask(df) & ~title_mask(df) & ~summary_mask(df) & is_not_empty
+        return df[mask].reset_index(drop=True)
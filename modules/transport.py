@@ -0,0 +1,90 @@
+import json
+import pandas as pd
+import pyarrow as pa
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from fastapi import HTTPException, Request
+from fastapi.responses import Response
+from modules import metrics
+
+# 表格傳輸格式：預設 JSON records，Content-Type / Accept 為 Arrow IPC stream 時改用二進位
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+# 附帶的非表格欄位（rows、sha256…）放在 schema metadata 的這個 key
+META_KEY = b"meta"
+
+
+def is_arrow(request: Request) -> bool:
+    return request.headers.get("content-type", "").split(";")[0].strip() == ARROW_STREAM
+
+
+def wants_arrow(request: Request) -> bool:
+    return ARROW_STREAM in request.headers.get("accept", "")
+
+
+def _column(col: pd.Series) -> pa.Array:
+    try:
+        return pa.array(col, from_pandas=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # 同一欄混有字串與數字（JSON 常見），統一轉字串
+        return pa.array(col.astype(object).where(col.notna(), None).map(
+            lambda v: v if v is None else str(v)), type=pa.string())
+
+
+def frame_to_arrow(df: pd.DataFrame, meta: Optional[Dict[str, Any]] = None) -> bytes:
+    # 合併 chunk，避免寫出大量各自壓縮的小 record batch
+    table = pa.Table.from_arrays([_column(df[c]) for c in df.columns],
+                                 names=[str(c) for c in df.columns]).combine_chunks()
+    if meta:
+        table = table.replace_schema_metadata(
+            {META_KEY: json.dumps(meta, ensure_ascii=False).encode("utf-8")})
+    sink = pa.BufferOutputStream()
+    # zstd 壓縮：重複字串多（單位、說明），1 萬列約為 JSON 的 1/6
+    options = pa.ipc.IpcWriteOptions(compression="zstd")
+    with pa.ipc.new_stream(sink, table.schema, options=options) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def arrow_to_frame(body: bytes) -> Tuple[pd.DataFrame, Dict[str, Any]]:
+    try:
+        table = pa.ipc.open_stream(body).read_all()
+    except (pa.ArrowInvalid, OSError) as e:
+        raise HTTPException(status_code=400, detail=f"Arrow 資料格式錯誤：{e}")
+    meta = (table.schema.metadata or {}).get(META_KEY)
+    df = table.to_pandas()
+    return df, (json.loads(meta) if meta else {})
+
+
+def json_records(df: pd.DataFrame) -> List[Dict[str, Any]]:
+    # NaN / <NA> 轉 None，以便 JSON 序列化
+    return df.astype(object).where(df.notna(), None).to_dict(orient="records")
+
+
+async def read_table(request: Request,
+                     extract: Callable[[Any], List[Dict[str, Any]]]) -> Tuple[pd.DataFrame, Dict[str, Any]]:
+    """
+    讀取請求中的表格，回傳 (DataFrame, 其他參數)。
+    Arrow：參數取自 schema metadata 與 query string；JSON：由 extract 從 body 取出 records。
+    """
+    if is_arrow(request):
+        body = await request.body()
+        with metrics.span("decode"):
+            df, meta = arrow_to_frame(body)
+        if df.empty:
+            raise HTTPException(status_code=400, detail="Empty data list")
+        return df, {**meta, **request.query_params}
+    body = await request.body()
+    with metrics.span("decode"):
+        try:
+            raw = json.loads(body)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid JSON body")
+        params = raw if isinstance(raw, dict) else {}
+        return pd.DataFrame(extract(raw)), {**params, **request.query_params}
+
+
+def respond_table(request: Request, df: Optional[pd.DataFrame], **meta) -> Any:
+    """依 Accept 回傳 Arrow IPC stream 或 JSON {"csv_data": [...], **meta}。"""
+    with metrics.span("encode"):
+        if wants_arrow(request) and df is not None:
+            return Response(content=frame_to_arrow(df, meta), media_type=ARROW_STREAM)
+        return {**meta, "csv_data": json_records(df) if df is not None else None}
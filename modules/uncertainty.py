@@ -0,0 +1,152 @@
+import os
+import numpy as np
+import pandas as pd
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from modules import metrics
+
+# 碳排不確定性：各列 GWP 以估算時取得的 (gwp_low, gwp, gwp_high) 視為三角分佈（眾數為 gwp），
+# 向量化蒙地卡羅分批抽出 (樣本數 × 列數) 的碳排矩陣，再加總成段落 / 全案 / 各方案的總碳排分佈。
+# 各列抽樣互相獨立；數量視為確定值。沒有上下限的列（手動填入的 gwp）不確定性為 0。
+#
+# 抽樣不走反函數（每個元素要 sqrt 與分支），改用 [0, 1] 上眾數為 c 的三角分佈等於
+# (1 - c)·min(U1, U2) + c·max(U1, U2)（Stein & Keblis 2009）：
+# 碳排 = low + a·min + b·max，其中 a = (high - low)(1 - c)、b = (high - low)c，
+# 每批只需兩次亂數、一次 min / max 與兩次乘加；low 的部分為常數，最後才加上。
+# 各列先依段落排序，段落合計以 np.add.reduceat 逐段加總（不需 列數 × 段落數 的矩陣），
+# 各方案合計則為一次矩陣乘法。
+
+DEFAULT_SAMPLES = 2000
+QUANTILES = (0.1, 0.5, 0.9)
+# 每批抽樣的（樣本 × 列）元素數上限；約 8 MB 一個陣列，留在快取內比一次抽完快
+CHUNK_ELEMENTS = 1_000_000
+
+
+def _numeric(df: pd.DataFrame, col: str) -> np.ndarray:
+    if col not in df.columns:
+        return np.full(len(df), np.nan)
+    return pd.to_numeric(df[col], errors='coerce').to_numpy(dtype=float)
+
+
+def carbon_bounds(df: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    各列碳排（gwp × qty）的 (下限, 眾數, 上限)。缺少上下限時以 gwp 代替；
+    模型偶爾給出 low > mean 之類的值，一律修正為 下限 <= 眾數 <= 上限。
+    """
+    qty = np.nan_to_num(_numeric(df, 'qty'))
+    mode = np.nan_to_num(_numeric(df, 'gwp'))
+    low, high = _numeric(df, 'gwp_low'), _numeric(df, 'gwp_high')
+    low = np.minimum(np.where(np.isnan(low), mode, low), mode)
+    high = np.maximum(np.where(np.isnan(high), mode, high), mode)
+    # 數量為負時上下限對調
+    a, b = low * qty, high * qty
+    return np.minimum(a, b), mode * qty, np.maximum(a, b)
+
+
+def triangular_ppf(u, low: np.ndarray, mode: np.ndarray, high: np.ndarray) -> np.ndarray:
+    """三角分佈的反函數（分位數）；u 可為 (樣本數 × 列數) 的均勻亂數或單一機率。寬度為 0 的列回傳眾數。"""
+    width = high - low
+    left, right = width * (mode - low), width * (high - mode)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        split = np.where(width > 0, (mode - low) / width, 1.0)
+    u = np.asarray(u, dtype=float)
+    return np.where(u < split, low + np.sqrt(u * left), high - np.sqrt((1 - u) * right))
+
+
+def _labels(q: float) -> str:
+    return f"p{round(q * 100):g}"
+
+
+def row_quantiles(df: pd.DataFrame, quantiles: Sequence[float] = QUANTILES) -> pd.DataFrame:
+    """各列碳排的分位數（carbon_p10 / carbon_p50 / carbon_p90）；單列分佈有解析解，不需抽樣。"""
+    low, mode, high = carbon_bounds(df)
+    out = triangular_ppf(np.asarray(quantiles, dtype=float)[:, None], low, mode, high)
+    return pd.DataFrame({f"carbon_{_labels(q)}": v for q, v in zip(quantiles, out)}, index=df.index)
+
+
+def _weights(low: np.ndarray, mode: np.ndarray, high: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """min / max 表示法的係數 (a, b)：碳排 = low + a·min(U1, U2) + b·max(U1, U2)。"""
+    return high - mode, mode - low
+
+
+def _minmax(rng: np.random.Generator, shape) -> Tuple[np.ndarray, np.ndarray]:
+    u1, u2 = rng.random(shape), rng.random(shape)
+    lo = np.minimum(u1, u2)
+    np.maximum(u1, u2, out=u1)
+    return lo, u1
+
+
+def sample(df: pd.DataFrame, n_samples: int, seed: Optional[int] = None) -> np.ndarray:
+    """(樣本數 × 列數) 的各列碳排抽樣。"""
+    low, mode, high = carbon_bounds(df)
+    a, b = _weights(low, mode, high)
+    lo, hi = _minmax(np.random.default_rng(seed), (n_samples, len(df)))
+    return low + a * lo + b * hi
+
+
+def _summary(totals: np.ndarray, quantiles: Sequence[float]) -> List[Dict[str, float]]:
+    """totals：(樣本數 × k)，回傳 k 個 {mean, p10, p50, p90}。"""
+    qs = np.quantile(totals, quantiles, axis=0)
+    mean = totals.mean(axis=0)
+    return [{"mean": float(mean[j]), **{_labels(q): float(qs[i, j]) for i, q in enumerate(quantiles)}}
+            for j in range(totals.shape[1])]
+
+
+def simulate(df: pd.DataFrame, n_samples: Optional[int] = None, seed: Optional[int] = None,
+             groups=None, solutions: Optional[np.ndarray] = None,
+             quantiles: Sequence[float] = QUANTILES) -> Dict[str, Any]:
+    """
+    蒙地卡羅估計碳排分佈，回傳：
+    - rows：各列分位數（DataFrame，解析解）
+    - total：全案總碳排 {mean, p10, p50, p90}
+    - sections：groups（各列所屬段落，例如 section 欄）各組的總碳排分佈
+    - solutions：solutions（方案數 × 列數 的選取遮罩）各方案所選列的總碳排分佈
+    樣本分批產生（每批不超過 CHUNK_ELEMENTS 個元素），每批以 reduceat 加總各段落、以一次矩陣乘法加總各方案。
+    """
+    n_samples = int(n_samples or os.getenv("MC_SAMPLES", DEFAULT_SAMPLES))
+    with metrics.span("uncertainty"):
+        metrics.ROWS.inc(len(df), stage="uncertainty")
+        low, mode, high = carbon_bounds(df)
+        n = len(df)
+        # 依段落排序；沒有 groups 時全部視為同一段
+        codes = np.zeros(n, dtype=int)
+        labels = []
+        if groups is not None:
+            codes, labels = pd.factorize(pd.Series(groups, index=df.index).fillna(''), sort=False)
+        order = np.argsort(codes, kind='stable')
+        starts = np.flatnonzero(np.r_[True, np.diff(codes[order]) != 0]) if n else np.zeros(0, dtype=int)
+        low, mode, high = low[order], mode[order], high[order]
+        a, b = _weights(low, mode, high)
+        S = np.zeros((n, 0))
+        if solutions is not None:
+            S = np.atleast_2d(np.asarray(solutions, dtype=float))
+            if S.shape[1] != n:
+                raise ValueError(f"solutions 需為 (方案數 × {n}) 的選取遮罩")
+            S = S[:, order].T
+
+        rng = np.random.default_rng(seed)
+        step = max(1, CHUNK_ELEMENTS // max(n, 1))
+        group_totals = np.empty((n_samples, len(starts)))
+        sol_totals = np.empty((n_samples, S.shape[1]))
+        for start in range(0, n_samples, step):
+            lo, hi = _minmax(rng, (min(step, n_samples - start), n))
+            lo *= a
+            hi *= b
+            lo += hi
+            rows = slice(start, start + len(lo))
+            if n:
+                group_totals[rows] = np.add.reduceat(lo, starts, axis=1)
+            sol_totals[rows] = lo @ S
+        group_totals += np.add.reduceat(low, starts) if n else 0
+        sol_totals += low @ S
+        total = group_totals.sum(axis=1, keepdims=True)
+        stats = _summary(np.hstack([total, group_totals if len(labels) else total[:, :0], sol_totals]),
+                         quantiles)
+
+    sections = [{"section": str(label), **s} for label, s in zip(labels, stats[1:1 + len(labels)])]
+    return {
+        "samples": n_samples,
+        "rows": row_quantiles(df, quantiles),
+        "total": stats[0],
+        "sections": sections,
+        "solutions": stats[1 + len(labels):],
+    }
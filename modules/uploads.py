@@ -0,0 +1,59 @@
+import os, hashlib
+import pandas as pd
+from pathlib import Path
+from typing import Optional, Tuple
+
+# 上傳檔以內容 SHA-256 命名，與原始檔名無關（也避開非 ASCII 檔名問題）
+DATA_DIR = Path(os.getenv("DATA_DIR", "data"))
+UPLOAD_DIR = DATA_DIR / "uploads"
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _valid_sha(sha: str) -> bool:
+    return len(sha) == 64 and all(c in "0123456789abcdef" for c in sha)
+
+
+def pdf_path(sha: str) -> Path:
+    return UPLOAD_DIR / f"{sha}.pdf"
+
+
+def parsed_path(sha: str) -> Path:
+    return UPLOAD_DIR / f"{sha}.parquet"
+
+
+def _atomic_write(path: Path, write) -> None:
+    # 先寫暫存檔再 rename，同時上傳同一份檔案時不會讀到寫一半的結果
+    path.parent.mkdir(exist_ok=True, parents=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    write(tmp)
+    os.replace(tmp, path)
+
+
+def store_pdf(data: bytes) -> Tuple[str, Path]:
+    """保存上傳的 PDF（已存在則略過），回傳 (sha256, 路徑)。"""
+    sha = content_hash(data)
+    path = pdf_path(sha)
+    if not path.exists():
+        _atomic_write(path, lambda p: p.write_bytes(data))
+    return sha, path
+
+
+def load_parsed(sha: str) -> Optional[pd.DataFrame]:
+    """已解析過則直接讀回 Parquet，否則回傳 None。"""
+    if not _valid_sha(sha):
+        return None
+    path = parsed_path(sha)
+    if not path.exists():
+        return None
+    df = pd.read_parquet(path)
+    # 與 ocr.pdf_to_dataframe 一致：缺值一律為 None
+    return df.astype(object).where(df.notna(), None)
+
+
+def save_parsed(sha: str, df: pd.DataFrame) -> Path:
+    path = parsed_path(sha)
+    _atomic_write(path, lambda p: df.to_parquet(p, index=False))
+    return path
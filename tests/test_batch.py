@@ -0,0 +1,37 @@
+import pytest
+
+from benchmarks import synthetic
+
+
+@pytest.fixture
+def batch(tmp_path, monkeypatch):
+    monkeypatch.setenv("LLM_BACKEND", "fake")
+    monkeypatch.setenv("LLM_RPS", "0")
+    monkeypatch.setenv("LLM_FAKE_LATENCY", "0")
+    monkeypatch.setenv("GWP_CACHE", "0")
+    from modules import batch, storage, uploads
+    # 各模組在 import 時已讀取 DATA_DIR，改為指向暫存目錄
+    monkeypatch.setattr(batch, "BATCH_DIR", tmp_path / "batches")
+    monkeypatch.setattr(storage, "TABLE_DIR", tmp_path / "tables")
+    monkeypatch.setattr(uploads, "UPLOAD_DIR", tmp_path / "uploads")
+    return batch
+
+
+def test_batch_name_replaces_dots():
+    from modules import batch
+    assert batch.batch_name("2024.06") == "2024_06"
+    assert batch.batch_name("../a/b.c") == "b_c"
+    assert batch.batch_name(None).startswith("batch_")
+
+
+def test_cli_name_with_dot_exports_csv(batch, tmp_path):
+    src = tmp_path / "in"
+    src.mkdir()
+    synthetic.boq_pdf(src / "a.b.pdf", 30)
+    out = tmp_path / "out.csv"
+    with pytest.raises(SystemExit) as exit_info:
+        batch.main([str(src), "--name", "2024.06", "--csv", str(out), "--parse-workers", "1"])
+    assert exit_info.value.code == 0
+    assert out.read_text(encoding="utf-8-sig").count("\n") == 31
+    assert (tmp_path / "batches" / "2024_06" / "summary.parquet").exists()
+    assert not (tmp_path / "batches" / "2024.06").exists()
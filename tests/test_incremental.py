@@ -0,0 +1,46 @@
+import asyncio
+
+import pandas as pd
+import pytest
+
+
+@pytest.fixture
+def project(monkeypatch):
+    monkeypatch.setenv("LLM_BACKEND", "fake")
+    monkeypatch.setenv("LLM_RPS", "0")
+    monkeypatch.setenv("LLM_FAKE_LATENCY", "0")
+    monkeypatch.setenv("GWP_CACHE", "0")
+    from modules import incremental
+    return incremental.Project()
+
+
+def _table():
+    return pd.DataFrame({
+        "item": ["預拌混凝土", "鋼筋", "模板"],
+        "unit": ["m3", "t", "m2"],
+        "qty": [10, 2, 30],
+    })
+
+
+def test_patch_chinese_column_then_put_reestimates_nothing(project, monkeypatch):
+    from modules import openai_helper
+    assert asyncio.run(project.load(_table()))["estimated"] == 3
+    asyncio.run(project.edit(updates=[{"row": 0, "數量": 12}]))
+    assert "數量" not in project.df.columns
+    assert project.df.at[0, "qty"] == 12
+
+    calls = []
+    real = openai_helper.estimate_rows
+
+    async def counting(rows, progress=None):
+        calls.append(len(rows))
+        return await real(rows, progress=progress)
+
+    monkeypatch.setattr(openai_helper, "estimate_rows", counting)
+    df = _table()
+    df.at[0, "qty"] = 12
+    total = project.total
+    result = asyncio.run(project.load(df))
+    assert result == {"changed": [], "estimated": 0}
+    assert calls == []
+    assert project.total == pytest.approx(total)
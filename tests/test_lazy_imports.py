@@ -0,0 +1,25 @@
+import os
+import statistics
+from pathlib import Path
+
+from benchmarks.bench_import import run_once
+
+ROOT = Path(__file__).resolve().parents[1]
+# 啟動時間預算（秒，中位數）；本機約 0.7 秒，留足 CI 機器的餘裕。可用 IMPORT_BUDGET 調整
+IMPORT_BUDGET = float(os.getenv("IMPORT_BUDGET", 3.0))
+
+
+def _env(tmp_path):
+    return {**os.environ, "PYTHONPATH": str(ROOT), "DATA_DIR": str(tmp_path)}
+
+
+def test_app_import_does_not_load_heavy_modules(tmp_path):
+    # 每次都在新的行程中 import，避免測試行程內已載入的模組干擾
+    assert run_once(_env(tmp_path))["loaded"] == []
+
+
+def test_app_import_time_within_budget(tmp_path):
+    env = _env(tmp_path)
+    run_once(env)  # 先產生 .pyc，量測不含編譯時間
+    median = statistics.median(run_once(env)["seconds"] for _ in range(3))
+    assert median < IMPORT_BUDGET, f"import app.main 中位數 {median:.2f} 秒，超過預算 {IMPORT_BUDGET} 秒"
@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from modules import optimizer
+
+
+def _alternatives():
+    # 每個項目的 "blank" 方案碳排最低、交期最短，但成本空白；缺資料的方案不可被選中
+    rows = []
+    for g in ('混凝土', '鋼筋', '模板'):
+        rows += [
+            {'group': g, 'option': 'blank', 'cost': None, 'carbon': 1.0, 'lead_time': 1},
+            {'group': g, 'option': 'cheap', 'cost': 100.0, 'carbon': 50.0, 'lead_time': 10},
+            {'group': g, 'option': 'green', 'cost': 200.0, 'carbon': 20.0, 'lead_time': 20},
+        ]
+    return pd.DataFrame(rows)
+
+
+def test_missing_values_are_unavailable():
+    mats = optimizer.ChoiceMatrices(_alternatives())
+    assert np.isinf(mats.cost[:, 0]).all()
+    assert not mats.valid[:, 0].any()
+    assert mats.valid[:, 1:].all()
+
+
+@pytest.mark.parametrize('budget, max_lead_time', [(None, None), (450.0, None), (None, 15.0)])
+def test_blank_cost_is_never_chosen(budget, max_lead_time):
+    res = optimizer.optimize_choices(_alternatives(), budget=budget, max_lead_time=max_lead_time,
+                                     pop_size=20, n_gen=20, seed=1, n_solutions=20)
+    assert res['feasible'] and res['solutions']
+    for sol in res['solutions']:
+        assert 'blank' not in sol['choices'].values()
+        assert np.isfinite([sol['total_cost'], sol['total_carbon'], sol['lead_time']]).all()
+
+
+def test_group_without_complete_alternative_is_rejected():
+    alts = pd.DataFrame([
+        {'group': '混凝土', 'option': 'a', 'cost': 100.0, 'carbon': 'n/a'},
+        {'group': '鋼筋', 'option': 'b', 'cost': 100.0, 'carbon': 10.0},
+    ])
+    with pytest.raises(ValueError, match='混凝土'):
+        optimizer.optimize_choices(alts)
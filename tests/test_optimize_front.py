@@ -0,0 +1,33 @@
+import numpy as np
+import pandas as pd
+
+from modules import optimizer
+
+
+def _table(n, gwp_low, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'item': [f'項目 {i}' for i in range(n)],
+        'unit_price': rng.uniform(10, 100, n),
+        'gwp': rng.uniform(gwp_low, 10, n),
+        'qty': rng.integers(1, 10, n),
+    })
+
+
+def test_degenerate_front_still_returns_several_solutions():
+    # 係數全為非負：真正的前緣只有「全不選」，其餘以次一層的解補足
+    res = optimizer.optimize_materials(_table(30, 1), use_cache=False)
+    assert res['engine'] == 'exact-enum'
+    assert len(res['solutions']) == 3
+    assert res['solutions'][0]['items'] == []
+    assert all(len(s['items']) == 1 for s in res['solutions'][1:])
+
+
+def test_weighted_sum_points_lie_on_exact_front():
+    df = _table(12, -10, seed=1)
+    _, F_exact, engine = optimizer.solve_front(df, engine='exact-enum')
+    _, F_ws = optimizer._weighted_sum_front(np.column_stack(optimizer._coefficients(df)))
+    assert engine == 'exact-enum'
+    assert len(F_ws) <= len(F_exact)
+    for f in F_ws:
+        assert np.isclose(F_exact, f).all(axis=1).any()